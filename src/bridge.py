@@ -10,34 +10,33 @@
   Copyright (c) 2015 Bronislav Robenek <brona@robenek.me>
 """
 
-import re
-import subprocess
 import sys
 
 from iproute2mac import *
 
 
 # Decode ifconfig output
+@without_gc
 def parse_ifconfig(res):
     links = []
     count = 1
 
-    for r in res.split("\n"):
-        if re.match(r"^\w+:", r):
+    for r in output_lines(res):
+        if regex(r"^\w+:").match(r):
             if count > 1:
                 links.append(link)
-            (ifname, flags, mtu, ifindex) = re.findall(
-                r"^(\w+): flags=[\da-f]+<(.*)>.+mtu (\d+).+index (\d+)", r
-            )[0]
-            flags = flags.split(",")
-            link = {
-                "ifindex": int(ifindex),
-                "ifname": ifname,
-                "flags": flags,
-                "mtu": int(mtu),
-                "operstate": "UNKNOWN",
-                "link_type": "unknown",
-            }
+            (ifname, flags, mtu, ifindex) = regex(
+                r"^(\w+): flags=[\da-f]+<(.*)>.+mtu (\d+).+index (\d+)"
+            ).findall(r)[0]
+            flags = [sys.intern(f) for f in flags.split(",")]
+            link = Link(
+                ifindex=int(ifindex),
+                ifname=sys.intern(ifname),
+                flags=flags,
+                mtu=int(mtu),
+                operstate="UNKNOWN",
+                link_type="unknown",
+            )
             if "LOOPBACK" in flags:
                 link["link_type"] = "loopback"
                 link["address"] = "00:00:00:00:00:00"
@@ -46,20 +45,19 @@ def parse_ifconfig(res):
                 link["link_type"] = "none"
             count = count + 1
         else:
-            if re.match(r"^\s+ether ", r):
+            if regex(r"^\s+ether ").match(r):
                 link["link_type"] = "ether"
-                link["address"] = re.findall(
-                    r"(\w\w:\w\w:\w\w:\w\w:\w\w:\w\w)", r
-                )[0]
+                link["address"] = regex(
+                    r"(\w\w:\w\w:\w\w:\w\w:\w\w:\w\w)"
+                ).findall(r)[0]
                 link["broadcast"] = "ff:ff:ff:ff:ff:ff"
-            elif match := re.search(r"^\s+status: (\w+)", r):
+            elif match := regex(r"^\s+status: (\w+)").search(r):
                 status = match.group(1)
                 link["operstate"] = "UP" if status == "active" else "DOWN"
-            elif re.match(r"^\s+maxage ", r):
-                (maxage, holdcnt, proto, maxaddr, timeout) = re.findall(
-                    r"maxage (\d+) holdcnt (\d+) proto (\w+) maxaddr (\d+) timeout (\d+)",
-                    r,
-                )[0]
+            elif regex(r"^\s+maxage ").match(r):
+                (maxage, holdcnt, proto, maxaddr, timeout) = regex(
+                    r"maxage (\d+) holdcnt (\d+) proto (\w+) maxaddr (\d+) timeout (\d+)"
+                ).findall(r)[0]
                 link["bridge"] = {
                     "maxage": int(maxage),
                     "holdcnt": int(holdcnt),
@@ -68,10 +66,10 @@ def parse_ifconfig(res):
                     "timeout": int(timeout),
                     "members": [],
                 }
-            elif re.match(r"^\s+member: ", r):
-                (ifname, flags) = re.findall(
-                    r"member: (\w+) flags=[\da-f]+<(.*)>", r
-                )[0]
+            elif regex(r"^\s+member: ").match(r):
+                (ifname, flags) = regex(
+                    r"member: (\w+) flags=[\da-f]+<(.*)>"
+                ).findall(r)[0]
                 flags = flags.split(",")
                 link["bridge"]["members"].append(
                     {
@@ -79,11 +77,10 @@ def parse_ifconfig(res):
                         "flags": flags,
                     }
                 )
-            elif re.match(r"^\s+ifmaxaddr ", r):
-                (ifmaxaddr, ifindex, priority, cost) = re.findall(
-                    r"ifmaxaddr (\d+) port (\d+) priority (\d+) path cost (\d+)",
-                    r,
-                )[0]
+            elif regex(r"^\s+ifmaxaddr ").match(r):
+                (ifmaxaddr, ifindex, priority, cost) = regex(
+                    r"ifmaxaddr (\d+) port (\d+) priority (\d+) path cost (\d+)"
+                ).findall(r)[0]
                 link["bridge"]["members"][-1].update(
                     {
                         "ifmaxaddr": int(ifmaxaddr),
@@ -99,6 +96,52 @@ def parse_ifconfig(res):
     return links
 
 
+BRIDGE_IFCONFIG_CMD = [IFCONFIG, "-v", "-a"]
+
+
+# Members of the bridges in links, only of dev if set
+def bridge_members(links, dev=None):
+    bridges = []
+    for master in [l for l in links if "bridge" in l]:
+        for slave in master["bridge"].get("members", []):
+            if dev and slave["ifname"] != dev:
+                continue
+            link = [l for l in links if l["ifname"] == slave["ifname"]][0]
+            bridges.append(
+                BridgeLink(
+                    ifindex=slave["ifindex"],
+                    ifname=slave["ifname"],
+                    flags=link["flags"],
+                    mtu=link["mtu"],
+                    master=master["ifname"],
+                    state="forwarding",  # FIXME: how to ensure it is forwarding?
+                    priority=slave["priority"],
+                    cost=slave["cost"],
+                )
+            )
+    return bridges
+
+
+# Bridge members from ifconfig, see bridge_links() of iproute2mac
+def get_bridge_links(dev=None):
+    res = check_result(run_cmd(BRIDGE_IFCONFIG_CMD))
+    profile_mark("collect")
+
+    links = parse_ifconfig(res.stdout)
+    profile_mark("parse", rows=len(links), size=len(res.stdout))
+
+    bridges = bridge_members(links, dev)
+    profile_mark("filter", rows=len(bridges))
+    return bridges
+
+
+# get_bridge_links without blocking, see bridge_links_async() of iproute2mac
+async def get_bridge_links_async(dev=None):
+    (res, links) = await run_cmd_async(BRIDGE_IFCONFIG_CMD, parse_ifconfig)
+    check_result(res)
+    return bridge_members(links, dev)
+
+
 # Help
 def do_help(
     argv=None, json_print=None, pretty_json=None, color=None, oneline=None
@@ -106,8 +149,9 @@ def do_help(
     perror("Usage: bridge [ OPTIONS ] OBJECT { COMMAND | help }")
     perror("where  OBJECT := { link }")
     perror(
-        "       OPTIONS := { -V[ersion] | -j[son] | -p[retty] | -c[olor] | -o[neline] }"
+        "       OPTIONS := { -V[ersion] | -j[son] | -p[retty] | -c[olor] | -o[neline] |"
     )
+    perror("                    -profile | -input FILE }")
     perror(HELP_ADDENDUM)
     exit(255)
 
@@ -146,44 +190,22 @@ def do_link_show(argv, json_print, pretty_json, color, oneline):
     else:
         dev = None
 
-    res = subprocess.run(
-        [IFCONFIG, "-v", "-a"], capture_output=True, text=True
-    )
-    if res.returncode != 0:
-        out = (res.stderr + res.stdout).strip()
-        if out:
-            perror(out)
+    try:
+        bridges = get_bridge_links(dev)
+    except IPRoute2MacError as e:
+        perror(str(e))
         return False
 
-    bridges = []
-    links = parse_ifconfig(res.stdout)
-
-    for master in [l for l in links if "bridge" in l]:
-        for slave in master["bridge"].get("members", []):
-            if dev and slave["ifname"] != dev:
-                continue
-            link = [l for l in links if l["ifname"] == slave["ifname"]][0]
-            bridges.append(
-                {
-                    "ifindex": slave["ifindex"],
-                    "ifname": slave["ifname"],
-                    "flags": link["flags"],
-                    "mtu": link["mtu"],
-                    "master": master["ifname"],
-                    "state": "forwarding",  # FIXME: how to ensure it is forwarding?
-                    "priority": slave["priority"],
-                    "cost": slave["cost"],
-                }
-            )
-
     if json_print:
         return json_dump(bridges, pretty_json)
 
+    out = Renderer(color)
+
     lines = [
         "%d: %s: <%s> mtu %d master %s state %s priority %d cost %d"
         % (
             b["ifindex"],
-            colorize_ifname(color, b["ifname"]),
+            out.ifname(b["ifname"]),
             ",".join(b["flags"]),
             b["mtu"],
             b["master"],
@@ -196,8 +218,9 @@ def do_link_show(argv, json_print, pretty_json, color, oneline):
 
     # oneline doesn't do anything in this case
     for l in lines:
-        print(l)
+        out.line(l)
 
+    out.flush()
     return True
 
 
@@ -241,6 +264,12 @@ def main(argv):
                 )
                 exit(255)
             argv.pop(0)
+        elif strict_startswith("-input", argv[0]):
+            opt = argv.pop(0)
+            if not argv:
+                perror('Option "{}" requires a file or -.'.format(opt))
+                exit(255)
+            input_enable(argv.pop(0))
         elif strict_startswith("-json", argv[0]):
             json_print = True
             argv.pop(0)
@@ -250,6 +279,9 @@ def main(argv):
         elif strict_startswith("-oneline", argv[0]):
             oneline = True
             argv.pop(0)
+        elif strict_startswith("-profile", argv[0]):
+            profile_enable("bridge")
+            argv.pop(0)
         elif strict_startswith("-Version", argv[0]):
             print("iproute2mac, v" + VERSION)
             exit(0)
@@ -280,4 +312,6 @@ def main(argv):
 
 
 if __name__ == "__main__":
+    profile_from_env("bridge")
+    daemon_forward("bridge", sys.argv[1:])
     main(sys.argv[1:])
@@ -10,38 +10,37 @@
   Copyright (c) 2015 Bronislav Robenek <brona@robenek.me>
 """
 
-import ipaddress
 import os
-import re
-import socket
-import subprocess
 import sys
+import time
+from functools import partial
 from operator import itemgetter
 
 from iproute2mac import *
 
 
 # Decode ifconfig output
+@without_gc
 def parse_ifconfig(res, af, address):
     links = []
     count = 1
 
-    for r in res.split("\n"):
-        if re.match(r"^\w+:", r):
+    for r in output_lines(res):
+        if regex(r"^\w+:").match(r):
             if count > 1:
                 links.append(link)
-            (ifname, flags, mtu, ifindex) = re.findall(
-                r"^(\w+): flags=[\da-f]+<(.*)>.+mtu (\d+).+index (\d+)", r
-            )[0]
-            flags = flags.split(",")
-            link = {
-                "ifindex": int(ifindex),
-                "ifname": ifname,
-                "flags": flags,
-                "mtu": int(mtu),
-                "operstate": "UNKNOWN",
-                "link_type": "unknown",
-            }
+            (ifname, flags, mtu, ifindex) = regex(
+                r"^(\w+): flags=[\da-f]+<(.*)>.+mtu (\d+).+index (\d+)"
+            ).findall(r)[0]
+            flags = [sys.intern(f) for f in flags.split(",")]
+            link = Link(
+                ifindex=int(ifindex),
+                ifname=sys.intern(ifname),
+                flags=flags,
+                mtu=int(mtu),
+                operstate="UNKNOWN",
+                link_type="unknown",
+            )
             if "LOOPBACK" in flags:
                 link["link_type"] = "loopback"
                 link["address"] = "00:00:00:00:00:00"
@@ -50,43 +49,41 @@ def parse_ifconfig(res, af, address):
                 link["link_type"] = "none"
             count = count + 1
         else:
-            if re.match(r"^\s+ether ", r):
+            if regex(r"^\s+ether ").match(r):
                 link["link_type"] = "ether"
-                link["address"] = re.findall(
-                    r"(\w\w:\w\w:\w\w:\w\w:\w\w:\w\w)", r
-                )[0]
+                link["address"] = regex(
+                    r"(\w\w:\w\w:\w\w:\w\w:\w\w:\w\w)"
+                ).findall(r)[0]
                 link["broadcast"] = "ff:ff:ff:ff:ff:ff"
-            elif address and re.match(r"^\s+inet ", r) and af != 6:
-                (local, peer, netmask) = re.findall(
-                    r"inet (\d+\.\d+\.\d+\.\d+)(?: --> (\d+\.\d+\.\d+\.\d+))? netmask (0x[\da-f]+)",
-                    r,
-                )[0]
-                addr = {
-                    "family": "inet",
-                    "local": local,
-                    "prefixlen": netmask_to_length(netmask),
-                }
+            elif address and regex(r"^\s+inet ").match(r) and af != 6:
+                (local, peer, netmask) = regex(
+                    r"inet (\d+\.\d+\.\d+\.\d+)(?: --> (\d+\.\d+\.\d+\.\d+))? netmask (0x[\da-f]+)"
+                ).findall(r)[0]
+                addr = Address(
+                    family="inet",
+                    local=local,
+                    prefixlen=netmask_to_length(netmask),
+                )
                 if peer:
                     addr["address"] = peer
-                if re.match(r"^.*broadcast", r):
-                    addr["broadcast"] = re.findall(
-                        r"broadcast (\d+\.\d+\.\d+\.\d+)", r
-                    )[0]
+                if regex(r"^.*broadcast").match(r):
+                    addr["broadcast"] = regex(
+                        r"broadcast (\d+\.\d+\.\d+\.\d+)"
+                    ).findall(r)[0]
                 link["addr_info"] = link.get("addr_info", []) + [addr]
-            elif address and re.match(r"^\s+inet6 ", r) and af != 4:
-                (local, peer, prefixlen) = re.findall(
-                    r"inet6 ([\da-f:]*:[\da-f:]+)%*\w*(?: --> ([\da-f:]*:[\da-f:]+)%*\w*)? prefixlen (\d+)",
-                    r,
-                )[0]
-                addr = {
-                    "family": "inet6",
-                    "local": local,
-                    "prefixlen": int(prefixlen),
-                }
+            elif address and regex(r"^\s+inet6 ").match(r) and af != 4:
+                (local, peer, prefixlen) = regex(
+                    r"inet6 ([\da-f:]*:[\da-f:]+)%*\w*(?: --> ([\da-f:]*:[\da-f:]+)%*\w*)? prefixlen (\d+)"
+                ).findall(r)[0]
+                addr = Address(
+                    family="inet6",
+                    local=local,
+                    prefixlen=int(prefixlen),
+                )
                 if peer:
                     addr["address"] = peer
                 link["addr_info"] = link.get("addr_info", []) + [addr]
-            elif match := re.search(r"^\s+status: (\w+)", r):
+            elif match := regex(r"^\s+status: (\w+)").search(r):
                 status = match.group(1)
                 link["operstate"] = "UP" if status == "active" else "DOWN"
 
@@ -96,49 +93,204 @@ def parse_ifconfig(res, af, address):
     return sorted(links, key=itemgetter("ifindex"))
 
 
-def link_addr_show(
-    argv, af, json_print, pretty_json, color, address, brief, oneline
-):
+# Decode netstat -ibdn output into per-interface counters keyed by ifname
+def parse_netstat_ib(res):
+    stats = {}
+    lines = iter(output_lines(res))
+    header = next(lines, "").split()
+    if "Ipkts" not in header:
+        return stats
+    # Address column may be empty, counters are always the trailing columns
+    counters = header[header.index("Ipkts") :]
+
+    for r in lines:
+        cols = r.split()
+        if len(cols) < len(counters) + 3 or not cols[2].startswith("<Link#"):
+            continue
+        values = dict(zip(counters, cols[-len(counters) :]))
+        rx = {
+            "bytes": int(values.get("Ibytes", 0)),
+            "packets": int(values["Ipkts"]),
+            "errors": int(values["Ierrs"]),
+        }
+        tx = {
+            "bytes": int(values.get("Obytes", 0)),
+            "packets": int(values["Opkts"]),
+            "errors": int(values["Oerrs"]),
+        }
+        if "Drop" in values:
+            tx["dropped"] = int(values["Drop"])
+        tx["collisions"] = int(values["Coll"])
+        # Interfaces which are down are marked with asterisk
+        stats[cols[0].rstrip("*")] = {"rx": rx, "tx": tx}
+
+    return stats
+
+
+NETSTAT_IB_CMD = [NETSTAT, "-ibdn"]
+
+
+def get_link_stats(fresh=False):
+    res = check_result(run_cmd(NETSTAT_IB_CMD, fresh=fresh))
+    profile_mark("collect")
+    stats = parse_netstat_ib(res.stdout)
+    profile_mark("parse", rows=len(stats), size=len(res.stdout))
+    return stats
+
+
+# Stats columns matching iproute2 print_link_stats() naming
+LINK_STATS_RX = [
+    ("bytes", "bytes"),
+    ("packets", "packets"),
+    ("errors", "errors"),
+]
+LINK_STATS_TX = [
+    ("bytes", "bytes"),
+    ("packets", "packets"),
+    ("errors", "errors"),
+    ("dropped", "dropped"),
+    ("collisions", "collsns"),
+]
+
+
+def format_link_stats(stats64, suffix=""):
+    lines = []
+    for name, columns in (("RX", LINK_STATS_RX), ("TX", LINK_STATS_TX)):
+        counters = stats64[name.lower()]
+        columns = [(k, h + suffix) for k, h in columns if k in counters]
+        values = [str(counters[k]) for k, _ in columns]
+        widths = [max(len(h), len(v)) for (_, h), v in zip(columns, values)]
+        lines.append(
+            "    %s: " % name
+            + " ".join(h.rjust(w) for (_, h), w in zip(columns, widths))
+        )
+        lines.append(
+            "        " + " ".join(v.rjust(w) for v, w in zip(values, widths))
+        )
+    return lines
+
+
+# ifconfig for [ DEVICE ] [ up ] selector
+def ifconfig_cmd(dev=None, up=False):
     cmd = [IFCONFIG, "-v"]
-    if "up" in argv:
-        argv.remove("up")
+    if up:
         cmd.append("-u")
+    cmd.append(dev if dev else "-a")
+    return cmd
+
+
+def check_links_result(res):
+    """check_result, ifconfig fails without output for unknown devices"""
+    if res.returncode != 0 and not (res.stderr + res.stdout).strip():
+        raise NotFoundError(" ".join(res.args[2:]) + " not found")
+    return check_result(res)
+
+
+# Filter out interfaces with no addresses of the requested family
+def select_links(links, af, address):
+    if address and af in (4, 6):
+        links = [l for l in links if l.get("addr_info")]
+    return links
+
+
+def merge_link_stats(links, link_stats):
+    for l in links:
+        if l["ifname"] in link_stats:
+            l["stats64"] = link_stats[l["ifname"]]
+
+
+# Runs ifconfig for [ DEVICE ] [ up ] selector, see links() of iproute2mac
+def get_links(dev=None, up=False, af=-1, address=False, stats=False):
+    res = check_links_result(run_cmd(ifconfig_cmd(dev, up)))
+    profile_mark("collect")
+
+    links = parse_ifconfig(res.stdout, af, address)
+    profile_mark("parse", rows=len(links), size=len(res.stdout))
+    if is_offline():
+        # The capture is ifconfig -v -a, select what ifconfig would have
+        if up:
+            links = [l for l in links if "UP" in l["flags"]]
+        if dev:
+            links = [l for l in links if l["ifname"] == dev]
+            if not links:
+                raise NotFoundError(dev + " not found")
+
+    links = select_links(links, af, address)
+    profile_mark("filter", rows=len(links))
 
+    if stats:
+        merge_link_stats(links, get_link_stats())
+    return links
+
+
+# get_links without blocking, see links_async() of iproute2mac
+async def get_links_async(
+    dev=None, up=False, af=-1, address=False, stats=False
+):
+    import asyncio
+
+    collect = [
+        run_cmd_async(
+            ifconfig_cmd(dev, up),
+            partial(parse_ifconfig, af=af, address=address),
+        )
+    ]
+    if stats:
+        collect.append(run_cmd_async(NETSTAT_IB_CMD, parse_netstat_ib))
+    results = await asyncio.gather(*collect)
+
+    (res, links) = results[0]
+    check_links_result(res)
+    links = select_links(links, af, address)
+    if stats:
+        (res, link_stats) = results[1]
+        check_result(res)
+        merge_link_stats(links, link_stats)
+    return links
+
+
+def link_selector(argv):
+    """Returns device and up of [ dev ] [ DEVICE ] [ up ] selector"""
+    up = "up" in argv
+    if up:
+        argv.remove("up")
     if len(argv) > 0 and argv[0] == "dev":
         argv.pop(0)
-    if len(argv) > 0:
-        cmd.append(argv[0])
-    else:
-        cmd.append("-a")
+    return (argv[0] if argv else None, up)
+
 
+def link_addr_show(
+    argv,
+    af,
+    json_print,
+    pretty_json,
+    color,
+    address,
+    brief,
+    oneline,
+    stats=0,
+):
     output_separator = "\\" if oneline else "\n"
 
-    res = subprocess.run(cmd, capture_output=True, text=True)
-    if res.returncode != 0:
-        out = (res.stderr + res.stdout).strip()
-        if out == "":
-            perror(" ".join(cmd[2:]) + " not found")
-        else:
-            perror(out)
+    try:
+        links = get_links(*link_selector(argv), af, address, stats)
+    except IPRoute2MacError as e:
+        perror(str(e))
         return False
 
-    links = parse_ifconfig(res.stdout, af, address)
-
-    # Filter out interfaces with no addresses of the requested family
-    if address and af in (4, 6):
-        links = [l for l in links if l.get("addr_info")]
-
     if json_print:
         return json_dump(links, pretty_json)
 
+    out = Renderer(color)
+
     for l in links:
         # Brief format: interface_name STATUS ip_addresses...
         if brief:
             # Interface name and state (right-padded to align)
             line = (
-                colorize_ifname(color, l["ifname"], 16)
+                out.ifname(l["ifname"], 16)
                 + " "
-                + colorize_op_state(color, l["operstate"], 8)
+                + out.op_state(l["operstate"], 8)
             )
 
             # Add addresses
@@ -147,7 +299,7 @@ def link_addr_show(
                 addrs.append(
                     "%s/%d"
                     % (
-                        colorize_inet(color, a["family"], a["local"]),
+                        out.inet(a["family"], a["local"]),
                         a["prefixlen"],
                     )
                 )
@@ -156,14 +308,14 @@ def link_addr_show(
             if not address:
                 #  Add MAC address
                 if "address" in l:
-                    addrs.append(colorize_mac(color, l["address"]))
+                    addrs.append(out.mac(l["address"]))
                 # Add state flags if set
                 if len(l["flags"]) > 0 and l["flags"] != [""]:
                     addrs.append("<%s>" % ",".join(l["flags"]))
 
             if addrs:
                 line += (" " * 7) + " ".join(addrs)
-            print(line)
+            out.line(line)
         # Regular and oneline format
         else:
             lines = []
@@ -173,64 +325,56 @@ def link_addr_show(
                     "%d: %s: %smtu %d status %s"
                     % (
                         l["ifindex"],
-                        colorize_ifname(color, l["ifname"]),
+                        out.ifname(l["ifname"]),
                         (
                             "<" + ",".join(l["flags"]) + "> "
                             if len(l["flags"]) > 0 and l["flags"] != [""]
                             else ""
                         ),
                         l["mtu"],
-                        colorize_op_state(color, l["operstate"]),
+                        out.op_state(l["operstate"]),
                     )
                 )
                 lines.append(
                     "    link/"
                     + l["link_type"]
+                    + ((" " + out.mac(l["address"])) if "address" in l else "")
                     + (
-                        (" " + colorize_mac(color, l["address"]))
-                        if "address" in l
-                        else ""
-                    )
-                    + (
-                        (" brd " + colorize_mac(color, l["broadcast"]))
+                        (" brd " + out.mac(l["broadcast"]))
                         if "broadcast" in l
                         else ""
                     )
                 )
-                print(output_separator.join(lines))
+                if "stats64" in l:
+                    lines.extend(format_link_stats(l["stats64"]))
+                out.line(output_separator.join(lines))
 
             for a in l.get("addr_info", []):
-                print(
+                out.line(
                     (
-                        "%d: %s"
-                        % (l["ifindex"], colorize_ifname(color, l["ifname"]))
+                        "%d: %s" % (l["ifindex"], out.ifname(l["ifname"]))
                         if address and oneline
                         else ""
                     )
                     + "    %s %s"
                     % (
                         a["family"],
-                        colorize_inet(color, a["family"], a["local"]),
+                        out.inet(a["family"], a["local"]),
                     )
                     + (
-                        (
-                            " peer %s"
-                            % colorize_inet(color, a["family"], a["address"])
-                        )
+                        (" peer %s" % out.inet(a["family"], a["address"]))
                         if "address" in a
                         else ""
                     )
                     + "/%d" % (a["prefixlen"])
                     + (
-                        (
-                            " brd "
-                            + colorize_inet(color, a["family"], a["broadcast"])
-                        )
+                        (" brd " + out.inet(a["family"], a["broadcast"]))
                         if "broadcast" in a
                         else ""
                     )
                 )
 
+    out.flush()
     return True
 
 
@@ -243,11 +387,18 @@ def do_help(
     color=None,
     brief=None,
     oneline=None,
+    stats=None,
 ):
     perror("Usage: ip [ OPTIONS ] OBJECT { COMMAND | help }")
-    perror("where  OBJECT := { link | addr | route | neigh }")
+    perror("where  OBJECT := { link | addr | route | neigh | snapshot }")
     perror("       OPTIONS := { -V[ersion] | -j[son] | -p[retty] | -c[olor] |")
-    perror("                    -br[ief] | -o[neline] | -4 | -6 }")
+    perror(
+        "                    -br[ief] | -o[neline] | -s[tatistics] | -4 | -6 |"
+    )
+    perror(
+        "                    -interval SECONDS [ -count COUNT ] | -profile |"
+    )
+    perror("                    -input FILE [ -jobs N ] | -dry-run }")
     perror(HELP_ADDENDUM)
     exit(255)
 
@@ -273,11 +424,14 @@ def do_help_addr():
 
 
 def do_help_link():
-    perror("Usage: ip link set dev DEVICE")
+    perror("Usage: ip link set dev DEVICE [ dev DEVICE ]...")
     perror("                [ { up | down } ]")
     perror("                [ address { LLADDR | factory | random } ]")
     perror("                [ mtu MTU ]")
     perror("       ip link show [ DEVICE ] [up]")
+    perror(
+        "       ip -s -interval SECONDS [ -count COUNT ] link show [ DEVICE ]"
+    )
     exit(255)
 
 
@@ -289,7 +443,7 @@ def do_help_neigh():
 
 # Route Module
 @help_msg(do_help_route)
-def do_route(argv, af, json_print, pretty_json, color, brief, oneline):
+def do_route(argv, af, json_print, pretty_json, color, brief, oneline, stats):
     if not argv or (
         any_startswith(["show", "lst", "list"], argv[0]) and len(argv) <= 3
     ):
@@ -316,33 +470,24 @@ def do_route(argv, af, json_print, pretty_json, color, brief, oneline):
     return True
 
 
-def do_route_list(argv, af, json_print, pretty_json, color):
-    # argv can have SELECTOR = [[exact] PREFIX]
-    argc = len(argv)
-    if argc == 0:
-        exact = ""
-    elif argc == 1:
-        exact = argv[0]
-    elif argc == 2 and argv[0] == "exact":
-        exact = argv[1]
-    else:
-        return False
+# Title of the netstat -nr table of the address family
+def netstat_nr_section(af):
+    return "Internet6:" if af == 6 else "Internet:"
 
-    # ip route prints IPv6 or IPv4, never both
-    inet = "inet6" if af == 6 else "inet"
-    res = subprocess.run(
-        [NETSTAT, "-nr", "-f", inet], capture_output=True, text=True
-    )
-    if res.returncode != 0:
-        perror((res.stderr + res.stdout).strip())
-        return False
-    lines = res.stdout.split("\n")
-    lines = lines[4:]  # Removes first 4 lines
 
+# Decode netstat -nr output, section is the table res starts in
+@without_gc
+def parse_netstat_nr(res, af, section=None):
     routes = []
+    # Rows of the Internet: or Internet6: table, netstat -nr without -f
+    # prints both
+    wanted = netstat_nr_section(af)
 
-    for r in lines:
-        if not r.strip():
+    for r in output_lines(res):
+        if r.startswith("Internet"):
+            section = r.strip()
+            continue
+        if section != wanted or not r.strip() or r.startswith("Destination"):
             continue
         ra = r.split()
         target = ra[0]
@@ -353,52 +498,131 @@ def do_route_list(argv, af, json_print, pretty_json, color):
         if flags.find("W") != -1:
             continue
         if af == 6:
-            target = re.sub(r"%[^ ]+/", "/", target)
+            target = regex(r"%[^ ]+/").sub("/", target)
         else:
             target = cidr_from_netstat_dst(target)
         if flags.find("B") != -1:
-            routes.append({"type": "blackhole", "dst": target, "flags": []})
+            routes.append(Route(type="blackhole", dst=target, flags=NO_FLAGS))
             continue
-        if re.match(r"link.+", gw):
+        if regex(r"link.+").match(gw):
             routes.append(
-                {"dst": target, "dev": dev, "scope": "link", "flags": []}
+                Route(
+                    dst=target,
+                    dev=sys.intern(dev),
+                    scope="link",
+                    flags=NO_FLAGS,
+                )
             )
         else:
             routes.append(
-                {"dst": target, "gateway": gw, "dev": dev, "flags": []}
+                Route(
+                    dst=target,
+                    gateway=sys.intern(gw),
+                    dev=sys.intern(dev),
+                    flags=NO_FLAGS,
+                )
             )
 
+    return routes
+
+
+def parse_netstat_nr_parallel(capture, af, jobs):
+    """parse_netstat_nr of a capture in parallel_map, only its af table"""
+    section = capture.section(netstat_nr_section(af))
+    if section is None:
+        return []
+    routes = []
+    for part in parallel_map(
+        partial(parse_netstat_nr, af=af, section=netstat_nr_section(af)),
+        section,
+        jobs,
+    ):
+        routes += part
+    return routes
+
+
+# netstat -nr of af, ip route prints IPv6 or IPv4, never both
+def netstat_nr_cmd(af):
+    return [NETSTAT, "-nr", "-f", "inet6" if af == 6 else "inet"]
+
+
+def select_routes(routes, exact):
     if exact:
         routes = [route for route in routes if route.get("dst") == exact]
+    return routes
+
+
+# Runs netstat -nr for routes of af, see routes() of iproute2mac
+def get_routes(af=4, exact=None):
+    res = check_result(run_cmd(netstat_nr_cmd(af)))
+    profile_mark("collect")
+    if parallel_jobs() is not None:
+        routes = parse_netstat_nr_parallel(res.stdout, af, parallel_jobs())
+    else:
+        routes = parse_netstat_nr(res.stdout, af)
+    profile_mark("parse", rows=len(routes), size=len(res.stdout))
+
+    routes = select_routes(routes, exact)
+    profile_mark("filter", rows=len(routes))
+    return routes
+
+
+# get_routes without blocking, see routes_async() of iproute2mac
+async def get_routes_async(af=4, exact=None):
+    (res, routes) = await run_cmd_async(
+        netstat_nr_cmd(af), partial(parse_netstat_nr, af=af)
+    )
+    check_result(res)
+    return select_routes(routes, exact)
+
+
+def do_route_list(argv, af, json_print, pretty_json, color):
+    # argv can have SELECTOR = [[exact] PREFIX]
+    argc = len(argv)
+    if argc == 0:
+        exact = ""
+    elif argc == 1:
+        exact = argv[0]
+    elif argc == 2 and argv[0] == "exact":
+        exact = argv[1]
+    else:
+        return False
+
+    inet = "inet6" if af == 6 else "inet"
+    try:
+        routes = get_routes(af, exact)
+    except IPRoute2MacError as e:
+        perror(str(e))
+        return False
 
     if json_print:
         return json_dump(routes, pretty_json)
 
+    out = Renderer(color)
+
     for route in routes:
         if "type" in route:
-            print(
-                "%s %s"
-                % (route["type"], colorize_inet(color, inet, route["dst"]))
-            )
+            out.line("%s %s" % (route["type"], out.inet(inet, route["dst"])))
         elif "scope" in route:
-            print(
+            out.line(
                 "%s dev %s scope %s"
                 % (
-                    colorize_inet(color, inet, route["dst"]),
-                    colorize_ifname(color, route["dev"]),
+                    out.inet(inet, route["dst"]),
+                    out.ifname(route["dev"]),
                     route["scope"],
                 )
             )
         elif "gateway" in route:
-            print(
+            out.line(
                 "%s via %s dev %s"
                 % (
-                    colorize_inet(color, inet, route["dst"]),
-                    colorize_inet(color, inet, route["gateway"]),
-                    colorize_ifname(color, route["dev"]),
+                    out.inet(inet, route["dst"]),
+                    out.inet(inet, route["gateway"]),
+                    out.ifname(route["dev"]),
                 )
             )
 
+    out.flush()
     return True
 
 
@@ -477,8 +701,12 @@ def do_route_flush(argv, af):
         return True
     elif len(argv) == 2 and argv[0] == "table" and argv[1] == "main":
         family = "-inet6" if af == 6 else "-inet"
-        print("iproute2mac: Flushing all routes")
-        return execute_cmd([SUDO, ROUTE, "-n", "flush", family])
+        cmd = [SUDO, ROUTE, "-n", "flush", family]
+        # A dry run only prints the command, nothing is flushed
+        if not is_dry_run():
+            check_mutation(cmd)
+            print("iproute2mac: Flushing all routes")
+        return execute_cmd(cmd)
     else:
         return False
 
@@ -486,6 +714,8 @@ def do_route_flush(argv, af):
 def do_route_get(argv, af, json_print, pretty_json, color):
     target = argv[0]
 
+    import socket
+
     cmd = [ROUTE, "-n", "get"]
     if ":" in target or af == 6:
         cmd.append("-inet6")
@@ -497,12 +727,15 @@ def do_route_get(argv, af, json_print, pretty_json, color):
 
     cmd.append(target)
 
-    res = subprocess.run(cmd, capture_output=True, text=True)
-    res_text = (
-        (res.stderr + res.stdout).strip()
-        if res.returncode != 0
-        else res.stdout
-    )
+    res = run_cmd(cmd)
+    profile_mark("collect")
+    if is_offline():
+        # The capture is route -n get output
+        res_text = "\n".join(output_lines(res.stdout))
+    elif res.returncode != 0:
+        res_text = (res.stderr + res.stdout).strip()
+    else:
+        res_text = res.stdout
     if res.returncode != 0:
         perror(res_text)
         return False
@@ -511,11 +744,9 @@ def do_route_get(argv, af, json_print, pretty_json, color):
         exit(1)
 
     res = dict(
-        re.findall(
-            r"^\W*((?:route to|destination|gateway|interface)): (.+)$",
-            res_text,
-            re.MULTILINE,
-        )
+        regex(
+            r"(?m)^\W*((?:route to|destination|gateway|interface)): (.+)$"
+        ).findall(res_text)
     )
 
     route = {"dst": res["route to"], "dev": res["interface"]}
@@ -523,13 +754,15 @@ def do_route_get(argv, af, json_print, pretty_json, color):
     if "gateway" in res:
         route["gateway"] = res["gateway"]
 
-    try:
-        s = socket.socket(family, socket.SOCK_DGRAM)
-        s.connect((route["dst"], 7))
-        route["prefsrc"] = src_ip = s.getsockname()[0]
-        s.close()
-    except Exception:
-        pass
+    # Source address is of this host, unknown for a captured one
+    if not is_offline():
+        try:
+            s = socket.socket(family, socket.SOCK_DGRAM)
+            s.connect((route["dst"], 7))
+            route["prefsrc"] = src_ip = s.getsockname()[0]
+            s.close()
+        except Exception:
+            pass
 
     route["flags"] = []
     route["uid"] = os.getuid()
@@ -538,17 +771,19 @@ def do_route_get(argv, af, json_print, pretty_json, color):
     if json_print:
         return json_dump([route], pretty_json)
 
-    print(
-        colorize_inet(color, color_af, route["dst"])
+    out = Renderer(color)
+
+    out.line(
+        out.inet(color_af, route["dst"])
         + (
-            (" via " + colorize_inet(color, color_af, route["gateway"]))
+            (" via " + out.inet(color_af, route["gateway"]))
             if "gateway" in route
             else ""
         )
         + " dev "
-        + colorize_ifname(color, route["dev"])
+        + out.ifname(route["dev"])
         + (
-            (" src " + colorize_inet(color, color_af, route["prefsrc"]))
+            (" src " + out.inet(color_af, route["prefsrc"]))
             if "prefsrc" in route
             else ""
         )
@@ -556,19 +791,20 @@ def do_route_get(argv, af, json_print, pretty_json, color):
         + str(route["uid"])
     )
 
+    out.flush()
     return True
 
 
 # Addr Module
 @help_msg(do_help_addr)
-def do_addr(argv, af, json_print, pretty_json, color, brief, oneline):
+def do_addr(argv, af, json_print, pretty_json, color, brief, oneline, stats):
     if not argv:
         argv.append("show")
 
     if any_startswith(["show", "lst", "list"], argv[0]):
         argv.pop(0)
         return do_addr_show(
-            argv, af, json_print, pretty_json, color, brief, oneline
+            argv, af, json_print, pretty_json, color, brief, oneline, stats
         )
     elif strict_startswith("add", argv[0]) and len(argv) >= 3:
         argv.pop(0)
@@ -581,9 +817,11 @@ def do_addr(argv, af, json_print, pretty_json, color, brief, oneline):
     return True
 
 
-def do_addr_show(argv, af, json_print, pretty_json, color, brief, oneline):
+def do_addr_show(
+    argv, af, json_print, pretty_json, color, brief, oneline, stats
+):
     return link_addr_show(
-        argv, af, json_print, pretty_json, color, True, brief, oneline
+        argv, af, json_print, pretty_json, color, True, brief, oneline, stats
     )
 
 
@@ -636,7 +874,7 @@ def do_addr_del(argv, af):
 
 # Link module
 @help_msg(do_help_link)
-def do_link(argv, af, json_print, pretty_json, color, brief, oneline):
+def do_link(argv, af, json_print, pretty_json, color, brief, oneline, stats):
     if not argv:
         argv.append("show")
 
@@ -646,75 +884,297 @@ def do_link(argv, af, json_print, pretty_json, color, brief, oneline):
     elif any_startswith(["show", "lst", "list"], argv[0]):
         argv.pop(0)
         return do_link_show(
-            argv, af, json_print, pretty_json, color, brief, oneline
+            argv, af, json_print, pretty_json, color, brief, oneline, stats
         )
     else:
         return False
     return True
 
 
-def do_link_show(argv, af, json_print, pretty_json, color, brief, oneline):
+def do_link_show(
+    argv, af, json_print, pretty_json, color, brief, oneline, stats
+):
     return link_addr_show(
-        argv, af, json_print, pretty_json, color, False, brief, oneline
+        argv, af, json_print, pretty_json, color, False, brief, oneline, stats
     )
 
 
-def do_link_set(argv, af):
-    if (
-        not argv
-        or not argv[0]
-        or (argv[0] == "dev" and (len(argv) < 2 or not argv[1]))
-    ):
-        perror('Not enough information: "dev" argument is required.')
-        return False
+@help_msg(do_help_link)
+def do_link_rate(argv, af, json_print, pretty_json, color, interval, count):
+    # Sampling runs until count is reached, it can't be served by the daemon
+    require_direct()
 
-    if argv[0] == "dev":
+    if argv and any_startswith(["show", "lst", "list"], argv[0]):
         argv.pop(0)
+    if len([a for a in argv if a not in ("dev", "up")]) > 1:
+        return False
 
-    dev = argv[0]
+    try:
+        links = get_links(*link_selector(argv), af)
+        prev = get_link_stats(fresh=True)
+    except IPRoute2MacError as e:
+        perror(str(e))
+        return False
+    prev_time = time.monotonic()
 
-    ifconfig_dev_cmd = [SUDO, IFCONFIG, dev]
+    out = Renderer(color)
+    sample = 0
+    try:
+        while count is None or sample < count:
+            time.sleep(interval)
+            profile_mark("sleep")
+            try:
+                cur = get_link_stats(fresh=True)
+            except IPRoute2MacError as e:
+                perror(str(e))
+                return False
+            cur_time = time.monotonic()
+            elapsed = cur_time - prev_time
+
+            rates = []
+            for l in links:
+                if l["ifname"] not in cur or l["ifname"] not in prev:
+                    continue
+                rate64 = {}
+                for direction in ("rx", "tx"):
+                    old = prev[l["ifname"]][direction]
+                    new = cur[l["ifname"]][direction]
+                    rate64[direction] = {
+                        k: int(max(0, new[k] - old[k]) / elapsed) for k in new
+                    }
+                rates.append(
+                    {
+                        "ifindex": l["ifindex"],
+                        "ifname": l["ifname"],
+                        "rate64": rate64,
+                    }
+                )
+
+            if json_print:
+                # One JSON document per sample
+                json_dump(rates, pretty_json)
+            else:
+                for r in rates:
+                    out.line(
+                        "%d: %s:" % (r["ifindex"], out.ifname(r["ifname"]))
+                    )
+                    for line in format_link_stats(r["rate64"], "/s"):
+                        out.line(line)
+            out.flush()
+
+            prev, prev_time = cur, cur_time
+            sample += 1
+    except KeyboardInterrupt:
+        pass
+    return True
+
+
+def factory_address(dev):
+    """Hardware address of dev from networksetup, None if it has none"""
+    (_, address) = hardware_ports().get(dev, (None, None))
+    return address
+
+
+def plan_link_set(dev, argv, several=False):
+    """
+    Parses and validates all ip link set attributes before anything is
+    changed and returns the ifconfig commands applying them, None if they
+    are invalid. With several devices selected, one literal lladdr for
+    all of them is invalid.
+
+    ifconfig applies its arguments in order, so one command does: a link
+    going down is taken down first and one going up is brought up last,
+    it never runs with only part of the new settings. Repeated attributes
+    are set once, to the last value.
+    """
+    state = None
+    attrs = {}
+    args = iter(argv)
     try:
-        args = iter(argv)
         for arg in args:
-            if arg == "up":
-                if not execute_cmd(ifconfig_dev_cmd + ["up"]):
-                    return False
-            elif arg == "down":
-                if not execute_cmd(ifconfig_dev_cmd + ["down"]):
-                    return False
+            if arg in ["up", "down"]:
+                state = arg
             elif arg in ["address", "addr", "lladdr"]:
                 addr = next(args)
                 if addr in ["random", "rand"]:
                     addr = randomMAC()
                 elif addr == "factory":
-                    res = subprocess.run(
-                        [NETWORKSETUP, "-listallhardwareports"],
-                        capture_output=True,
-                        text=True,
-                    )
-                    if res.returncode != 0:
-                        return False
-                    details = re.findall(
-                        r"^(?:Device|Ethernet Address): (.+)$",
-                        res.stdout,
-                        re.MULTILINE,
+                    addr = factory_address(dev)
+                    if addr is None:
+                        perror('No factory address of "{}".'.format(dev))
+                        return None
+                elif not regex(
+                    r"^[0-9a-fA-F]{1,2}(:[0-9a-fA-F]{1,2}){5}$"
+                ).match(addr):
+                    perror('"{}" is invalid lladdr.'.format(addr))
+                    return None
+                elif several:
+                    perror(
+                        'Error: lladdr "{}" can\'t be set on several'
+                        " devices.".format(addr)
                     )
-                    addr = details[details.index(dev) + 1]
-                if not execute_cmd(ifconfig_dev_cmd + ["lladdr", addr]):
-                    return False
+                    return None
+                attrs["lladdr"] = addr
             elif arg == "mtu":
-                mtu = int(next(args))
-                if not execute_cmd(ifconfig_dev_cmd + ["mtu", str(mtu)]):
-                    return False
-    except Exception:
+                mtu = next(args)
+                if not mtu.isdigit():
+                    perror('Error: argument "{}" is wrong: mtu'.format(mtu))
+                    return None
+                attrs["mtu"] = str(int(mtu))
+            else:
+                perror(
+                    'Error: either "dev" is duplicate, or "{}" is a garbage.'.format(
+                        arg
+                    )
+                )
+                return None
+    except StopIteration:
+        perror('Command line is not complete. Try option "help"')
+        return None
+
+    params = [value for attr in attrs.items() for value in attr]
+    if state == "down":
+        params.insert(0, "down")
+    elif state == "up":
+        params.append("up")
+    if not params:
+        return []
+    return [[SUDO, IFCONFIG, dev] + params]
+
+
+# Devices of ip link set configured at once without -jobs
+LINK_SET_JOBS = 8
+
+
+def link_set_devices(argv):
+    """
+    Removes devices from ip link set arguments, the first one and any
+    following "dev", and returns them, None if invalid. Names with
+    wildcards are matched against all links.
+    """
+    devs = []
+    if argv[0] != "dev":
+        devs.append(argv.pop(0))
+    i = 0
+    while i < len(argv):
+        if argv[i] == "dev":
+            argv.pop(i)
+            if i == len(argv) or not argv[i]:
+                perror('Not enough information: "dev" argument is required.')
+                return None
+            devs.append(argv.pop(i))
+        else:
+            i += 1
+
+    if not any(regex(r"[*?[]").search(dev) for dev in devs):
+        return list(dict.fromkeys(devs))
+
+    import fnmatch
+
+    # One list of links for all patterns
+    res = run_cmd([IFCONFIG, "-l"])
+    if res.returncode != 0:
+        perror((res.stderr + res.stdout).strip())
+        return None
+    names = res.stdout.split()
+    matched = []
+    for dev in devs:
+        if regex(r"[*?[]").search(dev):
+            found = [name for name in names if fnmatch.fnmatchcase(name, dev)]
+            if not found:
+                perror('Device "{}" does not exist.'.format(dev))
+                return None
+            matched += found
+        else:
+            matched.append(dev)
+    return list(dict.fromkeys(matched))
+
+
+def run_link_plan(plan):
+    """Runs ifconfig commands of one device, stops at the first failure"""
+    for cmd in plan:
+        res = run_mutation(cmd)
+        if res.returncode != 0:
+            break
+    return res
+
+
+def do_link_set_concurrent(plans):
+    """
+    Runs plans of several devices in threads, at most -jobs at once, and
+    prints status of each device in order
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    plans = [(dev, plan) for dev, plan in plans if plan]
+    if not plans:
+        return True
+    for _, plan in plans:
+        for cmd in plan:
+            check_mutation(cmd)
+            print("Executing: %s" % " ".join(cmd))
+    if not sudo_validate():
+        return False
+
+    jobs = parallel_jobs()
+    if jobs is None:
+        jobs = LINK_SET_JOBS
+    failed = 0
+    with ThreadPoolExecutor(min(jobs or os.cpu_count(), len(plans))) as pool:
+        results = pool.map(run_link_plan, [plan for _, plan in plans])
+        for (dev, _), res in zip(plans, results):
+            if res.returncode == 0:
+                print("%s: ok" % dev)
+            else:
+                failed += 1
+                perror(
+                    "%s: %s"
+                    % (
+                        dev,
+                        (res.stderr + res.stdout).strip()
+                        or "exit status %d" % res.returncode,
+                    )
+                )
+    if failed:
+        perror("Failed to set %d of %d devices." % (failed, len(plans)))
+        exit(1)
+    return True
+
+
+def do_link_set(argv, af):
+    if (
+        not argv
+        or not argv[0]
+        or (argv[0] == "dev" and (len(argv) < 2 or not argv[1]))
+    ):
+        perror('Not enough information: "dev" argument is required.')
+        return False
+
+    # Devices and factory addresses of a capture aren't looked up either
+    require_live()
+    devs = link_set_devices(argv)
+    if devs is None:
         return False
+    # Everything is validated before any device is changed
+    plans = []
+    for dev in devs:
+        plan = plan_link_set(dev, argv, len(devs) > 1)
+        if plan is None:
+            return False
+        plans.append((dev, plan))
+
+    if len(plans) > 1 and not is_dry_run():
+        return do_link_set_concurrent(plans)
+    for _, plan in plans:
+        for cmd in plan:
+            if not execute_cmd(cmd):
+                return False
     return True
 
 
 # Neigh module
 @help_msg(do_help_neigh)
-def do_neigh(argv, af, json_print, pretty_json, color, brief, oneline):
+def do_neigh(argv, af, json_print, pretty_json, color, brief, oneline, stats):
     if not argv:
         argv.append("show")
 
@@ -728,7 +1188,124 @@ def do_neigh(argv, af, json_print, pretty_json, color, brief, oneline):
         return False
 
 
+ND_LL_STATES = {
+    "R": "REACHABLE",
+    "S": "STALE",
+    "D": "DELAY",
+    "P": "PROBE",
+    "I": "INCOMPLETE",
+    "N": "INCOMPLETE",
+    "W": "INCOMPLETE",
+}
+
+
+# Decode ndp -an output
+@without_gc
+def parse_ndp(res):
+    neighs = []
+    for row in output_lines(res, 1):
+        cols = row.split()
+        entry = Neighbour(dst=regex(r"%.+$").sub("", cols[0]))
+        if cols[1] != "(incomplete)":
+            entry["lladdr"] = cols[1]
+        entry["dev"] = sys.intern(cols[2])
+        if cols[1] == "(incomplete)" and cols[4] != "R":
+            entry["state"] = shared_list(["INCOMPLETE"])
+        else:
+            entry["state"] = shared_list([ND_LL_STATES[cols[4]]])
+        if len(cols) >= 6 and cols[5] == "R":
+            # iproute2 outputs null in its json
+            entry["router"] = None
+        neighs.append(entry)
+    return neighs
+
+
+# Decode arp -anl output
+@without_gc
+def parse_arp(res):
+    neighs = []
+    for row in output_lines(res, 1):
+        cols = row.split()
+        entry = Neighbour(dst=cols[0])
+        if cols[1] != "(incomplete)":
+            entry["lladdr"] = cols[1]
+        entry["dev"] = sys.intern(cols[4])
+        if cols[1] == "(incomplete)":
+            entry["state"] = shared_list(["INCOMPLETE"])
+        else:
+            entry["state"] = shared_list(["REACHABLE"])
+        # router field is ipv6 feature, iproute2 doesn't include router element if not set
+        # entry["router"] = False
+        neighs.append(entry)
+    return neighs
+
+
+NDP_CMD = [NDP, "-an"]
+
+
+def arp_cmd(dev=None):
+    cmd = [ARP, "-anl"]
+    if dev:
+        cmd += ["-i", dev]
+    return cmd
+
+
+def select_neighbours(neighs, dev, prefix):
+    import ipaddress
+
+    if dev:
+        neighs = [nb for nb in neighs if nb["dev"] == dev]
+    if prefix:
+        prefix = ipaddress.ip_network(prefix, strict=False)
+        neighs = [
+            nb for nb in neighs if ipaddress.ip_address(nb["dst"]) in prefix
+        ]
+    return neighs
+
+
+# Runs ndp -an and arp -anl, see neighbours() of iproute2mac
+def get_neighbours(af=-1, dev=None, prefix=None):
+    neighs = []
+
+    if af != 4:
+        res = check_result(run_cmd(NDP_CMD))
+        profile_mark("collect")
+        neighs.extend(parse_ndp(res.stdout))
+        profile_mark("parse", rows=len(neighs), size=len(res.stdout))
+
+    if af != 6:
+        res = check_result(run_cmd(arp_cmd(dev)))
+        profile_mark("collect")
+        rows = len(neighs)
+        neighs.extend(parse_arp(res.stdout))
+        profile_mark("parse", rows=len(neighs) - rows, size=len(res.stdout))
+
+    neighs = select_neighbours(neighs, dev, prefix)
+    profile_mark("filter", rows=len(neighs))
+    return neighs
+
+
+# get_neighbours without blocking, see neighbours_async() of iproute2mac
+async def get_neighbours_async(af=-1, dev=None, prefix=None):
+    import asyncio
+
+    collect = []
+    if af != 4:
+        collect.append(run_cmd_async(NDP_CMD, parse_ndp))
+    if af != 6:
+        collect.append(run_cmd_async(arp_cmd(dev), parse_arp))
+
+    neighs = []
+    # IPv6 neighbours first, like get_neighbours
+    for res, parsed in await asyncio.gather(*collect):
+        check_result(res)
+        neighs.extend(parsed)
+    return select_neighbours(neighs, dev, prefix)
+
+
 def do_neigh_show(argv, af, json_print, pretty_json, color):
+    import ipaddress
+
     prefix = None
     dev = None
     try:
@@ -747,87 +1324,31 @@ def do_neigh_show(argv, af, json_print, pretty_json, color):
     except Exception:
         return False
 
-    nd_ll_states = {
-        "R": "REACHABLE",
-        "S": "STALE",
-        "D": "DELAY",
-        "P": "PROBE",
-        "I": "INCOMPLETE",
-        "N": "INCOMPLETE",
-        "W": "INCOMPLETE",
-    }
-
-    neighs = []
-
-    if af != 4:
-        res = subprocess.run(
-            [NDP, "-an"], capture_output=True, text=True, check=True
-        )
-        for row in res.stdout.splitlines()[1:]:
-            cols = row.split()
-            entry = {"dst": re.sub(r"%.+$", "", cols[0])}
-            if cols[1] != "(incomplete)":
-                entry["lladdr"] = cols[1]
-            entry["dev"] = cols[2]
-            if dev and entry["dev"] != dev:
-                continue
-            if prefix and ipaddress.ip_address(entry["dst"]) not in prefix:
-                continue
-            if cols[1] == "(incomplete)" and cols[4] != "R":
-                entry["state"] = ["INCOMPLETE"]
-            else:
-                entry["state"] = [nd_ll_states[cols[4]]]
-            if len(cols) >= 6 and cols[5] == "R":
-                # iproute2 outputs null in its json
-                entry["router"] = None
-            neighs.append(entry)
-
-    if af != 6:
-        args = [ARP, "-anl"]
-        if dev:
-            args += ["-i", dev]
-
-        res = subprocess.run(args, capture_output=True, text=True, check=True)
-        for row in res.stdout.splitlines()[1:]:
-            cols = row.split()
-            entry = {"dst": cols[0]}
-            if cols[1] != "(incomplete)":
-                entry["lladdr"] = cols[1]
-            entry["dev"] = cols[4]
-            if dev and entry["dev"] != dev:
-                continue
-            if prefix and ipaddress.ip_address(entry["dst"]) not in prefix:
-                continue
-            if cols[1] == "(incomplete)":
-                entry["state"] = ["INCOMPLETE"]
-            else:
-                entry["state"] = ["REACHABLE"]
-            # router field is ipv6 feature, iproute2 doesn't include router element if not set
-            # entry["router"] = False
-            neighs.append(entry)
+    try:
+        neighs = get_neighbours(af, dev, prefix)
+    except IPRoute2MacError as e:
+        perror(str(e))
+        return False
 
     if json_print:
         return json_dump(neighs, pretty_json)
 
+    out = Renderer(color)
+
     for nb in neighs:
-        print(
-            colorize_inet(
-                color, "inet6" if ":" in nb["dst"] else "inet", nb["dst"]
-            )
-            + (
-                ""
-                if nb["dev"] is None
-                else " dev " + colorize_ifname(color, nb["dev"])
-            )
+        out.line(
+            out.inet("inet6" if ":" in nb["dst"] else "inet", nb["dst"])
+            + ("" if nb["dev"] is None else " dev " + out.ifname(nb["dev"]))
             + (
                 ""
                 if "lladdr" not in nb
-                else " lladdr " + colorize_mac(color, nb["lladdr"])
+                else " lladdr " + out.mac(nb["lladdr"])
             )
             + (" router" if "router" in nb else "")
             + " %s" % (nb["state"][0])
         )
 
+    out.flush()
     return True
 
 
@@ -851,6 +1372,311 @@ def do_neigh_flush(argv, af):
     return True
 
 
+# Snapshot module
+SNAPSHOT_VERSION = 1
+
+# Objects of a snapshot and fields identifying their entries for diff
+SNAPSHOT_KEYS = {
+    "link": ("ifname",),
+    "addr": ("ifname", "local"),
+    "route": ("dst", "dev"),
+    "route6": ("dst", "dev"),
+    "neigh": ("dst", "dev"),
+    "bridge": ("ifname",),
+}
+
+
+def do_help_snapshot():
+    perror("Usage: ip snapshot save [ FILE ]")
+    perror("       ip snapshot diff OLD_FILE [ NEW_FILE ]")
+    exit(255)
+
+
+@help_msg(do_help_snapshot)
+def do_snapshot(
+    argv, af, json_print, pretty_json, color, brief, oneline, stats
+):
+    # Files are relative to the working directory of the client
+    require_direct()
+    if is_offline():
+        perror("iproute2mac: Snapshots are taken of a live system.")
+        exit(255)
+
+    if argv and strict_startswith("save", argv[0]) and len(argv) <= 2:
+        argv.pop(0)
+        return do_snapshot_save(argv[0] if argv else "-")
+    elif argv and strict_startswith("diff", argv[0]) and 2 <= len(argv) <= 3:
+        argv.pop(0)
+        return do_snapshot_diff(argv, json_print, pretty_json, color)
+    else:
+        return False
+
+
+# Runs the tools of all snapshot objects concurrently, returns JSON data
+async def get_snapshot_async():
+    import asyncio
+    import json
+
+    import bridge
+
+    ((res, links), routes, routes6, neighs) = await asyncio.gather(
+        run_cmd_async(
+            ifconfig_cmd(), partial(parse_ifconfig, af=-1, address=True)
+        ),
+        get_routes_async(4),
+        get_routes_async(6),
+        get_neighbours_async(),
+    )
+    check_links_result(res)
+    # Bridge members are in the same ifconfig output
+    members = bridge.bridge_members(
+        await asyncio.to_thread(bridge.parse_ifconfig, res.stdout)
+    )
+    profile_mark("collect")
+
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "taken": time.time(),
+        "link": [],
+        "addr": [],
+        "route": routes,
+        "route6": routes6,
+        "neigh": neighs,
+        "bridge": members,
+    }
+    for l in links:
+        link = l.to_json()
+        for addr in link.pop("addr_info", []):
+            snapshot["addr"].append({"ifname": l["ifname"], **addr.to_json()})
+        snapshot["link"].append(link)
+    # Same values as of a snapshot loaded from file, e.g. lists for tuples
+    return json.loads(json.dumps(snapshot, default=json_default))
+
+
+def do_snapshot_save(path):
+    import asyncio
+    import json
+
+    try:
+        snapshot = asyncio.run(get_snapshot_async())
+    except IPRoute2MacError as e:
+        perror(str(e))
+        exit(1)
+
+    data = json.dumps(snapshot, separators=(",", ":"))
+    if path == "-":
+        print(data)
+    else:
+        try:
+            with open(path, "w") as f:
+                f.write(data + "\n")
+        except OSError as e:
+            perror('Cannot write snapshot "%s": %s' % (path, e.strerror))
+            exit(1)
+    profile_mark(
+        "render",
+        rows=sum(len(snapshot[obj]) for obj in SNAPSHOT_KEYS),
+        size=len(data),
+    )
+    return True
+
+
+def load_snapshot(path):
+    import json
+
+    try:
+        if path == "-":
+            snapshot = json.load(sys.stdin)
+        else:
+            with open(path) as f:
+                snapshot = json.load(f)
+    except OSError as e:
+        perror('Cannot read snapshot "%s": %s' % (path, e.strerror))
+        exit(1)
+    except ValueError:
+        snapshot = None
+    if not isinstance(snapshot, dict) or "version" not in snapshot:
+        perror('"%s" is not a snapshot of ip snapshot save' % path)
+        exit(1)
+    if snapshot["version"] != SNAPSHOT_VERSION:
+        perror(
+            'Snapshot "%s" has version %s, expected %d'
+            % (path, snapshot["version"], SNAPSHOT_VERSION)
+        )
+        exit(1)
+    # Every object is a list of entries
+    for obj in SNAPSHOT_KEYS:
+        entries = snapshot.get(obj)
+        if not isinstance(entries, list) or not all(
+            isinstance(entry, dict) for entry in entries
+        ):
+            perror('"%s" is not a snapshot of ip snapshot save' % path)
+            exit(1)
+    return snapshot
+
+
+@without_gc
+def snapshot_index(entries, fields):
+    """
+    Entries by their key of fields, repeated keys are told apart by their
+    occurrence, so that e.g. the second of two equal routes matches the
+    second one in the other snapshot
+    """
+    index = {}
+    seen = {}
+    for entry in entries:
+        key = tuple(map(entry.get, fields))
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        index[(key, n)] = entry
+    return index
+
+
+def field_changes(prev, entry):
+    """
+    Fields of an entry which differ, as name to {"old": ..., "new": ...}
+    without the side where the field is absent
+    """
+    changes = {}
+    for name in list(prev) + [f for f in entry if f not in prev]:
+        if name in prev and name in entry and prev[name] == entry[name]:
+            continue
+        change = {}
+        if name in prev:
+            change["old"] = prev[name]
+        if name in entry:
+            change["new"] = entry[name]
+        changes[name] = change
+    return changes
+
+
+def diff_snapshots(old, new):
+    """
+    Changes from snapshot old to new, entries are matched by their
+    SNAPSHOT_KEYS in one pass over each snapshot
+    """
+    changes = []
+    for obj, fields in SNAPSHOT_KEYS.items():
+        before = snapshot_index(old.get(obj, []), fields)
+        after = snapshot_index(new.get(obj, []), fields)
+        for (key, n), entry in before.items():
+            if (key, n) not in after:
+                changes.append(
+                    {
+                        "object": obj,
+                        "change": "removed",
+                        "key": dict(zip(fields, key)),
+                        "old": entry,
+                    }
+                )
+        for (key, n), entry in after.items():
+            if (key, n) not in before:
+                changes.append(
+                    {
+                        "object": obj,
+                        "change": "added",
+                        "key": dict(zip(fields, key)),
+                        "new": entry,
+                    }
+                )
+            elif entry != before[(key, n)]:
+                prev = before[(key, n)]
+                changes.append(
+                    {
+                        "object": obj,
+                        "change": "changed",
+                        "key": dict(zip(fields, key)),
+                        "fields": field_changes(prev, entry),
+                    }
+                )
+    return changes
+
+
+def format_snapshot_value(value):
+    if isinstance(value, list):
+        return ",".join(map(format_snapshot_value, value))
+    elif isinstance(value, dict):
+        return ",".join(
+            "%s=%s" % (k, format_snapshot_value(v)) for k, v in value.items()
+        )
+    return "null" if value is None else str(value)
+
+
+# Key values and then the other fields of entry as name value pairs, null
+# fields like router as their name only
+def format_snapshot_entry(key, entry=None):
+    words = [str(v) for v in key.values() if v is not None][:1]
+    for name, value in list(key.items())[1:]:
+        if value is not None:
+            words += [name, str(value)]
+    for name, value in (entry or {}).items():
+        if name in key or value == []:
+            continue
+        elif value is None:
+            words.append(name)
+        else:
+            words += [name, format_snapshot_value(value)]
+    return " ".join(words)
+
+
+def do_snapshot_diff(argv, json_print, pretty_json, color):
+    import asyncio
+
+    old = load_snapshot(argv[0])
+    if len(argv) > 1:
+        new = load_snapshot(argv[1])
+    else:
+        try:
+            new = asyncio.run(get_snapshot_async())
+        except IPRoute2MacError as e:
+            perror(str(e))
+            exit(1)
+
+    changes = diff_snapshots(old, new)
+    profile_mark("filter", rows=len(changes))
+    if json_print:
+        json_dump(changes, pretty_json)
+    else:
+        out = Renderer(color)
+        for c in changes:
+            if c["change"] == "changed":
+                out.line(
+                    "~ %s %s" % (c["object"], format_snapshot_entry(c["key"]))
+                )
+                for name, change in c["fields"].items():
+                    out.line(
+                        "    %s %s -> %s"
+                        % (
+                            name,
+                            (
+                                format_snapshot_value(change["old"])
+                                if "old" in change
+                                else "(none)"
+                            ),
+                            (
+                                format_snapshot_value(change["new"])
+                                if "new" in change
+                                else "(none)"
+                            ),
+                        )
+                    )
+            elif c["change"] == "added":
+                out.line(
+                    "+ %s %s"
+                    % (c["object"], format_snapshot_entry(c["key"], c["new"]))
+                )
+            else:
+                out.line(
+                    "- %s %s"
+                    % (c["object"], format_snapshot_entry(c["key"], c["old"]))
+                )
+        out.flush()
+    # Like diff, the exit status tells whether anything changed
+    if changes:
+        exit(1)
+    return True
+
+
 # Match iproute2 commands
 # https://git.kernel.org/pub/scm/network/iproute2/iproute2.git/tree/ip/ip.c#n86
 cmds = [
@@ -859,6 +1685,7 @@ cmds = [
     ("neighbor", do_neigh),
     ("neighbour", do_neigh),
     ("link", do_link),
+    ("snapshot", do_snapshot),
     ("help", do_help),
 ]
 
@@ -871,6 +1698,12 @@ def main(argv):
     brief = False
     color_mode = "never"
     oneline = False
+    stats = 0
+    interval = None
+    count = None
+    input_path = None
+    jobs = None
+    dry_run = False
 
     while argv and argv[0].startswith("-"):
         if argv[0] == "-":
@@ -907,12 +1740,58 @@ def main(argv):
                 )
                 exit(255)
             argv.pop(0)
+        elif strict_startswith("-count", argv[0]):
+            opt = argv.pop(0)
+            try:
+                count = int(argv.pop(0))
+                if count < 1:
+                    raise ValueError
+            except (IndexError, ValueError):
+                perror('Option "{}" requires a positive integer.'.format(opt))
+                exit(255)
+        elif strict_startswith("-interval", argv[0]):
+            opt = argv.pop(0)
+            try:
+                interval = float(argv.pop(0))
+                if interval <= 0:
+                    raise ValueError
+            except (IndexError, ValueError):
+                perror('Option "{}" requires a positive number.'.format(opt))
+                exit(255)
+        elif strict_startswith("-input", argv[0]):
+            opt = argv.pop(0)
+            if not argv:
+                perror('Option "{}" requires a file or -.'.format(opt))
+                exit(255)
+            input_path = argv.pop(0)
+        # -d is -details of iproute2, which isn't implemented
+        elif strict_startswith("-dry-run", argv[0]) and len(argv[0]) > 2:
+            dry_run = True
+            argv.pop(0)
         elif strict_startswith("-json", argv[0]):
             json_print = True
             argv.pop(0)
+        # After -json, which -j abbreviates
+        elif strict_startswith("-jobs", argv[0]):
+            opt = argv.pop(0)
+            try:
+                jobs = int(argv.pop(0))
+                if jobs < 0:
+                    raise ValueError
+            except (IndexError, ValueError):
+                perror(
+                    'Option "{}" requires a non-negative integer.'.format(opt)
+                )
+                exit(255)
         elif strict_startswith("-pretty", argv[0]):
             pretty_json = True
             argv.pop(0)
+        elif strict_startswith("-profile", argv[0]):
+            profile_enable("ip")
+            argv.pop(0)
+        elif strict_startswith("-statistics", argv[0]):
+            stats += 1
+            argv.pop(0)
         elif strict_startswith("-Version", argv[0]):
             print("iproute2mac, v" + VERSION)
             exit(0)
@@ -927,13 +1806,71 @@ def main(argv):
 
     color_scheme = get_color_scheme(color_mode, json_print)
 
+    if input_path is not None:
+        # A capture holds the output of one tool
+        if stats or interval is not None:
+            perror('iproute2mac: "-input" can\'t be combined with "-s".')
+            exit(255)
+        if any_startswith(["neighbor", "neighbour"], argv[0]) and af not in (
+            4,
+            6,
+        ):
+            perror(
+                'iproute2mac: "-input" requires -4 for arp -anl or -6 for'
+                " ndp -an output with neigh."
+            )
+            exit(255)
+        input_enable(input_path)
+
+    if dry_run:
+        dry_run_enable()
+
+    if jobs is not None:
+        if not (
+            input_path not in (None, "-")
+            and strict_startswith("route", argv[0])
+            or strict_startswith("link", argv[0])
+            and len(argv) > 1
+            and strict_startswith("set", argv[1])
+        ):
+            perror(
+                'iproute2mac: "-jobs" is supported only with'
+                ' "ip -input FILE route" and "ip link set"'
+            )
+            exit(255)
+        parallel_enable(jobs)
+
+    # Rate sampling is implemented only for links
+    if interval is not None or count is not None:
+        if (
+            interval is None
+            or not stats
+            or not strict_startswith("link", argv[0])
+        ):
+            perror(
+                'iproute2mac: "-interval" and "-count" are supported only'
+                ' with "ip -s -interval SECONDS link show"'
+            )
+            exit(255)
+        argv.pop(0)
+        return do_link_rate(
+            argv, af, json_print, pretty_json, color_scheme, interval, count
+        )
+
     for cmd, cmd_func in cmds:
         if strict_startswith(cmd, argv[0]):
             argv.pop(0)
             # Functions return true or terminate with exit(255)
             # See help_msg and do_help*
             return cmd_func(
-                argv, af, json_print, pretty_json, color_scheme, brief, oneline
+                argv,
+                af,
+                json_print,
+                pretty_json,
+                color_scheme,
+                brief,
+                oneline,
+                stats,
             )
 
     perror('Object "{}" is unknown, try "ip help".'.format(argv[0]))
@@ -941,4 +1878,6 @@ def main(argv):
 
 
 if __name__ == "__main__":
+    profile_from_env("ip")
+    daemon_forward("ip", sys.argv[1:])
     main(sys.argv[1:])
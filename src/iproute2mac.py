@@ -10,13 +10,16 @@
   Copyright (c) 2015 Bronislav Robenek <brona@robenek.me>
 """
 
-import json
 import os
-import random
-import re
-import subprocess
 import sys
-import types
+import time
+
+# Only modules needed by every command are imported here, others like json
+# or subprocess are imported where used to keep the startup time low
+
+# Clocks when loaded, the baseline of profile timings
+_start_time = time.monotonic()
+_start_cpu = time.process_time()
 
 # Version
 VERSION = "1.7.5"
@@ -28,8 +31,47 @@ ROUTE = "/sbin/route"
 NETSTAT = "/usr/sbin/netstat"
 NDP = "/usr/sbin/ndp"
 ARP = "/usr/sbin/arp"
+LSOF = "/usr/sbin/lsof"
 NETWORKSETUP = "/usr/sbin/networksetup"
 
+# Snapshot daemon, see iproute2macd.py
+DAEMON_SOCKET_ENV = "IPROUTE2MAC_SOCKET"
+DAEMON_TIMEOUT = 10
+# Seconds the daemon waits for the request of a connected client
+DAEMON_REQUEST_TIMEOUT = 1
+# Environment affecting output which is forwarded to the daemon
+DAEMON_ENV = ["TERM", "NO_COLOR", "COLORFGBG"]
+# Default snapshot time to live in seconds per object
+SNAPSHOT_TTL = {
+    "link": 2.0,
+    "route": 2.0,
+    "neigh": 5.0,
+    "socket": 1.0,
+}
+
+# On-disk snapshot cache for bursts of read-only calls, disabled by default
+# IPROUTE2MAC_CACHE=SECONDS enables it with the given TTL
+# IPROUTE2MAC_CONSISTENCY=hard always runs the tools and refreshes the cache
+CACHE_ENV = "IPROUTE2MAC_CACHE"
+CONSISTENCY_ENV = "IPROUTE2MAC_CONSISTENCY"
+
+# Command backend running the tools
+# IPROUTE2MAC_BACKEND=live runs them (default)
+# IPROUTE2MAC_BACKEND=record:DIR runs them and saves their outputs to DIR
+# IPROUTE2MAC_BACKEND=replay:DIR serves saved outputs from DIR instead
+BACKEND_ENV = "IPROUTE2MAC_BACKEND"
+BACKEND_MODES = ["live", "record", "replay"]
+
+# Timings of phases and tool runs, disabled by default
+# IPROUTE2MAC_PROFILE=- or the -profile option prints them to stderr
+# IPROUTE2MAC_PROFILE=FILE appends them to FILE as JSON Lines
+PROFILE_ENV = "IPROUTE2MAC_PROFILE"
+
+# Trace of every tool run, disabled by default
+# IPROUTE2MAC_TRACE=FILE appends one JSON line per run to FILE, see
+# iproute2mactrace.py for latency histograms
+TRACE_ENV = "IPROUTE2MAC_TRACE"
+
 HELP_ADDENDUM = """iproute2mac
 Homepage: https://github.com/brona/iproute2mac
 This is CLI wrapper for basic network utilities on Mac OS X inspired with iproute2 on Linux systems.
@@ -43,14 +85,67 @@ def perror(*args):
     sys.stderr.write("\n")
 
 
-def execute_cmd(cmd):
+def user_tmp_path(suffix):
+    """Per-user file in $TMPDIR, which is also private to the user on macOS"""
+    return os.path.join(
+        os.getenv("TMPDIR", "/tmp"),
+        "iproute2mac-%d.%s" % (os.getuid(), suffix),
+    )
+
+
+def check_mutation(cmd):
+    """Terminates if the mutating command can't be run by this process"""
     if not isinstance(cmd, list):
         raise TypeError(
             "execute_cmd requires a list of argument strings, got %s"
             % type(cmd).__name__
         )
+    require_live()
+    require_direct()
+
+
+def require_live():
+    """Terminates in offline mode, see input_enable"""
+    if _input is not None:
+        perror(
+            "iproute2mac: Captured input can't be changed, use a live system."
+        )
+        exit(255)
+
+
+def run_mutation(cmd):
+    """
+    Runs mutating command checked with check_mutation and returns
+    subprocess.CompletedProcess without printing anything, safe to call
+    from several threads. In dry run mode, it succeeds without running.
+    """
+    import subprocess
+
+    if _dry_run:
+        return subprocess.CompletedProcess(cmd, 0, "", "")
+    invalidate_cache()
+    res = backend_run(cmd)
+    invalidate_cache()
+    return res
+
+
+def sudo_validate():
+    """
+    Asks for the sudo password, if needed, once before sudo commands run
+    concurrently, whose prompts would otherwise compete for the terminal
+    """
+    if _dry_run or not is_live_backend():
+        return True
+    return backend_run([SUDO, "-v"]).returncode == 0
+
+
+def execute_cmd(cmd):
+    check_mutation(cmd)
+    if _dry_run:
+        print("Would execute: %s" % " ".join(cmd))
+        return True
     print("Executing: %s" % " ".join(cmd))
-    res = subprocess.run(cmd, capture_output=True, text=True)
+    res = run_mutation(cmd)
     if res.returncode == 0:
         if res.stderr:
             perror(res.stderr.strip())
@@ -65,14 +160,1096 @@ def execute_cmd(cmd):
         return False
 
 
+# Mutations are only printed, see dry_run_enable
+_dry_run = False
+
+
+def dry_run_enable():
+    """execute_cmd prints the commands it would run instead of running them"""
+    global _dry_run
+    # The daemon runs commands of every client
+    require_direct()
+    _dry_run = True
+
+
+def is_dry_run():
+    return _dry_run
+
+
+# Snapshots of read-only commands, only set inside iproute2macd
+_daemon_snapshots = None
+
+
+class IPRoute2MacError(Exception):
+    """Base of errors raised by the library API, see links()"""
+
+
+class CommandError(IPRoute2MacError):
+    """Tool failed, the message is its output"""
+
+    def __init__(self, cmd, message):
+        super().__init__(message)
+        self.cmd = cmd
+
+
+class NotFoundError(IPRoute2MacError):
+    """Requested device doesn't exist"""
+
+
+def check_result(res):
+    """Returns result of run_cmd, raises CommandError if the tool failed"""
+    if res.returncode != 0:
+        raise CommandError(
+            res.args,
+            (res.stderr + res.stdout).strip()
+            or "%s failed with exit status %d" % (res.args[0], res.returncode),
+        )
+    return res
+
+
+class DaemonFallback(Exception):
+    """Raised inside iproute2macd for commands which must run directly."""
+
+
+def require_direct():
+    """
+    Mutating and long-running commands call this before doing anything,
+    iproute2macd then drops the snapshots and lets the client run it.
+    """
+    if _daemon_snapshots is not None:
+        _daemon_snapshots.clear()
+        raise DaemonFallback()
+
+
+def snapshot_object(cmd):
+    """
+    Returns object kind (see SNAPSHOT_TTL) of read-only command output,
+    None if the output shouldn't be reused.
+    """
+    if cmd[0] == IFCONFIG:
+        return "link"
+    elif cmd[0] in (ARP, NDP):
+        return "neigh"
+    elif cmd[0] == NETSTAT:
+        if "-nr" in cmd:
+            return "route"
+        elif "-ibdn" in cmd:
+            return "link"
+        elif "-na" in cmd or "-nab" in cmd or "-s" in cmd:
+            return "socket"
+    elif cmd[0] == LSOF:
+        return "socket"
+    return None
+
+
+def cache_ttl():
+    """Returns TTL of the on-disk cache in seconds, 0 if disabled"""
+    try:
+        return max(0.0, float(os.getenv(CACHE_ENV, "0")))
+    except ValueError:
+        return 0.0
+
+
+def cache_path():
+    return user_tmp_path("cache")
+
+
+def load_private_json(path):
+    """JSON of file written by write_private_json, None if unusable"""
+    import json
+
+    try:
+        with open(path) as f:
+            # Only trust files written by the same user
+            if os.fstat(f.fileno()).st_uid != os.getuid():
+                return None
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_private_file(path, text):
+    """Replaces file readable only by the user, errors are ignored"""
+    import tempfile
+
+    # A new file of its own, a predictable name in a shared directory
+    # could be a symlink planted by another user
+    try:
+        (fd, tmp) = tempfile.mkstemp(
+            prefix=os.path.basename(path) + ".", dir=os.path.dirname(path)
+        )
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+def write_private_json(path, data):
+    """write_private_file of data as JSON"""
+    import json
+
+    write_private_file(path, json.dumps(data, separators=(",", ":")))
+
+
+def cache_entry_valid(entry):
+    return (
+        isinstance(entry, dict)
+        and isinstance(entry.get("taken"), (int, float))
+        and isinstance(entry.get("stdout"), str)
+        and isinstance(entry.get("stderr"), str)
+    )
+
+
+def load_cache():
+    """Entries of the on-disk cache, malformed ones are misses"""
+    cache = load_private_json(cache_path())
+    if not isinstance(cache, dict):
+        return {}
+    return {k: v for k, v in cache.items() if cache_entry_valid(v)}
+
+
+def store_cache(key, res):
+    now = time.time()
+    ttl = cache_ttl()
+    entries = {k: v for k, v in load_cache().items() if now - v["taken"] < ttl}
+    entries[key] = {"taken": now, "stdout": res.stdout, "stderr": res.stderr}
+    write_private_json(cache_path(), entries)
+
+
+def invalidate_cache():
+    _memo.clear()
+    try:
+        os.unlink(cache_path())
+    except OSError:
+        pass
+
+
+def parse_hardware_ports(res):
+    """
+    Decode networksetup -listallhardwareports output into
+    {device: (hardware port, factory address or None)}
+    """
+    ports = {}
+    for block in res.split("\n\n"):
+        fields = dict(
+            regex(
+                r"(?m)^(Hardware Port|Device|Ethernet Address): (.+)$"
+            ).findall(block)
+        )
+        if "Device" in fields:
+            address = fields.get("Ethernet Address")
+            ports[fields["Device"]] = (
+                fields.get("Hardware Port"),
+                None if address == "N/A" else address,
+            )
+    return ports
+
+
+# Hardware ports of this process, see hardware_ports
+_hardware_ports = None
+
+
+def hardware_ports():
+    """
+    Returns {device: (hardware port, factory address)} from networksetup,
+    which is one of the slowest tools. The ports are kept on disk until the
+    set of interfaces changes, which costs no command to check.
+    """
+    global _hardware_ports
+    # A capture holds the output of one other tool, factory addresses are
+    # only used to change a live system
+    require_live()
+    if _hardware_ports is not None:
+        return _hardware_ports
+
+    import socket
+
+    path = user_tmp_path("ports")
+    interfaces = sorted(name for _, name in socket.if_nameindex())
+    # Recordings are of another system
+    cached = is_live_backend()
+    if cached and os.getenv(CONSISTENCY_ENV) != "hard":
+        entry = load_private_json(path)
+        if isinstance(entry, dict) and entry.get("interfaces") == interfaces:
+            _hardware_ports = {
+                dev: tuple(port) for dev, port in entry["ports"].items()
+            }
+            return _hardware_ports
+
+    res = run_cmd([NETWORKSETUP, "-listallhardwareports"])
+    if res.returncode != 0:
+        perror((res.stderr + res.stdout).strip())
+        return {}
+    _hardware_ports = parse_hardware_ports(res.stdout)
+    if cached:
+        write_private_json(
+            path, {"interfaces": interfaces, "ports": _hardware_ports}
+        )
+    return _hardware_ports
+
+
+def snapshot_run(cmd, obj):
+    key = tuple(cmd)
+    if key in _daemon_snapshots:
+        (taken, res) = _daemon_snapshots[key]
+        if time.monotonic() - taken < SNAPSHOT_TTL[obj]:
+            return res
+    res = backend_run(cmd)
+    if res.returncode == 0:
+        _daemon_snapshots[key] = (time.monotonic(), res)
+    return res
+
+
+def cache_run(cmd):
+    import subprocess
+
+    key = "\0".join(cmd)
+    if os.getenv(CONSISTENCY_ENV) != "hard":
+        entry = load_cache().get(key)
+        if entry and time.time() - entry["taken"] < cache_ttl():
+            return subprocess.CompletedProcess(
+                cmd, 0, entry["stdout"], entry["stderr"]
+            )
+    res = backend_run(cmd)
+    if res.returncode == 0:
+        store_cache(key, res)
+    return res
+
+
+def command_backend():
+    """
+    Returns (mode, directory) of the command backend set by
+    IPROUTE2MAC_BACKEND, directory is None in live mode.
+    """
+    value = os.getenv(BACKEND_ENV, "live")
+    (mode, _, directory) = value.partition(":")
+    if mode not in BACKEND_MODES or (mode == "live") != (not directory):
+        perror("Invalid %s: %s" % (BACKEND_ENV, value))
+        exit(255)
+    return (mode, directory or None)
+
+
+def is_live_backend():
+    return command_backend()[0] == "live"
+
+
+def recording_path(directory, cmd):
+    import hashlib
+
+    key = hashlib.sha1("\0".join(cmd).encode()).hexdigest()
+    return os.path.join(directory, key + ".json")
+
+
+def record_output(directory, cmd, res):
+    import json
+
+    os.makedirs(directory, exist_ok=True)
+    with open(recording_path(directory, cmd), "w") as f:
+        json.dump(
+            {
+                "cmd": cmd,
+                "returncode": res.returncode,
+                "stdout": res.stdout,
+                "stderr": res.stderr,
+            },
+            f,
+            indent=4,
+        )
+
+
+def replay_output(directory, cmd):
+    import json
+    import subprocess
+
+    try:
+        with open(recording_path(directory, cmd)) as f:
+            rec = json.load(f)
+    except (OSError, ValueError):
+        return subprocess.CompletedProcess(
+            cmd, 127, "", "No recording of: %s\n" % " ".join(cmd)
+        )
+    return subprocess.CompletedProcess(
+        cmd, rec["returncode"], rec["stdout"], rec["stderr"]
+    )
+
+
+def backend_run(cmd):
+    """
+    Runs the command with the backend set by IPROUTE2MAC_BACKEND, this is
+    the only place where the tools are executed.
+    """
+    import subprocess
+
+    (mode, directory) = command_backend()
+    start = time.monotonic()
+    if mode == "replay":
+        res = replay_output(directory, cmd)
+    else:
+        res = subprocess.run(cmd, capture_output=True, text=True)
+        if mode == "record":
+            record_output(directory, cmd, res)
+    if _profile is not None:
+        profile_command(cmd, start, res)
+    trace = os.getenv(TRACE_ENV)
+    if trace:
+        trace_command(trace, cmd, start, res, mode)
+    return res
+
+
+def trace_command(path, cmd, start, res, mode):
+    import json
+
+    duration = time.monotonic() - start
+    line = json.dumps(
+        {
+            "time": round(time.time() - duration, 6),
+            "pid": os.getpid(),
+            "cmd": cmd,
+            "backend": mode,
+            "duration": round(duration, 6),
+            "returncode": res.returncode,
+            "stdout_bytes": len(res.stdout),
+            "stderr_bytes": len(res.stderr),
+        }
+    )
+    try:
+        # Single append write, so lines of concurrent calls don't interleave
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, (line + "\n").encode())
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+
+# Profile of this process, only set when profiling is enabled
+_profile = None
+_profile_mark = _start_time
+
+
+def profile_enable(prog, target="-"):
+    """
+    Starts recording timings of phases and tool runs. They are written as
+    one JSON object to stderr ("-") or appended to target file at exit.
+    """
+    global _profile
+    if _profile is not None:
+        return
+    # Timings of the daemon would be meaningless to the client
+    require_direct()
+    import atexit
+
+    _profile = {
+        "prog": prog,
+        "argv": sys.argv[1:],
+        "version": VERSION,
+        # Interpreter startup until this module was loaded
+        "startup_cpu": round(_start_cpu, 6),
+        "phases": [],
+        "commands": [],
+    }
+    profile_mark("startup")
+    atexit.register(profile_report, target)
+
+
+def profile_from_env(prog):
+    target = os.getenv(PROFILE_ENV)
+    if target:
+        profile_enable(prog, target)
+
+
+def profile_mark(phase, rows=None, size=None):
+    """
+    Records phase lasting from the previous mark until now, with number of
+    rows and bytes it produced or consumed if known. No-op unless enabled.
+    """
+    global _profile_mark
+    if _profile is None:
+        return
+    now = time.monotonic()
+    entry = {
+        "phase": phase,
+        "start": round(_profile_mark - _start_time, 6),
+        "duration": round(now - _profile_mark, 6),
+    }
+    if rows is not None:
+        entry["rows"] = rows
+    if size is not None:
+        entry["bytes"] = size
+    _profile["phases"].append(entry)
+    _profile_mark = now
+
+
+def profile_command(cmd, start, res):
+    _profile["commands"].append(
+        {
+            "cmd": cmd,
+            "start": round(start - _start_time, 6),
+            "duration": round(time.monotonic() - start, 6),
+            "returncode": res.returncode,
+            "stdout_bytes": len(res.stdout),
+            "stderr_bytes": len(res.stderr),
+        }
+    )
+
+
+def profile_report(target):
+    import json
+
+    _profile["total"] = round(time.monotonic() - _start_time, 6)
+    _profile["cpu"] = round(time.process_time(), 6)
+    line = json.dumps(_profile) + "\n"
+    if target == "-":
+        sys.stderr.write(line)
+    else:
+        try:
+            with open(target, "a") as f:
+                f.write(line)
+        except OSError as e:
+            perror("iproute2mac: Cannot write profile: %s" % e)
+
+
+class Capture:
+    """
+    Tool output captured to a file, or "-" for stdin, standing in for the
+    stdout text of commands in offline mode (see input_enable).
+
+    Parsers iterate it by lines with output_lines. Files are memory-mapped
+    and decoded a chunk at a time, so captures larger than memory can be
+    parsed without ever being one string. len() is the size in bytes.
+    Captures of files may also be a byte range, see split and section.
+    """
+
+    CHUNK = 1 << 22
+
+    def __init__(self, path, start=0, end=None):
+        self.path = path
+        self.start = start
+        if end is None:
+            end = 0 if path == "-" else os.path.getsize(path)
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _map(self):
+        import mmap
+
+        with open(self.path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def split(self, parts):
+        """
+        Splits the capture of a file at line boundaries into at most parts
+        Captures of similar size, e.g. to parse them in parallel_map
+        """
+        if self.path == "-" or len(self) == 0:
+            return [self]
+        with self._map() as mm:
+            bounds = [self.start]
+            for i in range(1, parts):
+                cut = self.start + len(self) * i // parts
+                if cut <= bounds[-1]:
+                    continue
+                cut = mm.find(b"\n", cut - 1, self.end) + 1
+                if cut <= bounds[-1]:
+                    break
+                bounds.append(cut)
+        bounds.append(self.end)
+        return [
+            Capture(self.path, start, end)
+            for start, end in zip(bounds, bounds[1:])
+            if end > start
+        ]
+
+    def section(self, title):
+        """
+        Capture of the lines following a "title" line up to the next empty
+        line, e.g. the Internet: table of netstat -nr, None when missing
+        """
+        if self.path == "-" or len(self) == 0:
+            return None
+        title = title.encode()
+        with self._map() as mm:
+            if mm[self.start : self.start + len(title) + 1] == title + b"\n":
+                start = self.start + len(title) + 1
+            else:
+                start = mm.find(b"\n" + title + b"\n", self.start, self.end)
+                if start < 0:
+                    return None
+                start += len(title) + 2
+            end = mm.find(b"\n\n", start - 1, self.end) + 1 or self.end
+        return Capture(self.path, start, max(start, end))
+
+    def __iter__(self):
+        if self.path == "-":
+            for line in sys.stdin:
+                yield line.rstrip("\n")
+            return
+        if self.end <= self.start:
+            return
+
+        import mmap
+
+        with self._map() as mm:
+            # Pages of parsed chunks are released, memory use stays at a
+            # chunk however large the capture is
+            release = hasattr(mm, "madvise") and hasattr(mmap, "MADV_DONTNEED")
+            if release and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            start = self.start
+            while start < self.end:
+                # Chunks end at a line boundary
+                end = mm.rfind(b"\n", start, min(start + self.CHUNK, self.end))
+                end += 1
+                if end <= start:
+                    end = (
+                        mm.find(b"\n", start + self.CHUNK, self.end) + 1
+                        or self.end
+                    )
+                chunk = mm[start:end]
+                if release:
+                    page = start - start % mmap.PAGESIZE
+                    mm.madvise(mmap.MADV_DONTNEED, page, end - page)
+                yield from chunk.decode(errors="replace").splitlines()
+                start = end
+
+
+class LineFeed:
+    """
+    Output streaming from a process, see run_cmd_async. The event loop puts
+    chunks read from the pipe and a parser in another thread iterates the
+    lines as they arrive. len() is the size in bytes received so far.
+    """
+
+    def __init__(self):
+        import queue
+
+        self.chunks = queue.SimpleQueue()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def put(self, data):
+        """Adds chunk of bytes, None ends the output"""
+        if data is not None:
+            self.size += len(data)
+        self.chunks.put(data)
+
+    def __iter__(self):
+        import codecs
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        rest = ""
+        while (data := self.chunks.get()) is not None:
+            lines = (rest + decoder.decode(data)).split("\n")
+            rest = lines.pop()
+            yield from lines
+        rest += decoder.decode(b"", final=True)
+        if rest:
+            yield rest
+
+
+def output_lines(res, skip=0):
+    """
+    Lines of tool output, text, Capture or LineFeed, without the first
+    skip lines
+    """
+    if isinstance(res, str):
+        return res.splitlines()[skip:]
+    import itertools
+
+    return itertools.islice(res, skip, None)
+
+
+def parallel_map(func, capture, jobs):
+    """
+    Applies func to parts of the capture split at line boundaries, in a
+    pool of jobs processes (0 for one per core), and returns the results
+    in order. func must be a module level function, or a partial of one,
+    and the results are pickled back, so reducing them in the workers,
+    e.g. to counts, pays off.
+    """
+    jobs = jobs or os.cpu_count()
+    # More parts than processes even out their speed
+    parts = capture.split(4 * jobs)
+    if len(parts) == 1 or jobs == 1:
+        return list(map(func, parts))
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(min(jobs, len(parts))) as pool:
+        return list(pool.map(func, parts))
+
+
+# Workers of parallel work, see parallel_enable
+_jobs = None
+
+
+def parallel_enable(jobs):
+    """
+    Large captures are parsed by parallel_map and mutations of several
+    links are run by jobs workers, 0 for one per core
+    """
+    global _jobs
+    # The daemon would keep the setting for commands of other clients
+    require_direct()
+    _jobs = jobs
+
+
+def parallel_jobs():
+    """Workers set with parallel_enable, None if work runs in this thread"""
+    return _jobs
+
+
+# Capture parsed instead of running tools, see input_enable
+_input = None
+
+
+def input_enable(path):
+    """
+    Offline mode, the capture at path ("-" for stdin) stands in for the
+    output of every read-only command and mutations are refused
+    """
+    global _input
+    # The daemon has neither the file nor stdin of the client
+    require_direct()
+    try:
+        _input = Capture(path)
+    except OSError as e:
+        perror("Cannot open input: %s" % e)
+        exit(1)
+
+
+def is_offline():
+    """True when tools are not run but their output read with input_enable"""
+    return _input is not None
+
+
+# Results of read-only commands already run by this process
+_memo = {}
+
+
+def run_cmd(cmd, check=False, fresh=False):
+    """
+    Runs read-only command and returns subprocess.CompletedProcess.
+
+    Identical commands are run only once per process, until a mutation
+    with execute_cmd. Inside iproute2macd, successful results are reused
+    until the snapshot TTL of their object expires. Otherwise, when enabled
+    with IPROUTE2MAC_CACHE, they are reused from the on-disk cache.
+    With fresh, the command is always run, e.g. for sampling counters.
+    In offline mode, the output is the Capture instead.
+    """
+    if _input is not None:
+        import subprocess
+
+        return subprocess.CompletedProcess(cmd, 0, _input, "")
+
+    key = tuple(cmd)
+    res = None if fresh else _memo.get(key)
+    if res is None:
+        obj = None if fresh else snapshot_object(cmd)
+        if obj is not None and _daemon_snapshots is not None:
+            res = snapshot_run(cmd, obj)
+        elif obj is not None and cache_ttl() and is_live_backend():
+            res = cache_run(cmd)
+        else:
+            res = backend_run(cmd)
+        # The daemon keeps its own snapshots with a TTL
+        if res.returncode == 0 and _daemon_snapshots is None:
+            _memo[key] = res
+    if check:
+        res.check_returncode()
+    return res
+
+
+async def stream_cmd(cmd, parse):
+    """
+    Runs cmd as asyncio subprocess feeding its output to parse in a thread,
+    returns subprocess.CompletedProcess and the finished parsing future.
+    When cancelled, the command is killed and the parser gets end of output.
+    """
+    import asyncio
+    import subprocess
+
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    feed = LineFeed()
+    parsing = asyncio.ensure_future(asyncio.to_thread(parse, feed))
+    errors = asyncio.ensure_future(proc.stderr.read())
+    chunks = []
+    try:
+        while data := await proc.stdout.read(Capture.CHUNK):
+            feed.put(data)
+            chunks.append(data)
+        feed.put(None)
+        stderr = await errors
+        await proc.wait()
+        await asyncio.wait([parsing])
+    except BaseException:
+        feed.put(None)
+        parsing.cancel()
+        errors.cancel()
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+
+    res = subprocess.CompletedProcess(
+        cmd,
+        proc.returncode,
+        b"".join(chunks).decode(errors="replace"),
+        stderr.decode(errors="replace"),
+    )
+    return (res, parsing)
+
+
+def parse_nothing(res):
+    """Drains the output, the parse of run_cmd_async without a parser"""
+    for _ in output_lines(res):
+        pass
+
+
+async def run_cmd_async(cmd, parse=None):
+    """
+    Runs read-only command with the backend like backend_run, without
+    blocking the event loop, and returns (subprocess.CompletedProcess,
+    parse(output)). The parser runs in a thread and iterates the lines of a
+    LineFeed while they are read. Parsers expect output of a successful
+    command, so when it fails the parsed value is None. When cancelled,
+    e.g. by the timeout of asyncio.wait_for, the command is killed.
+
+    Unlike run_cmd, the command is always run, the memo, daemon snapshots
+    and on-disk cache are not used.
+    """
+    import asyncio
+
+    (mode, directory) = command_backend()
+    start = time.monotonic()
+    if mode == "replay":
+        res = replay_output(directory, cmd)
+        parsing = asyncio.ensure_future(
+            asyncio.to_thread(parse or parse_nothing, res.stdout)
+        )
+        await asyncio.wait([parsing])
+    else:
+        (res, parsing) = await stream_cmd(cmd, parse or parse_nothing)
+        if mode == "record":
+            record_output(directory, cmd, res)
+    if _profile is not None:
+        profile_command(cmd, start, res)
+    trace = os.getenv(TRACE_ENV)
+    if trace:
+        trace_command(trace, cmd, start, res, mode)
+
+    if res.returncode != 0:
+        # Retrieved, or asyncio would log it as never retrieved
+        parsing.exception()
+        return (res, None)
+    return (res, parsing.result())
+
+
+def daemon_socket_path():
+    return os.getenv(DAEMON_SOCKET_ENV) or user_tmp_path("sock")
+
+
+def daemon_forward(prog, argv):
+    """
+    Serves the command by iproute2macd and exits, if the daemon is running.
+    Returns when the daemon is absent or the command must run directly.
+    """
+    # Recording, replaying, profiling and tracing need the tools run by this
+    # process, consistency=hard output which isn't from a snapshot
+    if (
+        not is_live_backend()
+        or _profile is not None
+        or os.getenv(TRACE_ENV)
+        or os.getenv(CONSISTENCY_ENV) == "hard"
+    ):
+        return
+    path = daemon_socket_path()
+    try:
+        # Only trust sockets created by the same user
+        if os.stat(path).st_uid != os.getuid():
+            return
+    except OSError:
+        return
+
+    import json
+    import socket
+
+    request = {
+        "prog": prog,
+        "argv": argv,
+        "tty": sys.stdout.isatty(),
+        "env": {k: os.environ[k] for k in DAEMON_ENV if k in os.environ},
+    }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(DAEMON_TIMEOUT)
+            s.connect(path)
+            s.sendall(json.dumps(request).encode() + b"\n")
+            s.shutdown(socket.SHUT_WR)
+            chunks = []
+            while chunk := s.recv(65536):
+                chunks.append(chunk)
+        reply = json.loads(b"".join(chunks))
+    except (OSError, ValueError):
+        return
+
+    if reply.get("status") != "ok":
+        return
+    sys.stdout.write(reply["stdout"])
+    sys.stdout.flush()
+    sys.stderr.write(reply["stderr"])
+    sys.exit(reply["code"])
+
+
+class Record:
+    """
+    Parsed row with fields in __slots__ instead of a dict per row, which
+    takes a fraction of the memory for large tables.
+
+    Records are used like the dicts they replace, r["dev"], r.get("dev"),
+    "dev" in r and r["dev"] = value work and unset fields are absent keys.
+    to_json() builds the dict only when serializing, with set fields in slot
+    order which follows the order of iproute2 JSON output.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return hasattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def to_json(self):
+        return {
+            name: getattr(self, name)
+            for name in self.__slots__
+            if hasattr(self, name)
+        }
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_json() == other.to_json()
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.to_json())
+
+
+class Link(Record):
+    __slots__ = (
+        "ifindex",
+        "ifname",
+        "flags",
+        "mtu",
+        "operstate",
+        "link_type",
+        "address",
+        "broadcast",
+        "addr_info",
+        "bridge",
+        "stats64",
+    )
+
+
+class Address(Record):
+    __slots__ = ("family", "local", "prefixlen", "address", "broadcast")
+
+
+class Route(Record):
+    __slots__ = ("type", "dst", "gateway", "dev", "scope", "flags")
+
+
+class Neighbour(Record):
+    __slots__ = ("dst", "lladdr", "dev", "state", "router")
+
+
+class BridgeLink(Record):
+    __slots__ = (
+        "ifindex",
+        "ifname",
+        "flags",
+        "mtu",
+        "master",
+        "state",
+        "priority",
+        "cost",
+    )
+
+
+class SocketUser(Record):
+    __slots__ = ("command", "pid", "fd")
+
+    def __init__(self, command, pid, fd):
+        self.command = command
+        self.pid = pid
+        self.fd = fd
+
+
+class Socket(Record):
+    __slots__ = (
+        "netid",
+        "state",
+        "recv_q",
+        "send_q",
+        "local_addr",
+        "local_port",
+        "peer_addr",
+        "peer_port",
+        "bytes_sent",
+        "bytes_received",
+        "tx_rate",
+        "rx_rate",
+        "users",
+    )
+
+    # Sockets are the largest tables, positional fields are much faster
+    def __init__(
+        self,
+        netid,
+        state,
+        recv_q,
+        send_q,
+        local_addr,
+        local_port,
+        peer_addr,
+        peer_port,
+    ):
+        self.netid = netid
+        self.state = state
+        self.recv_q = recv_q
+        self.send_q = send_q
+        self.local_addr = local_addr
+        self.local_port = local_port
+        self.peer_addr = peer_addr
+        self.peer_port = peer_port
+
+    # Pickled by parallel_map workers, positional fields are again faster
+    # than the generic state of all slots
+    def __reduce__(self):
+        fields = (
+            self.netid,
+            self.state,
+            self.recv_q,
+            self.send_q,
+            self.local_addr,
+            self.local_port,
+            self.peer_addr,
+            self.peer_port,
+        )
+        extra = {
+            name: getattr(self, name)
+            for name in self.__slots__[8:]
+            if hasattr(self, name)
+        }
+        return (Socket, fields, (None, extra) if extra else None)
+
+
+def without_gc(func):
+    """
+    Decorator pausing the cyclic garbage collector in parsers. Records have
+    no reference cycles, but unlike dicts of strings they are tracked by the
+    collector, which would keep rescanning the growing table.
+    """
+
+    import functools
+
+    # Keeps the name of func, parallel_map pickles parsers by name
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        import gc
+
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if enabled:
+                gc.enable()
+
+    return inner
+
+
+# Flag and state lists shared by all records with the same value
+_shared_lists = {}
+NO_FLAGS = ()
+
+
+def shared_list(values):
+    """
+    Returns interned tuple of the values, records keep flags and states in
+    these instead of a list per row. JSON output is the same as for a list.
+    """
+    values = tuple(values)
+    try:
+        return _shared_lists[values]
+    except KeyError:
+        return _shared_lists.setdefault(values, tuple(map(sys.intern, values)))
+
+
+def json_default(obj):
+    if isinstance(obj, Record):
+        return obj.to_json()
+    raise TypeError(
+        "Object of type %s is not JSON serializable" % type(obj).__name__
+    )
+
+
 def json_dump(data, pretty):
+    import json
+
     if pretty:
-        print(json.dumps(data, indent=4))
+        print(json.dumps(data, indent=4, default=json_default))
     else:
-        print(json.dumps(data, separators=(",", ":")))
+        print(json.dumps(data, separators=(",", ":"), default=json_default))
+    profile_mark("render", rows=len(data))
     return True
 
 
+_regexes = {}
+
+
+def regex(pattern):
+    """
+    Returns compiled pattern, re is imported and the pattern compiled only
+    when first used.
+    """
+    compiled = _regexes.get(pattern)
+    if compiled is None:
+        import re
+
+        compiled = _regexes[pattern] = re.compile(pattern)
+    return compiled
+
+
 # Classful to CIDR conversion with "default" being passed through
 def cidr_from_netstat_dst(target):
     if target == "default":
@@ -112,6 +1289,8 @@ def help_msg(help_func):
     def wrapper(func):
         def inner(*args, **kwargs):
             if not func(*args, **kwargs):
+                import types
+
                 if help_func:
                     if isinstance(help_func, types.FunctionType):
                         if args and kwargs:
@@ -137,6 +1316,8 @@ def randomMAC():
     Generate random MAC address with XenSource Inc. OUI
     http://www.linux-kvm.com/sites/default/files/macgen.py
     """
+    import random
+
     mac = [
         0x00,
         0x16,
@@ -169,6 +1350,19 @@ C_BOLD_WHITE = "\033[1;37m"
 C_CLEAR = "\033[0m"
 
 
+# System terminfo directories, searched after $TERMINFO and ~/.terminfo
+TERMINFO_DIRS = [
+    "/usr/share/terminfo",
+    "/usr/lib/terminfo",
+    "/lib/terminfo",
+    "/etc/terminfo",
+    "/opt/homebrew/share/terminfo",
+    "/usr/local/share/terminfo",
+]
+# Index of max_colors in terminfo numbers section, see term.h
+TERMINFO_MAX_COLORS = 13
+
+
 # color_attr
 COLOR_IFNAME = 0
 COLOR_MAC = 1
@@ -273,33 +1467,124 @@ def _check_enable_color(color, json):
     if not sys.stdout.isatty():
         return False
 
-    try:
-        # Use tput to check color support
-        colors = int(
-            subprocess.check_output(
-                ["tput", "colors"], stderr=subprocess.DEVNULL
-            )
-            .decode()
-            .strip()
-        )
+    term = os.getenv("TERM", "")
+    colors = terminal_colors(term)
+    if colors is not None:
         return colors >= 8
-    except (subprocess.CalledProcessError, ValueError):
-        # If tput fails or returns invalid output, fall back to TERM check
-        term = os.getenv("TERM", "")
-        if term == "dumb":
-            return False
-
-        color_terms = [
-            "xterm",
-            "xterm-color",
-            "xterm-256color",
-            "linux",
-            "screen",
-            "screen-256color",
-            "vt100",
-            "rxvt",
-        ]
-        return any(term.startswith(t) for t in color_terms)
+
+    # If terminfo is not available, fall back to TERM check
+    if term == "dumb":
+        return False
+
+    color_terms = [
+        "xterm",
+        "xterm-color",
+        "xterm-256color",
+        "linux",
+        "screen",
+        "screen-256color",
+        "vt100",
+        "rxvt",
+    ]
+    return any(term.startswith(t) for t in color_terms)
+
+
+def terminfo_colors(term):
+    """
+    Reads max_colors capability from compiled terminfo entry of the terminal,
+    same as "tput colors" does, without running it.
+
+    Returns:
+        int: Number of colors, -1 if not supported, None if entry not found
+    """
+    if not term or "/" in term:
+        return None
+
+    dirs = []
+    if os.getenv("TERMINFO"):
+        dirs.append(os.getenv("TERMINFO"))
+    dirs.append(os.path.expanduser("~/.terminfo"))
+    # Empty entry stands for the system default directories
+    for d in os.getenv("TERMINFO_DIRS", "").split(":"):
+        if d:
+            dirs.append(d)
+    dirs.extend(TERMINFO_DIRS)
+
+    for d in dirs:
+        # Linux uses first letter, macOS its hexadecimal code as subdirectory
+        for sub in (term[0], "%02x" % ord(term[0])):
+            try:
+                with open(os.path.join(d, sub, term), "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            return parse_terminfo_colors(data)
+    return None
+
+
+def parse_terminfo_colors(data):
+    """
+    Parses max_colors out of compiled terminfo, see term(5).
+
+    Returns:
+        int: Number of colors, -1 if not supported, None if invalid
+    """
+    if len(data) < 12:
+        return None
+    header = [
+        int.from_bytes(data[i : i + 2], "little") for i in range(0, 12, 2)
+    ]
+    (magic, names_size, bools_count, nums_count) = header[:4]
+    if magic == 0o432:
+        num_size = 2
+    elif magic == 0o1036:
+        num_size = 4
+    else:
+        return None
+    if nums_count <= TERMINFO_MAX_COLORS:
+        return -1
+
+    offset = 12 + names_size + bools_count
+    # Numbers section starts on even byte
+    offset += offset % 2
+    offset += TERMINFO_MAX_COLORS * num_size
+    if len(data) < offset + num_size:
+        return None
+    colors = int.from_bytes(
+        data[offset : offset + num_size], "little", signed=True
+    )
+    return colors if colors >= 0 else -1
+
+
+def terminal_colors(term):
+    """
+    Returns number of colors of the terminal (see terminfo_colors),
+    memoized per TERM in a small cache file.
+    """
+    path = user_tmp_path("colors")
+    cached = {}
+    try:
+        with open(path) as f:
+            if os.fstat(f.fileno()).st_uid == os.getuid():
+                for line in f:
+                    (name, _, value) = line.rstrip("\n").rpartition(" ")
+                    cached[name] = None if value == "?" else int(value)
+    except (OSError, ValueError):
+        cached = {}
+
+    if term in cached:
+        return cached[term]
+
+    colors = terminfo_colors(term)
+    cached[term] = colors
+    write_private_file(
+        path,
+        "".join(
+            "%s %s\n" % (name, "?" if value is None else value)
+            for name, value in cached.items()
+        ),
+    )
+    return colors
 
 
 def colorize(scheme, attr, text, ljust=0):
@@ -363,3 +1648,218 @@ def colorize_op_state(scheme, state, ljust=0):
         return colorize(scheme, COLOR_OPERSTATE_DOWN, state, ljust)
     else:
         return str(state).ljust(ljust)
+
+
+# Color prefix and suffix per attribute, precomputed for each scheme
+_COLOR_TABLES = {
+    "none": [("", "")] * len(_COLOR_ATTR),
+    "light": [(c, C_CLEAR) for c in _ATTR_COLORS_LIGHT],
+    "dark": [(c, C_CLEAR) for c in _ATTR_COLORS_DARK],
+}
+
+# Rendered text is written to stdout in chunks of about this many characters
+RENDER_BUFSIZE = 1 << 16
+
+
+class Renderer:
+    """
+    Buffered text output for show commands.
+
+    Produces the same text as colorize_* functions using color tables looked
+    up once per scheme, collects lines and writes them to stdout in large
+    chunks instead of one print() per line. Use as context manager or call
+    flush() when done.
+    """
+
+    def __init__(self, scheme, bufsize=RENDER_BUFSIZE):
+        self.table = _COLOR_TABLES["none" if scheme is None else scheme]
+        self.colored = scheme not in ("none", None)
+        self.bufsize = bufsize
+        self.lines = []
+        self.size = 0
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def color(self, attr, text, ljust=0):
+        if not self.colored:
+            return text.ljust(ljust)
+        (prefix, suffix) = self.table[attr]
+        return prefix + text + suffix + " " * (ljust - len(text))
+
+    def ifname(self, ifname, ljust=0):
+        return self.color(COLOR_IFNAME, ifname, ljust)
+
+    def mac(self, mac):
+        return self.color(COLOR_MAC, mac)
+
+    def inet(self, af, inet, ljust=0):
+        if inet == "default" or af not in ("inet", "inet6"):
+            return str(inet).ljust(ljust)
+        return self.color(
+            COLOR_INET if af == "inet" else COLOR_INET6, inet, ljust
+        )
+
+    def op_state(self, state, ljust=0):
+        if state == "UP":
+            return self.color(COLOR_OPERSTATE_UP, state, ljust)
+        elif state == "DOWN":
+            return self.color(COLOR_OPERSTATE_DOWN, state, ljust)
+        return str(state).ljust(ljust)
+
+    def line(self, text):
+        self.lines.append(text)
+        self.rows += 1
+        self.size += len(text) + 1
+        if self.size >= self.bufsize:
+            self.write()
+
+    def write(self):
+        if self.lines:
+            self.lines.append("")
+            sys.stdout.write("\n".join(self.lines))
+            self.lines = []
+            self.size = 0
+        sys.stdout.flush()
+
+    def flush(self):
+        """Writes buffered lines, ending the render phase of a profile"""
+        self.write()
+        profile_mark("render", rows=self.rows)
+        self.rows = 0
+
+
+# Library API
+#
+# Python programs query network state in-process with these, instead of
+# running ip -j, ss -j or bridge -j and decoding JSON. They return records
+# (see Record) in the order of the CLI output and raise IPRoute2MacError,
+# or OSError if a tool can't be run, instead of printing and exiting.
+# Unlike a CLI run, every call collects fresh output, only the daemon
+# snapshots and the on-disk cache are reused within their TTL.
+
+
+def links(dev=None, up=False, stats=False):
+    """Links like ip [ -s ] link show [ dev DEV ] [ up ]"""
+    import ip
+
+    _memo.clear()
+    return ip.get_links(dev, up, stats=stats)
+
+
+def addresses(dev=None, up=False, af=None):
+    """Links with addr_info like ip [ -4 | -6 ] addr show [ dev DEV ] [ up ]"""
+    import ip
+
+    _memo.clear()
+    return ip.get_links(dev, up, af or -1, address=True)
+
+
+def routes(af=4, exact=None):
+    """Routes like ip [ -6 ] route show [ exact PREFIX ], af is 4 or 6"""
+    import ip
+
+    _memo.clear()
+    return ip.get_routes(af, exact)
+
+
+def neighbours(af=None, dev=None, prefix=None):
+    """Neighbours like ip [ -4 | -6 ] neigh show [ PREFIX ] [ dev DEV ]"""
+    import ip
+
+    _memo.clear()
+    return ip.get_neighbours(af or -1, dev, prefix)
+
+
+def sockets(processes=False, byte_counts=False, **filters):
+    """
+    Sockets like ss -a with filters of ss.iter_netstat, e.g. only_tcp=True,
+    users with processes and counters with byte_counts like ss -p and -i
+    """
+    import ss
+
+    _memo.clear()
+    filters.setdefault("include_listening", True)
+    return ss.get_sockets(processes, byte_counts, **filters)
+
+
+def bridge_links(dev=None):
+    """Bridge members like bridge link show [ dev DEV ]"""
+    import bridge
+
+    _memo.clear()
+    return bridge.get_bridge_links(dev)
+
+
+# Async library API
+#
+# Coroutines of the library API for asyncio programs, collecting without
+# blocking the event loop: tools run as asyncio subprocesses and parsers
+# consume their output in a thread while it is read (see run_cmd_async).
+# Several objects are collected concurrently with asyncio.gather. With a
+# timeout in seconds, asyncio.TimeoutError is raised and the tools still
+# running are killed, as on cancellation of the coroutine. Every call runs
+# the tools, neither the daemon snapshots nor the on-disk cache are used.
+
+
+async def wait_timeout(collect, timeout):
+    import asyncio
+
+    return await asyncio.wait_for(collect, timeout)
+
+
+async def links_async(dev=None, up=False, stats=False, timeout=None):
+    """links without blocking"""
+    import ip
+
+    return await wait_timeout(
+        ip.get_links_async(dev, up, stats=stats), timeout
+    )
+
+
+async def addresses_async(dev=None, up=False, af=None, timeout=None):
+    """addresses without blocking"""
+    import ip
+
+    return await wait_timeout(
+        ip.get_links_async(dev, up, af or -1, address=True), timeout
+    )
+
+
+async def routes_async(af=4, exact=None, timeout=None):
+    """routes without blocking"""
+    import ip
+
+    return await wait_timeout(ip.get_routes_async(af, exact), timeout)
+
+
+async def neighbours_async(af=None, dev=None, prefix=None, timeout=None):
+    """neighbours without blocking"""
+    import ip
+
+    return await wait_timeout(
+        ip.get_neighbours_async(af or -1, dev, prefix), timeout
+    )
+
+
+async def sockets_async(
+    processes=False, byte_counts=False, timeout=None, **filters
+):
+    """sockets without blocking"""
+    import ss
+
+    filters.setdefault("include_listening", True)
+    return await wait_timeout(
+        ss.get_sockets_async(processes, byte_counts, **filters), timeout
+    )
+
+
+async def bridge_links_async(dev=None, timeout=None):
+    """bridge_links without blocking"""
+    import bridge
+
+    return await wait_timeout(bridge.get_bridge_links_async(dev), timeout)
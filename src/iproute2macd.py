@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+
+"""
+  iproute2mac
+  CLI wrapper for basic network utilities on Mac OS X.
+  Homepage: https://github.com/brona/iproute2mac
+
+  The MIT License (MIT)
+  Copyright (c) 2015 Bronislav Robenek <brona@robenek.me>
+"""
+
+import io
+import json
+import os
+import socket
+import sys
+
+import bridge
+import ip
+import iproute2mac
+import ss
+from iproute2mac import *
+
+progs = {
+    "ip": ip.main,
+    "ss": ss.main,
+    "bridge": bridge.main,
+}
+
+
+class CapturedOutput(io.StringIO):
+    """Stands in for stdout/stderr of the client, including its tty state"""
+
+    def __init__(self, tty):
+        super().__init__()
+        self.tty = tty
+
+    def isatty(self):
+        return self.tty
+
+
+def serve_request(request):
+    """
+    Runs the requested command in-process with captured output.
+
+    Returns:
+        dict: Reply with "status" being "ok" or "fallback"
+    """
+    if request.get("prog") not in progs:
+        return {"status": "fallback"}
+
+    stdout = CapturedOutput(bool(request.get("tty")))
+    stderr = CapturedOutput(bool(request.get("tty")))
+    saved_env = {k: os.environ.get(k) for k in DAEMON_ENV}
+    for k in DAEMON_ENV:
+        os.environ.pop(k, None)
+    os.environ.update(request.get("env", {}))
+    sys.stdout, sys.stderr = stdout, stderr
+
+    code = 0
+    try:
+        progs[request["prog"]](list(request.get("argv", [])))
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            stderr.write(str(e.code) + "\n")
+            code = 1
+    except Exception:
+        # DaemonFallback or a failure the client reports by running directly
+        return {"status": "fallback"}
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        for k, v in saved_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+    return {
+        "status": "ok",
+        "stdout": stdout.getvalue(),
+        "stderr": stderr.getvalue(),
+        "code": code,
+    }
+
+
+def handle_connection(conn):
+    with conn:
+        # Connections are served one at a time, a client which never ends
+        # its request would block all others
+        conn.settimeout(DAEMON_REQUEST_TIMEOUT)
+        chunks = []
+        try:
+            while chunk := conn.recv(65536):
+                chunks.append(chunk)
+            request = json.loads(b"".join(chunks))
+        except (OSError, ValueError):
+            reply = {"status": "fallback"}
+        else:
+            reply = serve_request(request)
+        conn.sendall(json.dumps(reply).encode())
+
+
+def do_help():
+    perror("Usage: iproute2macd [ -socket PATH ] [ -ttl OBJECT=SECONDS ]...")
+    perror("where  OBJECT := { %s }" % " | ".join(SNAPSHOT_TTL))
+    perror("")
+    perror("Keeps snapshots of link, address, route, neighbour and socket")
+    perror("state and serves ip, ss and bridge commands over a unix socket.")
+    perror("Commands changing the system state are always run directly.")
+    perror(
+        "Default socket: $%s or $TMPDIR/iproute2mac-UID.sock"
+        % DAEMON_SOCKET_ENV
+    )
+    perror(HELP_ADDENDUM)
+    exit(255)
+
+
+def main(argv):
+    path = daemon_socket_path()
+    ttl = dict(SNAPSHOT_TTL)
+
+    while argv:
+        opt = argv.pop(0)
+        if opt.startswith("--"):
+            opt = opt[1:]
+        try:
+            if strict_startswith("-socket", opt):
+                path = argv.pop(0)
+            elif strict_startswith("-ttl", opt):
+                (obj, seconds) = argv.pop(0).split("=")
+                if obj not in ttl:
+                    raise ValueError
+                ttl[obj] = float(seconds)
+            elif strict_startswith("-Version", opt):
+                print("iproute2mac, v" + VERSION)
+                exit(0)
+            else:
+                do_help()
+        except (IndexError, ValueError):
+            do_help()
+
+    SNAPSHOT_TTL.update(ttl)
+    iproute2mac._daemon_snapshots = {}
+
+    if os.path.exists(path):
+        os.unlink(path)
+    old_umask = os.umask(0o077)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+
+    try:
+        while True:
+            (conn, _) = server.accept()
+            try:
+                handle_connection(conn)
+            except OSError:
+                pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(path)
+    return True
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+
+"""
+  iproute2mac
+  CLI wrapper for basic network utilities on Mac OS X.
+  Homepage: https://github.com/brona/iproute2mac
+
+  The MIT License (MIT)
+  Copyright (c) 2015 Bronislav Robenek <brona@robenek.me>
+"""
+
+import json
+import os
+import sys
+
+from iproute2mac import *
+
+HISTOGRAM_WIDTH = 40
+
+
+def load_trace(paths):
+    """Yields runs recorded by IPROUTE2MAC_TRACE, skipping broken lines"""
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    run = json.loads(line)
+                    if run["cmd"] and run["duration"] >= 0:
+                        yield run
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+
+def run_key(run, by):
+    if by == "cmd":
+        return " ".join([os.path.basename(run["cmd"][0])] + run["cmd"][1:])
+    return os.path.basename(run["cmd"][0])
+
+
+def bucket(duration):
+    """Power of two bucket in microseconds, bucket b holds [2^(b-1), 2^b)"""
+    return int(duration * 1e6).bit_length()
+
+
+def percentile(durations, p):
+    """Nearest-rank percentile of sorted durations"""
+    return durations[max(0, -(-len(durations) * p // 100) - 1)]
+
+
+def aggregate(runs, by):
+    """
+    Returns latency statistics per tool (or per command line with by="cmd")
+    ordered by total time spent, the biggest bottleneck first.
+    """
+    groups = {}
+    for run in runs:
+        groups.setdefault(run_key(run, by), []).append(run)
+
+    result = []
+    for key, group in groups.items():
+        durations = sorted(r["duration"] for r in group)
+        buckets = {}
+        for d in durations:
+            buckets[bucket(d)] = buckets.get(bucket(d), 0) + 1
+        result.append(
+            {
+                by: key,
+                "count": len(group),
+                "errors": sum(1 for r in group if r["returncode"] != 0),
+                "total": round(sum(durations), 6),
+                "p50": percentile(durations, 50),
+                "p90": percentile(durations, 90),
+                "p99": percentile(durations, 99),
+                "max": durations[-1],
+                "stdout_bytes": sum(r.get("stdout_bytes", 0) for r in group),
+                # Including empty buckets between the fastest and slowest
+                "histogram": [
+                    {"le": (1 << b) / 1e6, "count": buckets.get(b, 0)}
+                    for b in range(min(buckets), max(buckets) + 1)
+                ],
+            }
+        )
+    result.sort(key=lambda r: r["total"], reverse=True)
+    return result
+
+
+def format_duration(seconds):
+    if seconds < 1e-3:
+        return "%dus" % round(seconds * 1e6)
+    elif seconds < 1:
+        return "%.1fms" % (seconds * 1e3)
+    return "%.2fs" % seconds
+
+
+def print_stats(stats, by):
+    out = Renderer(None)
+    for s in stats:
+        out.line(
+            "%s: count %d errors %d total %s p50 %s p90 %s p99 %s max %s"
+            % (
+                s[by],
+                s["count"],
+                s["errors"],
+                format_duration(s["total"]),
+                format_duration(s["p50"]),
+                format_duration(s["p90"]),
+                format_duration(s["p99"]),
+                format_duration(s["max"]),
+            )
+        )
+        peak = max(h["count"] for h in s["histogram"])
+        for h in s["histogram"]:
+            bar = "@" * -(-h["count"] * HISTOGRAM_WIDTH // peak)
+            out.line(
+                "    < %-8s %8d |%s|"
+                % (
+                    format_duration(h["le"]),
+                    h["count"],
+                    bar.ljust(HISTOGRAM_WIDTH),
+                )
+            )
+    out.flush()
+
+
+def do_help():
+    perror(
+        "Usage: iproute2mactrace [ -json ] [ -pretty ] [ -by { tool | cmd } ]"
+    )
+    perror("                        [ FILE ]...")
+    perror("")
+    perror("Prints latency histograms of tools run by ip, ss and bridge from")
+    perror("trace files written with %s=FILE, slowest first." % TRACE_ENV)
+    perror("Default FILE: $%s" % TRACE_ENV)
+    perror(HELP_ADDENDUM)
+    exit(255)
+
+
+def main(argv):
+    json_print = False
+    pretty_json = False
+    by = "tool"
+
+    while argv and argv[0].startswith("-"):
+        opt = argv.pop(0)
+        if opt.startswith("--"):
+            opt = opt[1:]
+        try:
+            if strict_startswith("-json", opt):
+                json_print = True
+            elif strict_startswith("-pretty", opt):
+                pretty_json = True
+            elif strict_startswith("-by", opt):
+                by = argv.pop(0)
+                if by not in ("tool", "cmd"):
+                    raise ValueError
+            elif strict_startswith("-Version", opt):
+                print("iproute2mac, v" + VERSION)
+                exit(0)
+            else:
+                do_help()
+        except (IndexError, ValueError):
+            do_help()
+
+    paths = argv or [os.getenv(TRACE_ENV)]
+    if not all(paths):
+        do_help()
+
+    try:
+        stats = aggregate(load_trace(paths), by)
+    except OSError as e:
+        perror(str(e))
+        exit(1)
+
+    if json_print:
+        return json_dump(stats, pretty_json)
+    print_stats(stats, by)
+    return True
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -10,14 +10,15 @@
   Copyright (c) 2015 Bronislav Robenek <brona@robenek.me>
 """
 
-import argparse
-import subprocess
 import sys
+import time
+from functools import partial
+from operator import itemgetter, methodcaller
 
 from iproute2mac import *
 
 
-def parse_netstat(
+def iter_netstat(
     res,
     include_listening=False,
     resolve=False,
@@ -27,9 +28,11 @@ def parse_netstat(
     only_raw=False,
     ipv4_only=False,
     ipv6_only=False,
+    byte_counts=False,
 ):
     """
-    Parse netstat output into structured socket information
+    Parse netstat output into structured socket information, one socket at
+    a time, so aggregations don't need to keep all of them
 
     Args:
         res (str): Output from netstat command
@@ -41,16 +44,12 @@ def parse_netstat(
         only_raw (bool): Show only Raw sockets
         ipv4_only (bool): Show only IPv4 sockets
         ipv6_only (bool): Show only IPv6 sockets
+        byte_counts (bool): Output of netstat -b with rxbytes and txbytes
 
-    Returns:
-        list: List of socket dictionaries
+    Yields:
+        Socket: Parsed socket
     """
-    sockets = []
-
-    # Split by lines and skip header
-    lines = res.strip().split("\n")
-
-    for line in lines:
+    for line in output_lines(res):
         if not line or line.startswith("Active") or line.startswith("Proto"):
             continue
 
@@ -76,6 +75,18 @@ def parse_netstat(
         if ipv6_only and not "6" in proto:
             continue
 
+        # Byte counters follow the state, which UDP sockets don't have
+        counters = None
+        if (
+            byte_counts
+            and proto.startswith(("tcp", "udp"))
+            and len(parts) >= 7
+            and parts[-1].isdigit()
+            and parts[-2].isdigit()
+        ):
+            counters = parts[-2:]
+            del parts[-2:]
+
         # Filter by state (listening or established)
         state = parts[-1] if len(parts) >= 6 else "UNKNOWN"
         if not include_listening and state == "LISTEN":
@@ -98,60 +109,393 @@ def parse_netstat(
         elif state == "CLOSE_WAIT":
             state = "CLOSE-WAIT"
 
-        socket = {
-            "netid": proto,
-            "state": state,
-            "recv_q": parts[1],
-            "send_q": parts[2],
-            "local_addr": local_addr,
-            "local_port": local_port,
-            "peer_addr": peer_addr,
-            "peer_port": peer_port,
-        }
+        # Protocols, states, addresses and well-known ports repeat across
+        # rows, queue sizes are mostly single digits which are shared anyway
+        socket = Socket(
+            sys.intern(proto),
+            sys.intern(state),
+            parts[1],
+            parts[2],
+            sys.intern(local_addr),
+            local_port,
+            sys.intern(peer_addr),
+            sys.intern(peer_port),
+        )
+        if counters is not None:
+            socket.bytes_received = int(counters[0])
+            socket.bytes_sent = int(counters[1])
 
-        sockets.append(socket)
+        yield socket
 
-    return sockets
+
+@without_gc
+def parse_netstat(res, **filters):
+    """
+    Parse netstat output, see iter_netstat for filters
+
+    Returns:
+        list: List of sockets
+    """
+    return list(iter_netstat(res, **filters))
+
+
+# One lsof for all sockets: -F prints a process (pid, command) once followed
+# by its files (fd, IPv4/IPv6, protocol, name), +c 0 keeps whole commands
+LSOF_CMD = [LSOF, "-nP", "-w", "+c", "0", "-i", "-F", "pcftPn"]
+
+
+def lsof_endpoint(name):
+    """Splits lsof address:port, [v6 address]:port, into netstat form"""
+    (addr, _, port) = name.rpartition(":")
+    if addr.startswith("["):
+        addr = addr[1:-1]
+        # The kernel embeds the scope id into link-local addresses, which
+        # netstat shows as %interface instead
+        if addr.startswith("fe80:") and not addr.startswith("fe80::"):
+            import ipaddress
+
+            scoped = int(ipaddress.IPv6Address(addr))
+            addr = str(ipaddress.IPv6Address(scoped & ~(0xFFFF << 96)))
+    return (addr, port)
 
 
-def format_socket_line(socket, color, numeric=False):
+def users_key(netid, local_addr, local_port, peer_addr, peer_port):
     """
-    Format a socket for display
+    Key of the socket user index for a netstat socket, tcp46 sockets are
+    IPv6 for lsof and it doesn't show the scope of addresses
+    """
+    if netid.endswith("46"):
+        netid = netid[:-2] + "6"
+    return (
+        netid,
+        local_addr.split("%")[0],
+        local_port,
+        peer_addr.split("%")[0],
+        peer_port,
+    )
+
+
+@without_gc
+def parse_lsof(res):
+    """
+    Parse lsof -F pcftPn output into an index of processes using sockets
 
     Args:
-        socket (dict): Socket information dictionary
-        color: Color scheme from get_color_scheme
-        numeric (bool): Show numeric values only
+        res (str): Output from lsof command
 
     Returns:
-        str: Formatted line for display
+        dict: users_key of a socket to list of SocketUser
     """
-    netid = socket["netid"]
-    state = socket["state"]
-    recv_q = socket["recv_q"]
-    send_q = socket["send_q"]
-
-    local = f"{socket['local_addr']}:{socket['local_port']}"
-    peer = f"{socket['peer_addr']}:{socket['peer_port']}"
-
-    # Color the output using master branch color scheme
-    state_colored = colorize(
-        color,
-        COLOR_OPERSTATE_UP if state == "ESTAB" else COLOR_OPERSTATE_DOWN,
-        state,
+    # A process, or a file of the last process: fd, IP version, protocol
+    # and name, which lsof prints last
+    fields = regex(
+        r"(?m)^(?:p(\d+)\nc(.*)|f(\d+)\n(?:t\w*(\d)\n)?P(\w+)\nn(.*))$"
     )
-    local_colored = colorize_ifname(color, local)
-    peer_colored = colorize_inet(color, "inet", peer)
+    index = {}
+    pid = command = None
+    for p, c, fd, family, proto, name in fields.findall(res):
+        if p:
+            pid = int(p)
+            command = c
+            continue
+        (local, _, peer) = name.partition("->")
+        key = (
+            proto.lower() + (family or "6"),
+            *lsof_endpoint(local),
+            *(lsof_endpoint(peer) if peer else ("*", "*")),
+        )
+        user = SocketUser(command, pid, int(fd))
+        if key in index:
+            index[key].append(user)
+        else:
+            index[key] = [user]
+    return index
+
+
+def join_users(sockets, index):
+    """
+    Sets users of sockets found in the parse_lsof index in one pass, the
+    lists are shared with the index
+    """
+    for socket in sockets:
+        users = index.get(
+            users_key(
+                socket.netid,
+                socket.local_addr,
+                socket.local_port,
+                socket.peer_addr,
+                socket.peer_port,
+            )
+        )
+        if users:
+            socket.users = users
+
+
+def format_users(users):
+    return "users:(%s)" % ",".join(
+        '("%s",pid=%d,fd=%d)' % (u.command, u.pid, u.fd) for u in users
+    )
+
+
+# --count-by key: (JSON name, header, socket field)
+COUNT_KEYS = {
+    "state": ("state", "State", "state"),
+    "sport": ("sport", "Local Port", "local_port"),
+    "dport": ("dport", "Peer Port", "peer_port"),
+    "peer": ("peer", "Peer Address", "peer_addr"),
+}
+
+
+def peer_prefix_key(bits):
+    """Returns function mapping socket to network of its peer with prefix"""
+    import ipaddress
+
+    # Peers repeat, each is converted once
+    networks = {"*": "*"}
+    bits4 = min(bits, 32)
+    mask4 = (0xFFFFFFFF << (32 - bits4)) & 0xFFFFFFFF
+
+    def key(socket):
+        addr = socket["peer_addr"]
+        try:
+            return networks[addr]
+        except KeyError:
+            pass
+        octets = addr.split(".")
+        if len(octets) == 4 and all(o.isdigit() for o in octets):
+            # IPv4 without ipaddress, which is much slower
+            (a, b, c, d) = map(int, octets)
+            n = ((a << 24) | (b << 16) | (c << 8) | d) & mask4
+            network = "%d.%d.%d.%d/%d" % (
+                n >> 24,
+                n >> 16 & 0xFF,
+                n >> 8 & 0xFF,
+                n & 0xFF,
+                bits4,
+            )
+            networks[addr] = network
+            return network
+        try:
+            ip = ipaddress.ip_address(addr.split("%")[0])
+            network = str(
+                ipaddress.ip_interface(
+                    "%s/%d" % (ip, min(bits, ip.max_prefixlen))
+                ).network
+            )
+        except ValueError:
+            # netstat truncates long addresses
+            network = addr
+        networks[addr] = network
+        return network
+
+    return key
+
+
+def parse_count_by(spec):
+    """
+    Parse --count-by KEY[,KEY...] into [(JSON name, header, function)],
+    None if invalid
+    """
+    keys = []
+    for name in spec.split(","):
+        if name in COUNT_KEYS:
+            (json_name, header, field) = COUNT_KEYS[name]
+            keys.append((json_name, header, itemgetter(field)))
+        elif name.startswith("peer-prefix/") and name[12:].isdigit():
+            bits = int(name[12:])
+            keys.append(("peer_prefix", "Peer Prefix", peer_prefix_key(bits)))
+        else:
+            return None
+    return keys
+
+
+def tally_sockets(sockets, keys, counts=None):
+    """
+    Count sockets by the keys, streaming, only the counters are kept
+
+    Args:
+        sockets (iterable): Sockets, e.g. from iter_netstat
+        keys (list): Keys from parse_count_by
+        counts (dict): Counts to add to, e.g. of other parts of a capture
+
+    Returns:
+        dict: Count per tuple of key values
+    """
+    funcs = [func for _, _, func in keys]
+    if counts is None:
+        counts = {}
+    for socket in sockets:
+        group = tuple(func(socket) for func in funcs)
+        counts[group] = counts.get(group, 0) + 1
+    return counts
+
+
+def largest_counts(counts, top=None):
+    """
+    Args:
+        counts (dict): Count per group from tally_sockets
+        top (int): Return only top K groups
+
+    Returns:
+        list: (count, key values) tuples with the largest counts first
+    """
+    import heapq
+
+    if top is not None:
+        largest = heapq.nlargest(top, counts.items(), key=itemgetter(1))
+    else:
+        largest = sorted(counts.items(), key=itemgetter(1), reverse=True)
+    return [(count, group) for group, count in largest]
+
+
+def count_sockets(sockets, keys, top=None):
+    """Count sockets by the keys, see tally_sockets and largest_counts"""
+    return largest_counts(tally_sockets(sockets, keys), top)
 
-    # Format for display, adjust field spacing
-    return f"{netid}\t{state_colored}\t{recv_q}\t{send_q}\t{local_colored}\t{peer_colored}"
 
+def tally_part(part, spec, filters):
+    """
+    tally_sockets of a part of a capture, run by parallel_map workers,
+    which return only the counts instead of the sockets
+    """
+    return tally_sockets(iter_netstat(part, **filters), parse_count_by(spec))
+
+
+def do_count(counts, keys, args, color_scheme):
+    counts = largest_counts(counts, args.top)
+    profile_mark("count", rows=len(counts))
 
-def print_header():
-    """Print the table header"""
-    print(
-        f"Netid\tState\tRecv-Q\tSend-Q\tLocal Address:Port\tPeer Address:Port"
+    if args.json:
+        return json_dump(
+            [
+                dict([("count", count)] + list(zip((k[0] for k in keys), g)))
+                for count, g in counts
+            ],
+            args.pretty_json,
+        )
+
+    table = AlignedTable(
+        Renderer(color_scheme),
+        ["Count"] + [header for _, header, _ in keys],
+        show_header=not args.no_header,
     )
+    for count, group in counts:
+        table.row([str(count)] + list(group))
+    table.flush()
+    return True
+
+
+SOCKET_HEADER = [
+    "Netid",
+    "State",
+    "Recv-Q",
+    "Send-Q",
+    "Local Address:Port",
+    "Peer Address:Port",
+    "Process",
+]
+
+# Rows measured at a time by AlignedTable, widths only grow afterwards
+ALIGN_WINDOW = 1000
+
+
+class AlignedTable:
+    """
+    Table with columns padded to common widths, written to a Renderer
+    without keeping all rows in memory. Widths are measured on a window of
+    buffered rows and grow when a later window has longer cells, so only
+    rows before a longer cell are narrower. With window None, all rows are
+    measured before writing any.
+
+    Rows have a cell per header column. styles hold a Renderer function
+    (text, ljust) coloring each column, or None for plain text.
+    """
+
+    def __init__(
+        self, out, header, styles=None, show_header=True, window=None
+    ):
+        self.out = out
+        self.header = header if show_header else None
+        self.styles = styles if styles and out.colored else None
+        self.widths = [len(h) if show_header else 0 for h in header]
+        self.window = window
+        self.rows = []
+
+    def row(self, cells, extra=()):
+        """Adds a row of cells followed by unaligned extra lines"""
+        self.rows.append((cells, extra))
+        if self.window is not None and len(self.rows) >= self.window:
+            self.write()
+
+    def write(self):
+        widths = self.widths
+        for i, column in enumerate(zip(*(cells for cells, _ in self.rows))):
+            widths[i] = max(widths[i], max(map(len, column)))
+        # The last column is not padded, nor are trailing empty cells
+        fmt = " ".join(["%%-%ds" % w for w in widths[:-1]] + ["%s"])
+
+        line = self.out.line
+        if self.header is not None:
+            line((fmt % tuple(self.header)).rstrip(" "))
+            self.header = None
+        if self.styles is None:
+            for cells, extra in self.rows:
+                line((fmt % tuple(cells)).rstrip(" "))
+                for text in extra:
+                    line(text)
+        else:
+            # Padding goes after the color escapes, which have no width
+            funcs = [
+                partial(style, ljust=w) if style else methodcaller("ljust", w)
+                for style, w in zip(self.styles, widths[:-1] + [0])
+            ]
+            for cells, extra in self.rows:
+                line(
+                    " ".join([f(c) for f, c in zip(funcs, cells)]).rstrip(" ")
+                )
+                for text in extra:
+                    line(text)
+        self.rows = []
+
+    def flush(self):
+        self.write()
+        self.out.flush()
+
+
+def socket_cells(socket, processes=False):
+    """Table cells of a socket, with users column for processes"""
+    cells = [
+        socket.netid,
+        socket.state,
+        socket.recv_q,
+        socket.send_q,
+        socket.local_addr + ":" + socket.local_port,
+        socket.peer_addr + ":" + socket.peer_port,
+    ]
+    if processes:
+        cells.append(format_users(socket.users) if "users" in socket else "")
+    return cells
+
+
+def socket_styles(out):
+    """AlignedTable styles of socket_cells"""
+
+    def state(text, ljust):
+        return out.color(
+            COLOR_OPERSTATE_UP if text == "ESTAB" else COLOR_OPERSTATE_DOWN,
+            text,
+            ljust,
+        )
+
+    return [
+        None,
+        state,
+        None,
+        None,
+        out.ifname,
+        lambda text, ljust: out.inet("inet", text, ljust),
+        None,
+    ]
 
 
 def do_summary():
@@ -162,29 +506,467 @@ def do_summary():
         bool: Success or failure
     """
     try:
-        res = subprocess.run([NETSTAT, "-s"], capture_output=True, text=True)
+        res = run_cmd([NETSTAT, "-s"])
         if res.returncode != 0:
             perror("Cannot get socket statistics")
             return False
 
         # Just print netstat output for now
-        print(res.stdout, end="")
+        out = Renderer(None)
+        for line in output_lines(res.stdout):
+            out.line(line)
+        out.flush()
         return True
     except Exception as e:
         perror(str(e))
         return False
 
 
-def main(argv):
+def socket_filters(args):
+    """Returns parse_netstat keyword arguments selected by the options"""
+    return {
+        "include_listening": args.all or args.listening,
+        "resolve": args.resolve,
+        "only_tcp": args.tcp,
+        "only_udp": args.udp,
+        "only_unix": args.unix,
+        "only_raw": args.raw,
+        "ipv4_only": args.ipv4,
+        "ipv6_only": args.ipv6,
+    }
+
+
+def socket_key(socket):
+    """Identity of a socket across netstat runs"""
+    return (
+        socket["netid"],
+        socket["local_addr"],
+        socket["local_port"],
+        socket["peer_addr"],
+        socket["peer_port"],
+    )
+
+
+def format_socket_info(socket):
+    """Second line of -i with byte counters, and rates when sampled"""
+    info = []
+    for name in ("bytes_sent", "bytes_received"):
+        if name in socket:
+            info.append("%s:%d" % (name, socket[name]))
+    for name in ("tx_rate", "rx_rate"):
+        if name in socket:
+            info.append("%s:%dB/s" % (name, socket[name]))
+    return "\t " + " ".join(info) if info else None
+
+
+def socket_rate(socket):
+    """Bytes per second in both directions, set by do_throughput"""
+    return socket.rx_rate + socket.tx_rate
+
+
+def do_throughput(args, color_scheme):
     """
-    Main function for ss command
+    Samples byte counters of sockets twice, args.interval seconds apart,
+    and prints the connections with traffic between the samples, the
+    largest consumers first, only args.top of them if set
+
+    Returns:
+        bool: Success or failure
+    """
+    import heapq
+
+    # Both samples are needed, it can't be served by the daemon
+    require_direct()
+    filters = socket_filters(args)
+
+    def sample():
+        res = run_cmd([NETSTAT, "-nab"], fresh=True)
+        profile_mark("collect")
+        if res.returncode != 0:
+            perror((res.stderr + res.stdout).strip())
+        return (res, time.monotonic())
+
+    (res, start) = sample()
+    if res.returncode != 0:
+        return False
+    before = {
+        socket_key(s): (s.bytes_received, s.bytes_sent)
+        for s in iter_netstat(res.stdout, byte_counts=True, **filters)
+        if "bytes_received" in s
+    }
+    profile_mark("parse", rows=len(before), size=len(res.stdout))
+
+    time.sleep(args.interval)
+    profile_mark("sleep")
+    (res, end) = sample()
+    if res.returncode != 0:
+        return False
+    elapsed = end - start
+
+    consumers = []
+    for socket in iter_netstat(res.stdout, byte_counts=True, **filters):
+        old = before.get(socket_key(socket))
+        if old is None or "bytes_received" not in socket:
+            continue
+        socket.rx_rate = int(max(0, socket.bytes_received - old[0]) / elapsed)
+        socket.tx_rate = int(max(0, socket.bytes_sent - old[1]) / elapsed)
+        if socket.rx_rate or socket.tx_rate:
+            consumers.append(socket)
+    profile_mark("parse", rows=len(consumers), size=len(res.stdout))
+
+    if args.top:
+        consumers = heapq.nlargest(args.top, consumers, key=socket_rate)
+    else:
+        consumers.sort(key=socket_rate, reverse=True)
+    if args.processes:
+        try:
+            add_processes(consumers)
+        except IPRoute2MacError as e:
+            perror(str(e))
+    return print_sockets(consumers, args, color_scheme)
+
+
+def add_processes(sockets):
+    """Sets users of sockets from a single lsof run"""
+    try:
+        res = run_cmd(LSOF_CMD)
+    except OSError as e:
+        raise CommandError(
+            LSOF_CMD, "Cannot get process information: " + str(e)
+        ) from None
+    # lsof exits with 1 when it misses some files, the rest is valid
+    profile_mark("collect")
+    join_users(sockets, parse_lsof(res.stdout))
+    profile_mark("parse", size=len(res.stdout))
+
+
+def netstat_cmd(byte_counts=False):
+    """netstat -na, -nab with byte counters"""
+    return [NETSTAT, "-nab" if byte_counts else "-na"]
+
+
+def check_netstat_result(res):
+    """check_result, with the message of ss when netstat prints nothing"""
+    if res.returncode != 0 and not (res.stderr + res.stdout).strip():
+        raise CommandError(res.args, "Cannot get socket information")
+    return check_result(res)
+
+
+def get_netstat(byte_counts=False):
+    """Runs netstat_cmd and returns its output"""
+    res = run_cmd(netstat_cmd(byte_counts))
+    profile_mark("collect")
+    return check_netstat_result(res).stdout
+
+
+def parse_sockets(netstat_out, **filters):
+    """parse_netstat, in parallel_map with -jobs"""
+    if parallel_jobs() is not None:
+        sockets = []
+        for part in parallel_map(
+            partial(parse_netstat, **filters), netstat_out, parallel_jobs()
+        ):
+            sockets += part
+    else:
+        sockets = parse_netstat(netstat_out, **filters)
+    profile_mark("parse", rows=len(sockets), size=len(netstat_out))
+    return sockets
+
+
+# Runs netstat -na and lsof for processes, see sockets() of iproute2mac
+def get_sockets(processes=False, byte_counts=False, **filters):
+    sockets = parse_sockets(
+        get_netstat(byte_counts), byte_counts=byte_counts, **filters
+    )
+    if processes:
+        add_processes(sockets)
+    return sockets
+
+
+# add_processes without blocking, returns the parse_lsof index
+async def get_users_async():
+    import asyncio
+
+    try:
+        (res, _) = await run_cmd_async(LSOF_CMD)
+    except OSError as e:
+        raise CommandError(
+            LSOF_CMD, "Cannot get process information: " + str(e)
+        ) from None
+    # lsof exits with 1 when it misses some files, the rest is valid
+    return await asyncio.to_thread(parse_lsof, res.stdout)
+
+
+# get_sockets without blocking, see sockets_async() of iproute2mac
+async def get_sockets_async(processes=False, byte_counts=False, **filters):
+    import asyncio
+
+    collect = [
+        run_cmd_async(
+            netstat_cmd(byte_counts),
+            partial(parse_netstat, byte_counts=byte_counts, **filters),
+        )
+    ]
+    if processes:
+        collect.append(get_users_async())
+    results = await asyncio.gather(*collect)
+
+    (res, sockets) = results[0]
+    check_netstat_result(res)
+    if processes:
+        join_users(sockets, results[1])
+    return sockets
+
+
+def print_sockets(sockets, args, color_scheme):
+    """Prints sockets as JSON or aligned table with -i and -p details"""
+    if args.json:
+        return json_dump(sockets, args.pretty_json)
+
+    out = Renderer(color_scheme)
+    header = SOCKET_HEADER if args.processes else SOCKET_HEADER[:-1]
+    table = AlignedTable(
+        out,
+        header,
+        socket_styles(out),
+        show_header=not args.no_header,
+        window=None if args.exact_width else ALIGN_WINDOW,
+    )
+    for socket in sockets:
+        info = format_socket_info(socket) if args.info else None
+        table.row(
+            socket_cells(socket, args.processes), (info,) if info else ()
+        )
+    table.flush()
+
+    return True
+
+
+def format_watch_time(t):
+    return time.strftime("%H:%M:%S", time.localtime(t)) + ".%03d" % (
+        t % 1 * 1000
+    )
+
+
+def do_watch(args, color_scheme):
+    """
+    Watch mode, prints sockets opened, closed or changing state since the
+    previous netstat run every args.watch seconds until interrupted.
+
+    Only netstat lines which changed since the previous run are parsed and
+    compared, so the work per tick follows the churn, not the table size.
+
+    Returns:
+        bool: Success or failure
+    """
+    import json
+    from collections import Counter
+
+    require_direct()
+    filters = socket_filters(args)
+    # netstat lines of the previous run as multiset, identical lines like
+    # "udp4 0 0 *.* *.*" are several sockets
+    lines = Counter()
+    # netstat line: parsed socket or None if filtered out
+    parsed_lines = {}
+    # socket key: times sockets with the key were first seen opening
+    opened_at = {}
+    first = True
+
+    out = Renderer(color_scheme)
+    # Columns are aligned over all events, widths grow with later ones
+    table = AlignedTable(
+        out,
+        ["Time", "Event"] + SOCKET_HEADER[:-1] + ["Details"],
+        [None, None] + socket_styles(out)[:-1] + [None],
+        show_header=not args.no_header,
+    )
+    try:
+        while True:
+            res = run_cmd([NETSTAT, "-na"], fresh=True)
+            now = time.time()
+            if res.returncode != 0:
+                perror((res.stderr + res.stdout).strip())
+                return False
+
+            current = Counter(res.stdout.splitlines())
+            added = current - lines
+            removed = lines - current
+            lines = current
+
+            # socket key: sockets closed or opened with the key
+            gone = {}
+            for line, n in removed.items():
+                socket = parsed_lines[line]
+                if line not in current:
+                    del parsed_lines[line]
+                if socket is not None:
+                    gone.setdefault(socket_key(socket), []).extend(
+                        [socket] * n
+                    )
+            appeared = {}
+            for line, n in added.items():
+                if line not in parsed_lines:
+                    parsed = parse_netstat(line, **filters)
+                    parsed_lines[line] = parsed[0] if parsed else None
+                socket = parsed_lines[line]
+                if socket is not None:
+                    appeared.setdefault(socket_key(socket), []).extend(
+                        [socket] * n
+                    )
+
+            events = []
+            if not first:
+                for key, sockets in appeared.items():
+                    olds = gone.get(key, [])
+                    for socket in sockets:
+                        old = olds.pop() if olds else None
+                        if old is None:
+                            events.append((key, "open", socket, {}))
+                            opened_at.setdefault(key, []).append(now)
+                        elif old["state"] != socket["state"]:
+                            events.append(
+                                (key, "state", socket, {"from": old["state"]})
+                            )
+                for key, sockets in gone.items():
+                    for socket in sockets:
+                        extra = {}
+                        if opened_at.get(key):
+                            lifetime = now - opened_at[key].pop(0)
+                            if not opened_at[key]:
+                                del opened_at[key]
+                            if args.lifetime:
+                                extra["lifetime"] = round(lifetime, 3)
+                        events.append((key, "close", socket, extra))
+            first = False
+
+            # Sockets aren't ordered, only keys and events
+            for key, event, socket, extra in sorted(
+                events, key=itemgetter(0, 1)
+            ):
+                if args.json:
+                    entry = {"time": round(now, 3), "event": event}
+                    entry.update(socket.to_json())
+                    entry.update(extra)
+                    out.line(json.dumps(entry, separators=(",", ":")))
+                else:
+                    table.row(
+                        [format_watch_time(now), event]
+                        + socket_cells(socket)
+                        + [" ".join("%s %s" % kv for kv in extra.items())]
+                    )
+            if args.json:
+                out.flush()
+            else:
+                table.flush()
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        if args.json:
+            out.flush()
+        else:
+            table.flush()
+    return True
+
+
+# Boolean options as (flags, dest, help), shared by parse_flags and argparse
+FLAGS = [
+    (("-n", "--numeric"), "numeric", "Do not try to resolve service names."),
+    (("-r", "--resolve"), "resolve", "Try to resolve numeric address/ports."),
+    (
+        ("-a", "--all"),
+        "all",
+        "Display both listening and non-listening sockets.",
+    ),
+    (("-l", "--listening"), "listening", "Display only listening sockets."),
+    (("-p", "--processes"), "processes", "Show process using socket."),
+    (("-i", "--info"), "info", "Show internal TCP information."),
+    (("-s", "--summary"), "summary", "Print summary statistics."),
+    (("-4", "--ipv4"), "ipv4", "Display only IP version 4 sockets."),
+    (("-6", "--ipv6"), "ipv6", "Display only IP version 6 sockets."),
+    (("-t", "--tcp"), "tcp", "Display TCP sockets."),
+    (("-u", "--udp"), "udp", "Display UDP sockets."),
+    (("-w", "--raw"), "raw", "Display RAW sockets."),
+    (("-x", "--unix"), "unix", "Display Unix domain sockets."),
+    (("-H", "--no-header"), "no_header", "Suppress header line."),
+]
+
+# iproute2mac specific boolean options
+IPROUTE2MAC_FLAGS = [
+    (("-j", "--json"), "json", "Output in JSON format (iproute2mac)."),
+    (("--pretty",), "pretty_json", "Pretty-print JSON output (iproute2mac)."),
+    (
+        ("--profile",),
+        "profile",
+        "Print timings as JSON to stderr (iproute2mac).",
+    ),
+    (
+        ("--lifetime",),
+        "lifetime",
+        "Show lifetime of sockets closed while watching (iproute2mac).",
+    ),
+    (
+        ("--exact-width",),
+        "exact_width",
+        "Align columns over all sockets instead of windows of %d "
+        "(iproute2mac)." % ALIGN_WINDOW,
+    ),
+]
+
+# Defaults of options which are not boolean flags
+DEFAULTS = {
+    "color": "never",
+    "watch": None,
+    "count_by": None,
+    "top": None,
+    "interval": None,
+    "input": None,
+    "jobs": None,
+    "filter": [],
+}
+
+
+def parse_flags(argv):
+    """
+    Parse arguments consisting only of boolean flags without argparse,
+    which is the common case and saves importing and building the parser.
 
     Args:
         argv (list): Command line arguments
 
     Returns:
-        bool: Success or failure
+        Namespace with the same attributes as argparse would return,
+        or None if argparse is needed (help, values, errors, abbreviations)
     """
+    import types
+
+    flags = {}
+    for names, dest, _ in FLAGS + IPROUTE2MAC_FLAGS:
+        for name in names:
+            flags[name] = dest
+
+    args = dict(DEFAULTS)
+    args.update({dest: False for dest in flags.values()})
+    for arg in argv:
+        if arg in flags:
+            args[flags[arg]] = True
+        elif (
+            arg.startswith("-")
+            and not arg.startswith("--")
+            and len(arg) > 1
+            and all("-" + c in flags for c in arg[1:])
+        ):
+            # Combined short flags, e.g. -nat
+            for c in arg[1:]:
+                args[flags["-" + c]] = True
+        else:
+            return None
+
+    return types.SimpleNamespace(**args)
+
+
+def build_parser():
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog="ss",
         description="Dump socket statistics (iproute2mac wrapper for netstat on macOS).",
@@ -198,75 +980,8 @@ def main(argv):
         action="version",
         version="iproute2mac, v" + VERSION,
     )
-    parser.add_argument(
-        "-n",
-        "--numeric",
-        action="store_true",
-        help="Do not try to resolve service names.",
-    )
-    parser.add_argument(
-        "-r",
-        "--resolve",
-        action="store_true",
-        help="Try to resolve numeric address/ports.",
-    )
-    parser.add_argument(
-        "-a",
-        "--all",
-        action="store_true",
-        help="Display both listening and non-listening sockets.",
-    )
-    parser.add_argument(
-        "-l",
-        "--listening",
-        action="store_true",
-        help="Display only listening sockets.",
-    )
-    parser.add_argument(
-        "-p",
-        "--processes",
-        action="store_true",
-        help="Show process using socket.",
-    )
-    parser.add_argument(
-        "-s",
-        "--summary",
-        action="store_true",
-        help="Print summary statistics.",
-    )
-    parser.add_argument(
-        "-4",
-        "--ipv4",
-        action="store_true",
-        help="Display only IP version 4 sockets.",
-    )
-    parser.add_argument(
-        "-6",
-        "--ipv6",
-        action="store_true",
-        help="Display only IP version 6 sockets.",
-    )
-    parser.add_argument(
-        "-t", "--tcp", action="store_true", help="Display TCP sockets."
-    )
-    parser.add_argument(
-        "-u", "--udp", action="store_true", help="Display UDP sockets."
-    )
-    parser.add_argument(
-        "-w", "--raw", action="store_true", help="Display RAW sockets."
-    )
-    parser.add_argument(
-        "-x",
-        "--unix",
-        action="store_true",
-        help="Display Unix domain sockets.",
-    )
-    parser.add_argument(
-        "-H",
-        "--no-header",
-        action="store_true",
-        help="Suppress header line.",
-    )
+    for names, dest, help in FLAGS:
+        parser.add_argument(*names, action="store_true", dest=dest, help=help)
 
     # iproute2mac specific options
     parser.add_argument(
@@ -278,17 +993,48 @@ def main(argv):
         default="never",
         help="Colorize output (iproute2mac).",
     )
+    for names, dest, help in IPROUTE2MAC_FLAGS:
+        parser.add_argument(*names, action="store_true", dest=dest, help=help)
+    parser.add_argument(
+        "--count-by",
+        metavar="KEY[,KEY...]",
+        help="Count sockets by state, sport, dport, peer or peer-prefix/N "
+        "instead of listing them (iproute2mac).",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        metavar="K",
+        help="Show only K largest counts of --count-by or consumers of "
+        "--interval (iproute2mac).",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        metavar="SECONDS",
+        help="With -i, sample byte counters again after SECONDS and show "
+        "connections by throughput (iproute2mac).",
+    )
     parser.add_argument(
-        "-j",
-        "--json",
-        action="store_true",
-        help="Output in JSON format (iproute2mac).",
+        "--input",
+        metavar="FILE",
+        help="Parse netstat -na output captured to FILE, - for stdin, "
+        "instead of running netstat (iproute2mac).",
     )
     parser.add_argument(
-        "--pretty",
-        action="store_true",
-        dest="pretty_json",
-        help="Pretty-print JSON output (iproute2mac).",
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="Parse --input FILE in N processes, 0 for one per core "
+        "(iproute2mac).",
+    )
+    parser.add_argument(
+        "-W",
+        "--watch",
+        type=float,
+        metavar="INTERVAL",
+        help="Print opened and closed sockets and state changes every "
+        "INTERVAL seconds, NDJSON with -j (iproute2mac).",
     )
 
     # filter positional arguments if any
@@ -298,7 +1044,41 @@ def main(argv):
         help="FILTER := [ state STATE-FILTER ] [ EXPRESSION ]",
     )
 
-    args = parser.parse_args(argv)
+    return parser
+
+
+def main(argv):
+    """
+    Main function for ss command
+
+    Args:
+        argv (list): Command line arguments
+
+    Returns:
+        bool: Success or failure
+    """
+    args = parse_flags(argv)
+    if args is None:
+        args = build_parser().parse_args(argv)
+
+    if args.profile:
+        profile_enable("ss")
+
+    if args.jobs is not None and (args.input in (None, "-") or args.jobs < 0):
+        perror(
+            'Option "--jobs" requires --input FILE and a non-negative number.'
+        )
+        exit(255)
+    if args.input is not None:
+        if args.watch is not None or args.interval is not None:
+            perror('Option "--input" can\'t be combined with sampling.')
+            exit(255)
+        if args.processes:
+            perror('Option "--input" can\'t be combined with -p.')
+            exit(255)
+        input_enable(args.input)
+    if args.jobs is not None:
+        parallel_enable(args.jobs)
 
     if args.filter:
         perror(
@@ -313,50 +1093,73 @@ def main(argv):
     if args.summary:
         return do_summary()
 
-    # Run netstat with appropriate options
-    cmd = [NETSTAT, "-na"]
+    if args.watch is not None:
+        if args.watch <= 0:
+            perror('Option "--watch" requires a positive number.')
+            exit(255)
+        return do_watch(args, color_scheme)
+
+    count_keys = None
+    if args.count_by is not None:
+        count_keys = parse_count_by(args.count_by)
+        if count_keys is None:
+            perror(
+                'Option "--count-by" requires { %s | peer-prefix/N }[,...].'
+                % " | ".join(COUNT_KEYS)
+            )
+            exit(255)
+    if args.interval is not None and (not args.info or args.interval <= 0):
+        perror('Option "--interval" requires -i and a positive number.')
+        exit(255)
+    if args.top is not None and (
+        (count_keys is None and args.interval is None) or args.top < 1
+    ):
+        perror(
+            'Option "--top" requires --count-by or --interval and a positive'
+            " integer."
+        )
+        exit(255)
+    if args.interval is not None:
+        return do_throughput(args, color_scheme)
 
     # Execute command
     try:
-        res = subprocess.run(cmd, capture_output=True, text=True)
-        if res.returncode != 0:
-            out = (res.stderr + res.stdout).strip()
-            if out == "":
-                perror("Cannot get socket information")
-            else:
-                perror(out)
-            return False
-        netstat_out = res.stdout
+        netstat_out = get_netstat(args.info)
     except Exception as e:
         perror(str(e))
         return False
 
-    # Parse socket info
-    sockets = parse_netstat(
-        netstat_out,
-        include_listening=args.all or args.listening,
-        resolve=args.resolve,
-        only_tcp=args.tcp,
-        only_udp=args.udp,
-        only_unix=args.unix,
-        only_raw=args.raw,
-        ipv4_only=args.ipv4,
-        ipv6_only=args.ipv6,
-    )
-
-    # JSON output
-    if args.json:
-        return json_dump(sockets, args.pretty_json)
+    filters = dict(socket_filters(args), byte_counts=args.info)
+    if count_keys:
+        if parallel_jobs() is not None:
+            # Workers count their parts, the counts are added up here
+            counts = {}
+            for part in parallel_map(
+                partial(tally_part, spec=args.count_by, filters=filters),
+                netstat_out,
+                parallel_jobs(),
+            ):
+                for group, count in part.items():
+                    counts[group] = counts.get(group, 0) + count
+        else:
+            counts = tally_sockets(
+                iter_netstat(netstat_out, **filters), count_keys
+            )
+        return do_count(counts, count_keys, args, color_scheme)
 
-    # Display results as table
-    if not args.no_header:
-        print_header()
+    # Parse socket info
+    sockets = parse_sockets(netstat_out, **filters)
 
-    for socket in sockets:
-        print(format_socket_line(socket, color_scheme, numeric=args.numeric))
+    if args.processes:
+        try:
+            add_processes(sockets)
+        except IPRoute2MacError as e:
+            perror(str(e))
 
-    return True
+    return print_sockets(sockets, args, color_scheme)
 
 
 if __name__ == "__main__":
+    profile_from_env("ss")
+    daemon_forward("ss", sys.argv[1:])
     main(sys.argv[1:])
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+
+"""
+  iproute2mac benchmark
+  Measures parsers and renderers of ip, ss and bridge on output of macOS
+  tools with the requested number of rows, either recorded fixtures scaled
+  by repetition or synthetic output of generate.py. No macOS tool is run,
+  so it works on Linux as well.
+
+  Writes one JSON object per command and size (JSON Lines) with seconds
+  spent in each phase and peak memory of the whole command:
+    parse   parser on the tool output
+    filter  selector of the command applied to the parsed records
+    json    JSON serialization of the parsed records
+    text    whole command with text output, including parse
+    peak    peak traced memory of the whole command in bytes
+
+  Results of two runs can be compared with -compare OLD NEW.
+"""
+
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+rundir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(rundir, "..", "src"))
+
+import generate  # noqa: E402
+
+import bridge  # noqa: E402
+import ip  # noqa: E402
+import ss  # noqa: E402
+from iproute2mac import (  # noqa: E402
+    ARP,
+    IFCONFIG,
+    LSOF,
+    NDP,
+    VERSION,
+    json_default,
+    perror,
+)
+
+FIXTURES = os.path.join(rundir, "fixtures")
+SIZES = [10, 100, 1000, 10000, 100000, 1000000]
+# Interfaces are blocks of many lines, larger sizes don't fit in memory
+MAX_INTERFACES = 100000
+# Each phase is repeated until it runs at least this long
+MIN_DURATION = 0.2
+CORPORA = ["recorded", "synthetic"]
+
+# fixture: generator of synthetic output with the same format
+SYNTHETIC = {
+    "ifconfig.txt": lambda rows, version: generate.ifconfig(
+        rows, bridges=rows // 10
+    ),
+    "netstat_ibdn.txt": lambda rows, version: generate.netstat_ibdn(rows),
+    "netstat_nr_inet.txt": lambda rows, version: generate.netstat_nr(
+        rows, "inet", version
+    ),
+    "netstat_nr_inet6.txt": lambda rows, version: generate.netstat_nr(
+        rows, "inet6", version
+    ),
+    "arp_anl.txt": lambda rows, version: generate.arp_anl(rows),
+    "ndp_an.txt": lambda rows, version: generate.ndp_an(rows),
+    "netstat_na.txt": lambda rows, version: generate.netstat_na(rows),
+    "netstat_nab.txt": lambda rows, version: generate.netstat_na(
+        rows, byte_counts=True
+    ),
+    "lsof_i.txt": lambda rows, version: generate.lsof_i(rows),
+}
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+def scale_table(text, rows, header, keep=lambda line: True):
+    """Repeats data rows of table output after header lines to rows count"""
+    lines = text.split("\n")
+    data = [l for l in lines[header:] if l.strip() and keep(l)]
+    body = [data[i % len(data)] for i in range(rows)]
+    return "\n".join(lines[:header] + body) + "\n"
+
+
+def scale_ifconfig(text, rows):
+    """Repeats interface blocks with unique names and indexes"""
+    blocks = []
+    for line in text.split("\n"):
+        if line and not line[0].isspace():
+            blocks.append([])
+        if line:
+            blocks[-1].append(line)
+
+    out = []
+    for i in range(rows):
+        block = blocks[i % len(blocks)]
+        (name, rest) = block[0].split(":", 1)
+        rest = rest[: rest.rindex("index")] + "index %d" % (i + 1)
+        name = name.rstrip("0123456789") + str(i)
+        out.append("%s:%s" % (name, rest))
+        out.extend(block[1:])
+    return "\n".join(out) + "\n"
+
+
+def is_inet_socket(line):
+    return line.startswith(("tcp", "udp"))
+
+
+def parse_sockets_users(t):
+    sockets = ss.parse_netstat(t["-na"], include_listening=True)
+    ss.join_users(sockets, ss.parse_lsof(t[LSOF]))
+    return sockets
+
+
+# name: (tool outputs by command word, scale, parse, filter, argv)
+COMMANDS = {
+    "ip link": (
+        {IFCONFIG: ("ifconfig.txt", scale_ifconfig)},
+        lambda t: ip.parse_ifconfig(t[IFCONFIG], -1, False),
+        lambda links: [l for l in links if "UP" in l["flags"]],
+        (ip, ["link", "show"]),
+    ),
+    "ip addr": (
+        {IFCONFIG: ("ifconfig.txt", scale_ifconfig)},
+        lambda t: ip.parse_ifconfig(t[IFCONFIG], -1, True),
+        lambda links: [l for l in links if l.get("addr_info")],
+        (ip, ["addr", "show"]),
+    ),
+    "ip -s link": (
+        {
+            IFCONFIG: ("ifconfig.txt", scale_ifconfig),
+            "-ibdn": (
+                "netstat_ibdn.txt",
+                lambda text, rows: scale_table(text, rows, 1),
+            ),
+        },
+        lambda t: ip.parse_netstat_ib(t["-ibdn"]),
+        lambda stats: {k: v for k, v in stats.items() if v["rx"]["bytes"]},
+        (ip, ["-s", "link", "show"]),
+    ),
+    "ip route": (
+        {
+            "inet": (
+                "netstat_nr_inet.txt",
+                lambda text, rows: scale_table(text, rows, 4),
+            )
+        },
+        lambda t: ip.parse_netstat_nr(t["inet"], 4),
+        lambda routes: [r for r in routes if r["dst"] == "default"],
+        (ip, ["route", "show"]),
+    ),
+    "ip -6 route": (
+        {
+            "inet6": (
+                "netstat_nr_inet6.txt",
+                lambda text, rows: scale_table(text, rows, 4),
+            )
+        },
+        lambda t: ip.parse_netstat_nr(t["inet6"], 6),
+        lambda routes: [r for r in routes if r["dst"] == "default"],
+        (ip, ["-6", "route", "show"]),
+    ),
+    "ip -4 neigh": (
+        {ARP: ("arp_anl.txt", lambda text, rows: scale_table(text, rows, 1))},
+        lambda t: ip.parse_arp(t[ARP]),
+        lambda neighs: [n for n in neighs if n["dev"] == "en0"],
+        (ip, ["-4", "neigh", "show"]),
+    ),
+    "ip -6 neigh": (
+        {NDP: ("ndp_an.txt", lambda text, rows: scale_table(text, rows, 1))},
+        lambda t: ip.parse_ndp(t[NDP]),
+        lambda neighs: [n for n in neighs if n["dev"] == "en0"],
+        (ip, ["-6", "neigh", "show"]),
+    ),
+    "ss -a": (
+        {
+            "-na": (
+                "netstat_na.txt",
+                lambda text, rows: scale_table(
+                    text, rows, 2, keep=is_inet_socket
+                ),
+            )
+        },
+        lambda t: ss.parse_netstat(t["-na"], include_listening=True),
+        # ss applies its filters while parsing
+        None,
+        (ss, ["-a"]),
+    ),
+    "ss -t4": (
+        {
+            "-na": (
+                "netstat_na.txt",
+                lambda text, rows: scale_table(
+                    text, rows, 2, keep=is_inet_socket
+                ),
+            )
+        },
+        lambda t: ss.parse_netstat(t["-na"], only_tcp=True, ipv4_only=True),
+        None,
+        (ss, ["-t4"]),
+    ),
+    "ss -ai": (
+        {
+            "-nab": (
+                "netstat_nab.txt",
+                lambda text, rows: scale_table(
+                    text, rows, 2, keep=is_inet_socket
+                ),
+            )
+        },
+        lambda t: ss.parse_netstat(
+            t["-nab"], include_listening=True, byte_counts=True
+        ),
+        None,
+        (ss, ["-ai"]),
+    ),
+    "ss -ap": (
+        {
+            "-na": (
+                "netstat_na.txt",
+                lambda text, rows: scale_table(
+                    text, rows, 2, keep=is_inet_socket
+                ),
+            ),
+            # Repeated sockets have the same users, lsof lists them once
+            LSOF: ("lsof_i.txt", lambda text, rows: text),
+        },
+        parse_sockets_users,
+        None,
+        (ss, ["-ap"]),
+    ),
+    "bridge link": (
+        {IFCONFIG: ("ifconfig.txt", scale_ifconfig)},
+        lambda t: bridge.parse_ifconfig(t[IFCONFIG]),
+        lambda links: [l for l in links if "bridge" in l],
+        (bridge, ["link", "show"]),
+    ),
+}
+
+
+def fake_run_cmd(outputs):
+    def run_cmd(cmd, check=False, fresh=False):
+        for word, text in outputs.items():
+            if word in cmd:
+                return subprocess.CompletedProcess(cmd, 0, text, "")
+        raise RuntimeError("No fixture for: " + " ".join(cmd))
+
+    return run_cmd
+
+
+def measure(func):
+    """Returns median duration of func in seconds and its last result"""
+    durations = []
+    total = 0
+    while total < MIN_DURATION or len(durations) < 3:
+        start = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - start)
+        total += durations[-1]
+        if len(durations) >= 100:
+            break
+    return statistics.median(durations), result
+
+
+def run_command(module, argv):
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        module.main(list(argv))
+
+
+def bench(name, rows, corpus="recorded", version=generate.DEFAULT_VERSION):
+    (tools, parse, filter_func, (module, argv)) = COMMANDS[name]
+    if tools.get(IFCONFIG):
+        rows = min(rows, MAX_INTERFACES)
+    if corpus == "synthetic":
+        outputs = {
+            word: SYNTHETIC[file](rows, version)
+            for word, (file, _) in tools.items()
+        }
+    else:
+        outputs = {
+            word: scale(fixture(file), rows)
+            for word, (file, scale) in tools.items()
+        }
+
+    result = {
+        "command": name,
+        "rows": rows,
+        "corpus": corpus,
+        "bytes": sum(len(t) for t in outputs.values()),
+        "version": VERSION,
+    }
+    (result["parse"], parsed) = measure(lambda: parse(outputs))
+    if filter_func:
+        (result["filter"], _) = measure(lambda: filter_func(parsed))
+    (result["json"], _) = measure(
+        lambda: json.dumps(parsed, separators=(",", ":"), default=json_default)
+    )
+
+    saved = module.run_cmd
+    module.run_cmd = fake_run_cmd(outputs)
+    try:
+        (result["text"], _) = measure(lambda: run_command(module, argv))
+        tracemalloc.start()
+        run_command(module, argv)
+        result["peak"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        module.run_cmd = saved
+    return result
+
+
+def compare(old_path, new_path):
+    def load(path):
+        with open(path) as f:
+            return {
+                (r["command"], r["rows"]): r for r in map(json.loads, f) if r
+            }
+
+    old = load(old_path)
+    new = load(new_path)
+    phases = ["parse", "filter", "json", "text", "peak"]
+    print(
+        "%-14s %8s " % ("command", "rows")
+        + " ".join(p.rjust(8) for p in phases)
+    )
+    for key in sorted(old.keys() & new.keys()):
+        ratios = []
+        for p in phases:
+            if p in old[key] and p in new[key] and old[key][p]:
+                ratios.append("%7.2fx" % (new[key][p] / old[key][p]))
+            else:
+                ratios.append("-".rjust(8))
+        print("%-14s %8d " % key + " ".join(ratios))
+
+
+def do_help():
+    perror(
+        "Usage: benchmark.py [ -sizes N[,N...] ] [ -commands NAME[,NAME...] ]"
+    )
+    perror(
+        "                    [ -corpus CORPUS ] [ -macos VERSION ] [ -o FILE ]"
+    )
+    perror("       benchmark.py -compare OLD NEW")
+    perror("where  NAME := { %s }" % " | ".join(COMMANDS))
+    perror("       CORPUS := { %s }" % " | ".join(CORPORA))
+    perror("       VERSION := { %s }" % " | ".join(generate.VERSIONS))
+    exit(255)
+
+
+def main(argv):
+    sizes = SIZES
+    commands = list(COMMANDS)
+    output = sys.stdout
+    corpus = CORPORA[0]
+    version = generate.DEFAULT_VERSION
+
+    try:
+        while argv:
+            opt = argv.pop(0)
+            if opt == "-sizes":
+                sizes = [int(n) for n in argv.pop(0).split(",")]
+            elif opt == "-commands":
+                commands = argv.pop(0).split(",")
+                if not set(commands) <= set(COMMANDS):
+                    do_help()
+            elif opt == "-corpus":
+                corpus = argv.pop(0)
+                if corpus not in CORPORA:
+                    do_help()
+            elif opt == "-macos":
+                version = argv.pop(0)
+                if version not in generate.VERSIONS:
+                    do_help()
+            elif opt == "-o":
+                output = open(argv.pop(0), "w")
+            elif opt == "-compare":
+                return compare(argv.pop(0), argv.pop(0))
+            else:
+                do_help()
+    except (IndexError, ValueError):
+        do_help()
+
+    for name in commands:
+        for rows in sizes:
+            result = bench(name, rows, corpus, version)
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+    return True
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -6,6 +6,8 @@ rundir=$(cd -P -- "$(dirname -- "$0")" && printf '%s\n' "$(pwd -P)")
 ip_cmd="$rundir"/../src/ip.py
 bridge_cmd="$rundir"/../src/bridge.py
 ss_cmd="$rundir"/../src/ss.py
+daemon_cmd="$rundir"/../src/iproute2macd.py
+trace_cmd="$rundir"/../src/iproute2mactrace.py
 ip_prefix=192.0.2
 ip_dest=$ip_prefix.99/32
 ip_via=$ip_prefix.98
@@ -50,6 +52,15 @@ $ss_cmd -h | grep -i "Usage: ss "
 ! $bridge_cmd -N link sh
 ! $ss_cmd -X socket sh
 
+# import time budget, modules not needed by every command are imported lazily
+
+for mod in ip ss bridge; do
+    imports=$(cd "$rundir"/../src && python3 -X importtime -c "import $mod" 2>&1)
+    test -z "$(echo "$imports" | grep -E '\| +(argparse|ipaddress|json|random|re|socket|subprocess)$')"
+    # cumulative import time of the module in microseconds
+    echo "$imports" | tail -1 | awk -F'|' '{ exit ($2 > 50000) }'
+done
+
 # route
 
 ! $ip_cmd route help
@@ -205,6 +216,20 @@ $ip_cmd -j link show | tee | perl -MJSON -e 'decode_json(<STDIN>)'
 
 $ip_cmd -j -p link show dev lo0 | grep '"link_type": "loopback"'
 
+$ip_cmd -s link show dev lo0 | grep "RX:"
+
+$ip_cmd -s -s link show
+
+$ip_cmd -j -s link show dev lo0 | grep '"stats64"'
+
+$ip_cmd -s -interval 0.2 -count 2 link show dev lo0 | grep "bytes/s"
+
+$ip_cmd -j -s -interval 0.2 -count 1 link show lo0 | grep '"rate64"'
+
+! $ip_cmd -interval 1 link show
+
+! $ip_cmd -s -interval 1 route show
+
 $ip_cmd li sho | grep mtu
 
 $ip_cmd li ls | grep mtu
@@ -287,10 +312,191 @@ $ss_cmd -x
 
 $ss_cmd -j -p | grep '"netid"'
 
+$ss_cmd -ap | grep '^Netid.*Process$'
+
+$ss_cmd -ta | grep '^Netid  *State  *Recv-Q  *Send-Q  *Local Address:Port  *Peer Address:Port$'
+
+$ss_cmd -ta --exact-width | grep '^Netid  *State'
+
+$ss_cmd -tai | grep 'bytes_received:'
+
+$ss_cmd -ti --interval 1 --top 5 -j | perl -MJSON -e 'decode_json(<STDIN>)'
+
+! $ss_cmd --interval 1
+
 $ss_cmd -nat
 
 $ss_cmd --unix
 
 ! $ss_cmd asdf
 
+$ss_cmd -tan --count-by state | grep '^Count'
+
+$ss_cmd -tn --count-by dport,peer-prefix/24 --top 3 -j | perl -MJSON -e 'decode_json(<STDIN>)'
+
+! $ss_cmd --count-by asdf
+
+! $ss_cmd --top 3
+
+watch_file=$(mktemp)
+$ss_cmd -tn -j -W 0.2 --lifetime > "$watch_file" &
+watch_pid=$!
+sleep 1
+curl -s -o /dev/null https://github.com || true
+sleep 1
+kill $watch_pid
+perl -MJSON -ne 'decode_json($_)' "$watch_file"
+rm "$watch_file"
+
+# cache
+
+IPROUTE2MAC_CACHE=5 $ip_cmd addr show dev lo0 | grep '127.0.0.1'
+
+IPROUTE2MAC_CACHE=5 $ip_cmd addr show dev lo0 | grep '127.0.0.1'
+
+IPROUTE2MAC_CACHE=5 IPROUTE2MAC_CONSISTENCY=hard $ip_cmd -j route show | perl -MJSON -e 'decode_json(<STDIN>)'
+
+IPROUTE2MAC_CACHE=5 $ip_cmd route add $ip_dest via $ip_via
+IPROUTE2MAC_CACHE=5 $ip_cmd route show | grep "$ip_prefix.99"
+IPROUTE2MAC_CACHE=5 $ip_cmd route delete $ip_dest via $ip_via
+! IPROUTE2MAC_CACHE=5 $ip_cmd route show | grep "$ip_prefix.99"
+
+# profile
+
+$ip_cmd -profile link show 2>&1 >/dev/null | perl -MJSON -e 'decode_json(<STDIN>)'
+$ss_cmd --profile -t 2>&1 >/dev/null | perl -MJSON -e 'decode_json(<STDIN>)'
+$bridge_cmd -profile link show 2>&1 >/dev/null | perl -MJSON -e 'decode_json(<STDIN>)'
+profile_file=$(mktemp)
+IPROUTE2MAC_PROFILE="$profile_file" $ip_cmd route show
+grep '"phase": "parse"' "$profile_file"
+rm "$profile_file"
+
+# trace
+
+trace_file=$(mktemp)
+IPROUTE2MAC_TRACE="$trace_file" $ip_cmd addr show
+IPROUTE2MAC_TRACE="$trace_file" $ss_cmd -t
+$trace_cmd "$trace_file" | grep '^ifconfig: count 1 '
+$trace_cmd -j -by cmd "$trace_file" | perl -MJSON -e 'decode_json(<STDIN>)'
+rm "$trace_file"
+
+# record and replay
+
+record_dir=$(mktemp -d)
+IPROUTE2MAC_BACKEND=record:"$record_dir" $ip_cmd -j addr show > "$record_dir"/live.json
+IPROUTE2MAC_BACKEND=replay:"$record_dir" $ip_cmd -j addr show > "$record_dir"/replay.json
+cmp "$record_dir"/live.json "$record_dir"/replay.json
+! IPROUTE2MAC_BACKEND=replay:"$record_dir" $ip_cmd route show
+rm -r "$record_dir"
+
+# offline input
+
+fixtures="$rundir"/fixtures
+$ss_cmd -ta --input "$fixtures"/netstat_na.txt | grep '^tcp46 *LISTEN'
+$ss_cmd -tan --count-by state --input - < "$fixtures"/netstat_na.txt | grep ESTAB
+$ip_cmd -input "$fixtures"/netstat_nr_inet.txt route show | grep '^default via 192.168.1.1'
+$ss_cmd -ta --input "$fixtures"/netstat_na.txt --jobs 2 | grep '^tcp46 *LISTEN'
+$ss_cmd -tan --count-by state --input "$fixtures"/netstat_na.txt --jobs 0 | grep ESTAB
+$ip_cmd -input "$fixtures"/netstat_nr_inet.txt -jobs 2 route show | grep '^default via 192.168.1.1'
+! $ss_cmd -ta --input - --jobs 2 < "$fixtures"/netstat_na.txt
+$ip_cmd -6 -j -input "$fixtures"/netstat_nr_inet6.txt route show | perl -MJSON -e 'decode_json(<STDIN>)'
+$ip_cmd -input "$fixtures"/route_get.txt route get 8.8.8.8 | grep '^8.8.8.8 via 192.168.1.1 dev en0'
+$ip_cmd -4 -input "$fixtures"/arp_anl.txt neigh show dev en0
+$ip_cmd -6 -input - neigh show < "$fixtures"/ndp_an.txt
+$ip_cmd -input "$fixtures"/ifconfig.txt link show en0 | grep '^6: en0'
+$ip_cmd -br -input "$fixtures"/ifconfig.txt addr show
+$bridge_cmd -input "$fixtures"/ifconfig.txt link show | grep 'master bridge0'
+! $ip_cmd -input "$fixtures"/ndp_an.txt neigh show
+! $ip_cmd -input "$fixtures"/ifconfig.txt link set en0 down
+
+# dry run
+
+$ip_cmd -dry-run link set en0 down mtu 1500 | grep 'ifconfig en0 down mtu 1500$'
+$ip_cmd -dry-run link set dev en0 mtu 1500 address random up | grep 'ifconfig en0 mtu 1500 lladdr .* up$'
+! $ip_cmd -dry-run link set en0 mtu big
+! $ip_cmd -dry-run link set en0 promisc on
+! $ip_cmd -d link set en0 up
+! $ip_cmd -dry-run route flush table main | grep Flushing
+! $ip_cmd -dry-run -input "$fixtures"/ifconfig.txt link set 'en*' up
+! $ip_cmd -dry-run -input "$fixtures"/ifconfig.txt link set en0 address factory
+! $ip_cmd -dry-run link set 'lo*' dev en0 address 00:11:22:33:44:55
+test "$($ip_cmd -dry-run link set dev lo0 dev en0 dev lo0 up | wc -l)" -eq 2
+$ip_cmd -dry-run link set 'lo*' up | grep 'ifconfig lo0 up$'
+! $ip_cmd -dry-run link set 'nonexistent*' up
+$ip_cmd -dry-run link set en0 address factory | grep 'ifconfig en0 lladdr ..:'
+$ip_cmd -dry-run link set en0 address factory | grep 'ifconfig en0 lladdr ..:'
+
+# snapshot
+
+snapshot_file=$(mktemp)
+$ip_cmd snapshot save "$snapshot_file"
+$ip_cmd snapshot save | perl -MJSON -e 'decode_json(<STDIN>)'
+$ip_cmd snapshot diff "$snapshot_file" "$snapshot_file"
+$ip_cmd -j snapshot diff "$snapshot_file" | perl -MJSON -e 'decode_json(<STDIN>)'
+! $ip_cmd snapshot diff /nonexistent.json
+rm -f "$snapshot_file"
+
+# library API
+
+PYTHONPATH="$rundir"/../src python3 -c 'import iproute2mac; assert iproute2mac.links(); assert iproute2mac.routes(); iproute2mac.sockets(only_tcp=True)'
+PYTHONPATH="$rundir"/../src python3 -c 'import iproute2mac; iproute2mac.addresses("lo0", af=4); iproute2mac.neighbours(); iproute2mac.bridge_links()'
+! PYTHONPATH="$rundir"/../src python3 -c 'import iproute2mac; iproute2mac.links("nonexistent0")'
+PYTHONPATH="$rundir"/../src python3 - <<'EOF'
+import asyncio
+
+import iproute2mac
+
+
+async def main():
+    return await asyncio.wait_for(
+        asyncio.gather(
+            iproute2mac.links_async(stats=True),
+            iproute2mac.routes_async(timeout=10),
+            iproute2mac.neighbours_async(),
+            iproute2mac.sockets_async(processes=True),
+        ),
+        30,
+    )
+
+
+r = asyncio.run(main())
+assert r[0] and r[1]
+EOF
+PYTHONPATH="$rundir"/../src python3 - <<'EOF'
+import asyncio
+
+import iproute2mac
+
+try:
+    asyncio.run(iproute2mac.links_async("nonexistent0"))
+except iproute2mac.NotFoundError:
+    pass
+else:
+    raise AssertionError("nonexistent0 was found")
+EOF
+
+# daemon
+
+daemon_sock=$(mktemp -u)
+$daemon_cmd -socket "$daemon_sock" &
+daemon_pid=$!
+sleep 1
+
+IPROUTE2MAC_SOCKET="$daemon_sock" $ip_cmd -j addr show | perl -MJSON -e 'decode_json(<STDIN>)'
+
+IPROUTE2MAC_SOCKET="$daemon_sock" $ip_cmd -j route show | perl -MJSON -e 'decode_json(<STDIN>)'
+
+IPROUTE2MAC_SOCKET="$daemon_sock" $ss_cmd -tn
+
+IPROUTE2MAC_SOCKET="$daemon_sock" $bridge_cmd link show
+
+! IPROUTE2MAC_SOCKET="$daemon_sock" $ip_cmd help
+
+IPROUTE2MAC_SOCKET="$daemon_sock" $ip_cmd route add $ip_dest via $ip_via
+IPROUTE2MAC_SOCKET="$daemon_sock" $ip_cmd route show | grep "$ip_prefix.99"
+IPROUTE2MAC_SOCKET="$daemon_sock" $ip_cmd route delete $ip_dest via $ip_via
+
+kill $daemon_pid
+IPROUTE2MAC_SOCKET="$daemon_sock" $ip_cmd link show lo0
+
 echo "Tests passed!!"
@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+
+
+"""
+  iproute2mac fixture generator
+  Emits synthetic output of macOS networking tools in the formats parsed by
+  ip.py, ss.py and bridge.py, at arbitrary scale and without macOS.
+
+  Output is deterministic for the same arguments and seed. Column widths
+  follow the printf formats of the macOS tools, including truncation of
+  long addresses by netstat.
+
+  Versions:
+    mojave    netstat -nr with Refs and Use columns (macOS 10.14 and older)
+    catalina  netstat -nr without Refs and Use columns (macOS 10.15 and newer)
+"""
+
+import random
+import sys
+
+VERSIONS = ["mojave", "catalina"]
+DEFAULT_VERSION = "catalina"
+
+TCP_STATES = [
+    "ESTABLISHED",
+    "ESTABLISHED",
+    "ESTABLISHED",
+    "LISTEN",
+    "TIME_WAIT",
+    "CLOSE_WAIT",
+    "FIN_WAIT_2",
+    "SYN_SENT",
+]
+ND_STATES = ["R", "R", "S", "D", "P", "I", "N", "W"]
+
+
+def mac(rnd, compact=False):
+    """arp and ndp print octets without leading zeros, ifconfig with them"""
+    octets = [0xA4, 0x83, 0xE7] + [rnd.randrange(256) for _ in range(3)]
+    return ":".join(("%x" if compact else "%02x") % o for o in octets)
+
+
+def inet(i):
+    return "10.%d.%d.%d" % ((i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF)
+
+
+def inet6(i):
+    """Unique canonical address, all groups nonzero so none is compressed"""
+    return "2001:db8:%x:%x::1" % (0x100 + i // 0xF000, 0x1000 + i % 0xF000)
+
+
+def ifconfig(interfaces=8, addresses=2, bridges=0, seed=0):
+    """
+    ifconfig -v -a, lo0 first followed by ethernet interfaces, point-to-point
+    tunnels and bridges. Each non-loopback interface gets the given number
+    of addresses, alternating IPv4 and IPv6 after a link-local one.
+    """
+    rnd = random.Random(seed)
+    lines = [
+        "lo0: flags=8049<UP,LOOPBACK,RUNNING,MULTICAST> mtu 16384 index 1",
+        "\teflags=12000000<ECN_ENABLE,SENDLIST_ENABLE>",
+        "\toptions=1203<RXCSUM,TXCSUM,TXSTATUS,SW_TIMESTAMP>",
+        "\tinet 127.0.0.1 netmask 0xff000000",
+        "\tinet6 ::1 prefixlen 128",
+        "\tinet6 fe80::1%lo0 prefixlen 64 scopeid 0x1",
+        "\tnd6 options=201<PERFORMNUD,DAD>",
+        "\tlink quality: 100 (good)",
+        "\tstate availability: 0 (true)",
+    ]
+
+    ethers = []
+    for n in range(1, interfaces):
+        index = n + 1
+        if n > interfaces - 1 - bridges:
+            name = "bridge%d" % (n - (interfaces - 1 - bridges) - 1)
+            kind = "bridge"
+        elif n % 10 == 9:
+            name = "utun%d" % (n // 10)
+            kind = "utun"
+        else:
+            name = "en%d" % (n - 1 - n // 10)
+            kind = "ether"
+            ethers.append((name, index))
+
+        if kind == "utun":
+            lines.append(
+                "%s: flags=8051<UP,POINTOPOINT,RUNNING,MULTICAST>"
+                " mtu 1380 index %d" % (name, index)
+            )
+        else:
+            lines.append(
+                "%s: flags=8863<UP,BROADCAST,SMART,RUNNING,SIMPLEX,MULTICAST>"
+                " mtu 1500 index %d" % (name, index)
+            )
+            lines.append("\teflags=1000080<TXSTART>")
+            lines.append(
+                "\toptions=6463<RXCSUM,TXCSUM,TSO4,TSO6,CHANNEL_IO,"
+                "PARTIAL_CSUM,ZEROINVERT_CSUM>"
+            )
+            lines.append("\tether %s" % mac(rnd))
+
+        for a in range(addresses):
+            addr = n * addresses + a
+            if kind == "utun":
+                lines.append(
+                    "\tinet %s --> %s netmask 0xffffffff"
+                    % (inet(addr * 2), inet(addr * 2 + 1))
+                )
+            elif a == 0:
+                lines.append(
+                    "\tinet6 fe80::%x:%x%%%s prefixlen 64 secured scopeid 0x%x"
+                    % (
+                        rnd.randrange(0xFFFF),
+                        rnd.randrange(0xFFFF),
+                        name,
+                        index,
+                    )
+                )
+            elif a % 2:
+                lines.append(
+                    "\tinet %s netmask 0xffffff00 broadcast %s"
+                    % (inet(addr), inet(addr | 0xFF))
+                )
+            else:
+                lines.append(
+                    "\tinet6 %s prefixlen 64 autoconf secured" % inet6(addr)
+                )
+
+        if kind == "bridge":
+            lines.extend(
+                [
+                    "\tConfiguration:",
+                    "\t\tid 0:0:0:0:0:0 priority 0 hellotime 0 fwddelay 0",
+                    "\t\tmaxage 0 holdcnt 0 proto stp maxaddr 100 timeout 1200",
+                    "\t\troot id 0:0:0:0:0:0 priority 0 ifcost 0 port 0",
+                    "\t\tipfilter disabled flags 0x0",
+                ]
+            )
+            for member, member_index in ethers[-2:]:
+                lines.append(
+                    "\tmember: %s flags=3<LEARNING,DISCOVER>" % member
+                )
+                lines.append(
+                    "\t        ifmaxaddr 0 port %d priority 0 path cost 0"
+                    % member_index
+                )
+        if kind != "utun":
+            lines.append("\tnd6 options=201<PERFORMNUD,DAD>")
+            lines.append("\tmedia: autoselect")
+            lines.append(
+                "\tstatus: %s"
+                % ("active" if rnd.random() < 0.7 else "inactive")
+            )
+    return "\n".join(lines) + "\n"
+
+
+def netstat_ibdn(interfaces=8, seed=0):
+    """netstat -ibdn, one link row and one address row per interface"""
+    rnd = random.Random(seed)
+    row = "%-10.10s %5s %-13.13s %-17.17s %8s %5s %10s %8s %5s %10s %5s %4s"
+    lines = [
+        row
+        % (
+            "Name",
+            "Mtu",
+            "Network",
+            "Address",
+            "Ipkts",
+            "Ierrs",
+            "Ibytes",
+            "Opkts",
+            "Oerrs",
+            "Obytes",
+            "Coll",
+            "Drop",
+        )
+    ]
+    for n in range(interfaces):
+        name = "lo0" if n == 0 else "en%d" % (n - 1)
+        ipkts = rnd.randrange(10**7)
+        opkts = rnd.randrange(10**7)
+        counters = [
+            ipkts,
+            rnd.randrange(10),
+            ipkts * rnd.randrange(60, 1500),
+            opkts,
+            rnd.randrange(10),
+            opkts * rnd.randrange(60, 1500),
+            0,
+            rnd.randrange(100),
+        ]
+        address = "" if n == 0 else mac(rnd)
+        mtu = 16384 if n == 0 else 1500
+        lines.append(
+            row % tuple([name, mtu, "<Link#%d>" % (n + 1), address] + counters)
+        )
+        network = "127" if n == 0 else "10.%d" % n
+        local = "127.0.0.1" if n == 0 else inet(n)
+        lines.append(
+            row
+            % tuple(
+                [name, mtu, network, local]
+                + [counters[0], "-", counters[2], counters[3], "-"]
+                + [counters[5], "-", "-"]
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+def netstat_na(sockets=100, unix=0, byte_counts=False, seed=0):
+    """
+    netstat -na, internet sockets followed by unix domain sockets, with
+    rxbytes and txbytes columns of netstat -nab if byte_counts
+    """
+    rnd = random.Random(seed)
+    lines = [
+        "Active Internet connections (including servers)",
+        "%-5.5s %6.6s %6.6s  %-22.22s %-22.22s %s"
+        % (
+            "Proto",
+            "Recv-Q",
+            "Send-Q",
+            "Local Address",
+            "Foreign Address",
+            "(state)",
+        )
+        + (" %10.10s %10.10s" % ("rxbytes", "txbytes") if byte_counts else ""),
+    ]
+    for i in range(sockets):
+        v6 = rnd.random() < 0.3
+        udp = rnd.random() < 0.15
+        proto = ("udp" if udp else "tcp") + ("6" if v6 else "4")
+        state = "" if udp else rnd.choice(TCP_STATES)
+        if state == "LISTEN" or (udp and rnd.random() < 0.5):
+            if not v6 and rnd.random() < 0.5:
+                proto = proto[:3] + "46"
+            local = "*.%d" % rnd.randrange(1, 1024)
+            peer = "*.*"
+        else:
+            addr = inet6 if v6 else inet
+            local = "%s.%d" % (addr(rnd.randrange(1 << 16)), 49152 + i % 16384)
+            peer = "%s.%d" % (addr(i), rnd.choice([443, 80, 22, 5223, 8080]))
+        lines.append(
+            "%-5.5s %6u %6u  %-22.22s %-22.22s %-11s"
+            % (
+                proto,
+                rnd.choice([0, 0, 0, rnd.randrange(65536)]),
+                rnd.choice([0, 0, 0, rnd.randrange(65536)]),
+                local,
+                peer,
+                state,
+            )
+        )
+        if byte_counts:
+            lines[-1] += " %10u %10u" % (
+                rnd.randrange(1 << 32),
+                rnd.randrange(1 << 28),
+            )
+
+    if unix:
+        lines.append("Active LOCAL (UNIX) domain sockets")
+        lines.append(
+            "%-16.16s %-6.6s %6.6s %6.6s %16.16s %16.16s %16.16s %16.16s Addr"
+            % (
+                "Address",
+                "Type",
+                "Recv-Q",
+                "Send-Q",
+                "Inode",
+                "Conn",
+                "Refs",
+                "Nextref",
+            )
+        )
+        for i in range(unix):
+            lines.append(
+                "%016x %-6.6s %6u %6u %16x %16x %16x %16x%s"
+                % (
+                    rnd.getrandbits(64),
+                    rnd.choice(["stream", "dgram"]),
+                    0,
+                    0,
+                    0,
+                    rnd.getrandbits(64),
+                    0,
+                    0,
+                    " /var/run/sock%d" % i if i % 3 == 0 else "",
+                )
+            )
+    return "\n".join(lines) + "\n"
+
+
+def lsof_name(endpoint):
+    """netstat address.port as lsof address:port, IPv6 in brackets"""
+    (addr, port) = endpoint.rsplit(".", 1)
+    return ("[%s]:%s" if ":" in addr else "%s:%s") % (addr, port)
+
+
+def lsof_i(sockets=100, seed=0):
+    """
+    lsof -nP -i -F pcftPn, processes owning the internet sockets of
+    netstat_na with the same arguments
+    """
+    rnd = random.Random(seed)
+    commands = ["rapportd", "mDNSResponder", "Google Chrome Helper", "sshd"]
+    lines = []
+    pid = 100
+    fd = 0
+    for line in netstat_na(sockets, seed=seed).split("\n")[2:]:
+        if not line:
+            continue
+        (proto, _, _, local, peer) = line.split()[:5]
+        if fd == 0 or rnd.random() < 0.2:
+            pid += rnd.randrange(1, 50)
+            fd = 3
+            lines += ["p%d" % pid, "c" + rnd.choice(commands)]
+        family = (
+            "4" if proto.endswith("4") and not proto.endswith("46") else "6"
+        )
+        name = lsof_name(local)
+        if peer != "*.*":
+            name += "->" + lsof_name(peer)
+        lines += [
+            "f%d" % fd,
+            "tIPv" + family,
+            "P" + proto[:3].upper(),
+            "n" + name,
+        ]
+        fd += 1
+    return "\n".join(lines) + "\n"
+
+
+def netstat_nr(routes=20, family="inet", version=DEFAULT_VERSION, seed=0):
+    """netstat -nr -f inet|inet6, in the column layout of the version"""
+    if version not in VERSIONS:
+        raise ValueError("Unknown version: " + version)
+    rnd = random.Random(seed)
+    v6 = family == "inet6"
+    width = 39 if v6 else 18
+    mojave = version == "mojave"
+
+    def row(dst, gw, flags, dev, expire=""):
+        if mojave:
+            return "%-*.*s %-*.*s %-10.10s %6d %8d %6.6s %6s" % (
+                width,
+                width,
+                dst,
+                width,
+                width,
+                gw,
+                flags,
+                rnd.randrange(200),
+                rnd.randrange(10**6),
+                dev,
+                expire,
+            )
+        return "%-*.*s %-*.*s %-10.10s %15.15s %6s" % (
+            width,
+            width,
+            dst,
+            width,
+            width,
+            gw,
+            flags,
+            dev,
+            expire,
+        )
+
+    lines = ["Routing tables", "", "Internet6:" if v6 else "Internet:"]
+    if mojave:
+        lines.append(
+            "%-*s %-*s %-10s %6s %8s %6s %s"
+            % (
+                width,
+                "Destination",
+                width,
+                "Gateway",
+                "Flags",
+                "Refs",
+                "Use",
+                "Netif",
+                "Expire",
+            )
+        )
+    else:
+        lines.append(
+            "%-*s %-*s %-10s %15s %s"
+            % (
+                width,
+                "Destination",
+                width,
+                "Gateway",
+                "Flags",
+                "Netif",
+                "Expire",
+            )
+        )
+
+    for i in range(routes):
+        dev = "en%d" % (i % 4)
+        kind = i % 5
+        if i == 0:
+            lines.append(
+                row(
+                    "default",
+                    "fe80::1%en0" if v6 else "10.0.0.1",
+                    "UGScg",
+                    dev,
+                )
+            )
+        elif v6:
+            prefix = "2001:db8:%x::/64" % (0x100 + i)
+            if kind == 0:
+                lines.append(row(prefix, "link#%d" % (i % 4 + 4), "UC", dev))
+            elif kind == 1:
+                lines.append(
+                    row(
+                        "fe80::%%%s/64" % dev,
+                        "link#%d" % (i % 4 + 4),
+                        "UCI",
+                        dev,
+                    )
+                )
+            elif kind == 2:
+                lines.append(
+                    row(
+                        inet6(i),
+                        mac(rnd),
+                        "UHLWIi",
+                        dev,
+                        "%d" % rnd.randrange(1200),
+                    )
+                )
+            elif kind == 3:
+                lines.append(row(prefix, "::1", "UGSB", "lo0"))
+            else:
+                lines.append(row(prefix, "fe80::1%%%s" % dev, "UGSc", dev))
+        else:
+            if kind == 0:
+                lines.append(
+                    row(
+                        "10.%d.%d" % (i >> 8 & 0xFF, i & 0xFF),
+                        "link#%d" % (i % 4 + 4),
+                        "UCS",
+                        dev,
+                        "!",
+                    )
+                )
+            elif kind == 1:
+                lines.append(
+                    row(inet(i), mac(rnd, compact=True), "UHLWIi", dev, "1180")
+                )
+            elif kind == 2:
+                lines.append(row(inet(i) + "/32", "127.0.0.1", "UGSB", "lo0"))
+            elif kind == 3:
+                lines.append(
+                    row("172.%d/16" % (16 + i % 16), "10.0.0.1", "UGSc", dev)
+                )
+            else:
+                lines.append(
+                    row(
+                        "192.168.%d" % (i & 0xFF),
+                        "10.0.0.%d" % (1 + i % 250),
+                        "UGSc",
+                        dev,
+                    )
+                )
+    return "\n".join(lines) + "\n"
+
+
+def arp_anl(neighbours=20, seed=0):
+    """arp -anl"""
+    rnd = random.Random(seed)
+    row = "%-23.23s %-17.17s %-9.9s %-9.9s %8.8s %4s %4s"
+    lines = [
+        row
+        % (
+            "Neighbor",
+            "Linklayer Address",
+            "Expire(O)",
+            "Expire(I)",
+            "Netif",
+            "Refs",
+            "Prbs",
+        )
+    ]
+    for i in range(neighbours):
+        incomplete = rnd.random() < 0.1
+        expire = (
+            "expired"
+            if incomplete
+            else "%dm%ds"
+            % (
+                rnd.randrange(20),
+                rnd.randrange(60),
+            )
+        )
+        lines.append(
+            row
+            % (
+                inet(i),
+                "(incomplete)" if incomplete else mac(rnd, compact=True),
+                expire,
+                expire,
+                "en%d" % (i % 4),
+                1,
+                "",
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+def ndp_an(neighbours=20, seed=0):
+    """ndp -an"""
+    rnd = random.Random(seed)
+    row = "%-31.31s %-17.17s %6.6s %-9.9s %2s %4s %4s"
+    lines = [
+        row
+        % (
+            "Neighbor",
+            "Linklayer Address",
+            "Netif",
+            "Expire",
+            "St",
+            "Flgs",
+            "Prbs",
+        )
+    ]
+    for i in range(neighbours):
+        dev = "en%d" % (i % 4)
+        state = rnd.choice(ND_STATES)
+        incomplete = state in ("I", "N", "W")
+        lines.append(
+            row
+            % (
+                ("fe80::%x%%%s" % (i + 1, dev) if i % 2 else inet6(i)),
+                "(incomplete)" if incomplete else mac(rnd, compact=True),
+                dev,
+                "permanent" if state == "R" else "%ds" % rnd.randrange(86400),
+                state,
+                "R" if i % 7 == 0 else "",
+                "",
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+def route_get(target="8.8.8.8", gateway="10.0.0.1", interface="en0"):
+    """route -n get TARGET"""
+    lines = [
+        "   route to: %s" % target,
+        "destination: default",
+        "       mask: default",
+    ]
+    if gateway:
+        lines.append("    gateway: %s" % gateway)
+    lines.extend(
+        [
+            "  interface: %s" % interface,
+            "      flags: <UP,GATEWAY,DONE,STATIC,PRCLONING,GLOBAL>",
+            " recvpipe  sendpipe  ssthresh  rtt,msec    rttvar  hopcount"
+            "      mtu     expire",
+            "       0         0         0         0         0         0"
+            "      1500         0 ",
+        ]
+    )
+    return "\n".join(lines) + "\n"
+
+
+# name: (generator, {option: type})
+GENERATORS = {
+    "ifconfig": (
+        ifconfig,
+        {"interfaces": int, "addresses": int, "bridges": int, "seed": int},
+    ),
+    "netstat-ibdn": (netstat_ibdn, {"interfaces": int, "seed": int}),
+    "netstat-na": (
+        netstat_na,
+        {"sockets": int, "unix": int, "byte_counts": int, "seed": int},
+    ),
+    "lsof": (lsof_i, {"sockets": int, "seed": int}),
+    "netstat-nr": (
+        netstat_nr,
+        {"routes": int, "family": str, "version": str, "seed": int},
+    ),
+    "arp": (arp_anl, {"neighbours": int, "seed": int}),
+    "ndp": (ndp_an, {"neighbours": int, "seed": int}),
+    "route-get": (
+        route_get,
+        {"target": str, "gateway": str, "interface": str},
+    ),
+}
+
+
+def do_help():
+    sys.stderr.write("Usage: generate.py TOOL [ -OPTION VALUE ]...\n")
+    for name, (_, options) in GENERATORS.items():
+        sys.stderr.write(
+            "       generate.py %s %s\n"
+            % (name, " ".join("[ -%s VALUE ]" % o for o in options))
+        )
+    sys.stderr.write("where  VERSION := { %s }\n" % " | ".join(VERSIONS))
+    exit(255)
+
+
+def main(argv):
+    if not argv or argv[0] not in GENERATORS:
+        do_help()
+    (func, options) = GENERATORS[argv.pop(0)]
+    kwargs = {}
+    try:
+        while argv:
+            opt = argv.pop(0).lstrip("-")
+            if opt not in options:
+                do_help()
+            kwargs[opt] = options[opt](argv.pop(0))
+        sys.stdout.write(func(**kwargs))
+    except (IndexError, ValueError):
+        do_help()
+    return True
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])